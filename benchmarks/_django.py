@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Standalone Django configuration for the benchmarks.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import django
+from django.conf import settings
+
+
+def setup(database=":memory:", **extra_settings):
+    """
+    Configures Django with the plans application and a SQLite database,
+    stored in the given file or in memory.
+    """
+    if not settings.configured:
+        settings.configure(
+            DATABASES={
+                'default': {
+                    'ENGINE': 'django.db.backends.sqlite3',
+                    'NAME': database,
+                    # Wait for the locks of concurrent processes
+                    'OPTIONS': {'timeout': 60},
+                }
+            },
+            INSTALLED_APPS=(
+                'django.contrib.auth',
+                'django.contrib.contenttypes',
+                'django_countries',
+                'plans',
+            ),
+            TEMPLATES=[{
+                'BACKEND': 'django.template.backends.django.DjangoTemplates',
+                'APP_DIRS': True,
+            }],
+            SECRET_KEY='this-is-just-for-benchmarks',
+            **extra_settings
+        )
+        django.setup()
+
+
+def migrate(target=None):
+    """
+    Migrates the database, up to the given migration of plans if any.
+    """
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+    if target:
+        call_command('migrate', 'plans', target, verbosity=0)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Time feature checks: following the user's vault, running subscription and
+plan entitlements with queries, against has_entitlement().
+
+    python benchmarks/bench_entitlements.py [users] [checks]
+
+The first has_entitlement() call of each user loads its entitlements, the
+following ones are served from process memory without any query.
+"""
+from __future__ import print_function
+
+import random
+import sys
+import timeit
+
+import _django
+
+_django.setup()
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+
+from plans.entitlements import has_entitlement
+from plans.models import Entitlement, Plan, Subscription
+
+FEATURES = ("export", "api", "projects")
+
+
+def seed(count):
+    now = "2020-03-01 00:00:00"
+    plans = [Plan.objects.create(name=name, plan_id=name, price=price)
+             for name, price in (("basic", "9.90"), ("pro", "19.90"))]
+    Entitlement.objects.create(plan=plans[0], feature="projects", limit=3)
+    Entitlement.objects.create(plan=plans[1], feature="projects", limit=30)
+    Entitlement.objects.create(plan=plans[1], feature="export")
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO auth_user (id, password, is_superuser, username, "
+            "first_name, last_name, email, is_staff, is_active, date_joined) "
+            "VALUES (%s, '', 0, %s, '', '', '', 0, 1, %s)",
+            [(i, "user%s" % i, now) for i in range(1, count + 1)])
+        cursor.executemany(
+            "INSERT INTO plans_uservault (id, user_id, vault_id, token, "
+            "created, modified) VALUES (%s, %s, %s, '', %s, %s)",
+            [(i, i, "v%s" % i, now, now) for i in range(1, count + 1)])
+        cursor.executemany(
+            "INSERT INTO plans_subscription (id, subscription_id, "
+            "user_vault_id, plan_id, status, start_date, next_billing_date, "
+            "created, modified) VALUES (%s, %s, %s, %s, 'active', "
+            "'2020-02-01', '2020-04-01', %s, %s)",
+            [(i, "s%s" % i, i, plans[i % 2].pk, now, now)
+             for i in range(1, count + 1)])
+
+
+def with_queries(user, feature):
+    subscription = Subscription.objects.running().filter(
+        user_vault__user=user).select_related('plan').first()
+    if subscription is None:
+        return False
+    return subscription.plan.entitlements.filter(feature=feature).exists()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    checks = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    _django.migrate()
+    seed(count)
+    users = list(User.objects.all())
+    rng = random.Random(0)
+    calls = [(rng.choice(users), rng.choice(FEATURES))
+             for _ in range(checks)]
+    slow = calls[:checks // 100]
+    query_time = timeit.timeit(
+        lambda: [with_queries(user, feature) for user, feature in slow],
+        number=1) / len(slow)
+    for user in users:
+        has_entitlement(user, "export")
+    memory_time = timeit.timeit(
+        lambda: [has_entitlement(user, feature) for user, feature in calls],
+        number=1) / len(calls)
+    print("%s users, %s checks" % (count, checks))
+    print("queries         %8.2f us/check" % (query_time * 1e6))
+    print("has_entitlement %8.2f us/check" % (memory_time * 1e6))
+
+
+if __name__ == '__main__':
+    main()
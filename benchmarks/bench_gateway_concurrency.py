@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measure the throughput of gateway calls against the concurrency, using the
+in-process DummyGateway with a simulated network latency.
+
+    python benchmarks/bench_gateway_concurrency.py [calls] [latency in ms]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.conf import settings
+
+settings.configure()
+
+from plans.gateway.concurrency import ConcurrentGateway
+from plans.gateway.dummy import DummyGateway
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.02
+    gateway = DummyGateway(latency=latency)
+    calls = [(None, "9.90", {"vault_id": "v%s" % i}) for i in range(count)]
+    print("%s charges, %.0fms latency" % (count, latency * 1000))
+    for concurrency in (1, 2, 4, 8, 16, 32):
+        with ConcurrentGateway(gateway, concurrency) as concurrent_gateway:
+            start = time.time()
+            results = concurrent_gateway.map("charge", calls)
+            elapsed = time.time() - start
+        assert all(result.ok for result in results)
+        print("concurrency %2s  %7.3fs  %8.1f calls/s" % (
+            concurrency, elapsed, count / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Time the month-end invoicing: creating the invoices of the payments, then
+rendering them to a directory, one HTML file per invoice.
+
+    python benchmarks/bench_invoices.py [payments] [batch size]
+
+The peak resident memory is reported, as it should not grow with the number
+of invoices.
+"""
+from __future__ import print_function
+
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from datetime import date
+
+import _django
+
+directory = tempfile.mkdtemp()
+_django.setup(os.path.join(directory, "invoices.sqlite3"))
+
+from django.db import connection, transaction
+
+from plans.invoicing import create_invoices, write_invoices
+from plans.models import Invoice
+
+COUNTRIES = ["FR", "DE", "IT", "US", "GB", "ES"]
+
+
+def seed(count):
+    now = "2020-03-01 00:00:00"
+    users = max(count // 4, 1)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO auth_user (id, password, is_superuser, username, "
+            "first_name, last_name, email, is_staff, is_active, date_joined) "
+            "VALUES (%s, '', 0, %s, '', '', '', 0, 1, %s)",
+            [(i, "user%s" % i, now) for i in range(1, users + 1)])
+        cursor.executemany(
+            "INSERT INTO plans_billinginfo (id, user_id, tax_number, name, "
+            "street, zipcode, city, country, shipping_name, shipping_street, "
+            "shipping_zipcode, shipping_city, created, modified) VALUES "
+            "(%s, %s, %s, %s, '1 Main St', '1000', 'City', %s, '', '', '', "
+            "'', %s, %s)",
+            [(i, i, "DE123456789" if i % 3 == 0 else "", "Customer %s" % i,
+              COUNTRIES[i % len(COUNTRIES)], now, now)
+             for i in range(1, users + 1)])
+        cursor.executemany(
+            "INSERT INTO plans_uservault (id, user_id, vault_id, token, "
+            "created, modified) VALUES (%s, %s, %s, '', %s, %s)",
+            [(i, i, "v%s" % i, now, now) for i in range(1, users + 1)])
+        cursor.executemany(
+            "INSERT INTO plans_paymentlog (id, vault_id, transaction_id, "
+            "status, amount, currency, created, modified) VALUES "
+            "(%s, %s, %s, 'succeeded', 9.90, 'EUR', %s, %s)",
+            [(i, (i - 1) % users + 1, "tx%s" % i, now, now)
+             for i in range(1, count + 1)])
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    _django.migrate()
+    seed(count)
+    issued = date(2020, 3, 31)
+    try:
+        start = time.time()
+        created = create_invoices(issued=issued, batch_size=batch_size)
+        create_time = time.time() - start
+        output = os.path.join(directory, "invoices")
+        os.mkdir(output)
+        start = time.time()
+        written = write_invoices(Invoice.objects.all(), output)
+        render_time = time.time() - start
+    finally:
+        shutil.rmtree(directory)
+    assert created == written == count
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    print("%s invoices, batches of %s" % (count, batch_size))
+    print("create  %7.2fs  %8.0f invoices/s" % (create_time,
+                                                 count / create_time))
+    print("render  %7.2fs  %8.0f invoices/s" % (render_time,
+                                                 count / render_time))
+    print("200k invoices in %.1f minutes, peak memory %.0f MB" % (
+        200000 * (create_time + render_time) / count / 60, peak))
+
+
+if __name__ == '__main__':
+    main()
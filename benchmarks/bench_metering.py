@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Time the recording of usage events, one row written per event against the
+buffered counters of plans.metering, then the usage lookup of a billing
+run.
+
+    python benchmarks/bench_metering.py [subscriptions] [events]
+
+Events are spread over the subscriptions and two metrics. The buffer is
+flushed by size (USAGE_BUFFER_SIZE), so the database is written once per
+buffered counter instead of once per event.
+"""
+from __future__ import print_function
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import _django
+
+directory = tempfile.mkdtemp()
+_django.setup(os.path.join(directory, "metering.sqlite3"),
+              PLANS={"USAGE_BUFFER_SIZE": 1000,
+                     "USAGE_FLUSH_INTERVAL": 3600})
+
+from django.db import connection, transaction
+from django.db.models import F
+
+from plans.metering import UsageBuffer, usage_charges, usage_period
+from plans.models import Plan, Subscription, UsageRate, UsageRecord
+
+
+METRICS = ("api_calls", "storage")
+
+
+def seed(count):
+    now = "2020-03-01 00:00:00"
+    plan = Plan.objects.create(name="Metered", plan_id="metered",
+                               price="9.90")
+    UsageRate.objects.create(plan=plan, metric="api_calls",
+                             unit_price="0.0010")
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO auth_user (id, password, is_superuser, username, "
+            "first_name, last_name, email, is_staff, is_active, date_joined) "
+            "VALUES (%s, '', 0, %s, '', '', '', 0, 1, %s)",
+            [(i, "user%s" % i, now) for i in range(1, count + 1)])
+        cursor.executemany(
+            "INSERT INTO plans_uservault (id, user_id, vault_id, token, "
+            "created, modified) VALUES (%s, %s, %s, '', %s, %s)",
+            [(i, i, "v%s" % i, now, now) for i in range(1, count + 1)])
+        cursor.executemany(
+            "INSERT INTO plans_subscription (id, subscription_id, "
+            "user_vault_id, plan_id, status, start_date, next_billing_date, "
+            "created, modified) VALUES (%s, %s, %s, %s, 'active', "
+            "'2020-02-01', '2020-04-01', %s, %s)",
+            [(i, "s%s" % i, i, plan.pk, now, now)
+             for i in range(1, count + 1)])
+
+
+def per_event(events):
+    # The naive recording: one upsert per event, in its own transaction
+    for subscription, metric in events:
+        period_start = usage_period(subscription.start_date,
+                                    subscription.next_billing_date)
+        with transaction.atomic():
+            updated = UsageRecord.objects.filter(
+                subscription=subscription, metric=metric,
+                period_start=period_start,
+            ).update(quantity=F('quantity') + 1)
+            if not updated:
+                UsageRecord.objects.create(
+                    subscription=subscription, metric=metric,
+                    period_start=period_start, quantity=1)
+
+
+def buffered(events):
+    usage_buffer = UsageBuffer()
+    for subscription, metric in events:
+        usage_buffer.add(subscription, metric)
+    usage_buffer.flush()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    event_count = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    _django.migrate()
+    seed(count)
+    subscriptions = list(Subscription.objects.all())
+    rng = random.Random(0)
+    events = [(rng.choice(subscriptions), rng.choice(METRICS))
+              for _ in range(event_count)]
+    try:
+        start = time.time()
+        per_event(events)
+        naive_time = time.time() - start
+        UsageRecord.objects.all().delete()
+        start = time.time()
+        buffered(events)
+        buffered_time = time.time() - start
+        total = sum(UsageRecord.objects.values_list('quantity', flat=True))
+        assert total == event_count
+        start = time.time()
+        charges = {}
+        # By chunks of a billing run
+        for chunk in range(0, count, 500):
+            charges.update(usage_charges(subscriptions[chunk:chunk + 500]))
+        charges_time = time.time() - start
+        assert charges
+    finally:
+        shutil.rmtree(directory)
+    print("%s events on %s subscriptions" % (event_count, count))
+    print("per event %7.2fs  %8.0f events/s" % (naive_time,
+                                                event_count / naive_time))
+    print("buffered  %7.2fs  %8.0f events/s" % (buffered_time,
+                                                event_count / buffered_time))
+    print("usage charges of all subscriptions %.2fs" % charges_time)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Time a repricing campaign: moving all the subscribers of a plan to another
+one, recording the prorated differences as adjustments.
+
+    python benchmarks/bench_reprice.py [subscriptions] [chunk size]
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from datetime import date
+
+import _django
+
+directory = tempfile.mkdtemp()
+_django.setup(os.path.join(directory, "reprice.sqlite3"))
+
+from django.db import connection, transaction
+
+from plans.models import PaymentLog, Plan, Subscription
+from plans.proration import reprice
+
+
+def seed(count):
+    now = "2020-03-01 00:00:00"
+    old = Plan.objects.create(name="Old", plan_id="old", price="9.90")
+    new = Plan.objects.create(name="New", plan_id="new", price="11.90")
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO auth_user (id, password, is_superuser, username, "
+            "first_name, last_name, email, is_staff, is_active, date_joined) "
+            "VALUES (%s, '', 0, %s, '', '', '', 0, 1, %s)",
+            [(i, "user%s" % i, now) for i in range(1, count + 1)])
+        cursor.executemany(
+            "INSERT INTO plans_uservault (id, user_id, vault_id, token, "
+            "created, modified) VALUES (%s, %s, %s, '', %s, %s)",
+            [(i, i, "v%s" % i, now, now) for i in range(1, count + 1)])
+        cursor.executemany(
+            "INSERT INTO plans_subscription (id, subscription_id, "
+            "user_vault_id, plan_id, status, start_date, next_billing_date, "
+            "created, modified) VALUES (%s, %s, %s, %s, 'active', "
+            "'2020-01-01', %s, %s, %s)",
+            [(i, "s%s" % i, i, old.pk, "2020-03-%02d" % (i % 28 + 1), now,
+              now) for i in range(1, count + 1)])
+    return old, new
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    _django.migrate()
+    old, new = seed(count)
+    try:
+        start = time.time()
+        repricing = reprice(old, new, date(2020, 2, 20),
+                            chunk_size=chunk_size)
+        elapsed = time.time() - start
+        assert repricing.moved == count
+        assert PaymentLog.objects.count() == repricing.adjustments == count
+        assert not Subscription.objects.filter(plan=old).exists()
+    finally:
+        shutil.rmtree(directory)
+    print("%s subscriptions, chunks of %s" % (count, chunk_size))
+    print("reprice %7.2fs  %8.0f subscriptions/s" % (elapsed,
+                                                     count / elapsed))
+    print("400k subscriptions in %.1f minutes" % (
+        400000 * elapsed / count / 60))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Run the billing of due subscriptions with 1, 2 and 4 worker processes
+sharing a SQLite database file, and check that every subscription is charged
+exactly once.
+
+    python benchmarks/bench_sharded_billing.py [subscriptions] [latency in ms]
+
+Charges go through the DummyGateway, whose latency stands for the round trip
+to the payment processor.
+"""
+from __future__ import print_function
+
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from datetime import date
+
+import _django
+
+_django.setup(os.path.join(tempfile.mkdtemp(), "billing.sqlite3"))
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+
+from plans.billing import BillingRun
+from plans.gateway.dummy import DummyGateway
+from plans.models import PaymentLog, Plan, Subscription, UserVault
+
+TODAY = date(2020, 3, 10)
+
+
+def seed(count):
+    plan = Plan.objects.create(name="Basic", plan_id="basic", price="9.90")
+    with transaction.atomic():
+        User.objects.bulk_create([User(username="user%s" % i)
+                                  for i in range(count)])
+        users = User.objects.order_by('pk')
+        UserVault.objects.bulk_create([
+            UserVault(user=user, vault_id="v%s" % user.pk)
+            for user in users])
+        Subscription.objects.bulk_create([
+            Subscription(subscription_id="s%s" % vault.pk, user_vault=vault,
+                         plan=plan, status=Subscription.ACTIVE,
+                         next_billing_date=TODAY)
+            for vault in UserVault.objects.order_by('pk')])
+
+
+def reset():
+    PaymentLog.objects.all().delete()
+    Subscription.objects.update(next_billing_date=TODAY, lease_owner=None,
+                                lease_expires=None)
+
+
+def work(worker_id, latency, results):
+    # Each process opens its own connection
+    connection.close()
+    run = BillingRun(TODAY, DummyGateway(latency=latency), chunk_size=50,
+                     concurrency=1, worker_id=worker_id).run()
+    results.put(run.charged)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.005
+    _django.migrate()
+    seed(count)
+    print("%s subscriptions, %.0fms gateway latency" % (count,
+                                                        latency * 1000))
+    reference = None
+    for workers in (1, 2, 4):
+        reset()
+        connection.close()
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=work,
+                                    args=("w%s" % i, latency, results))
+            for i in range(workers)]
+        start = time.time()
+        for process in processes:
+            process.start()
+        charged = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        elapsed = time.time() - start
+
+        logs = PaymentLog.objects.filter(status=PaymentLog.SUCCEEDED)
+        assert sum(charged) == count, charged
+        assert logs.count() == count
+        assert logs.values('idempotency_key').distinct().count() == count
+        assert not Subscription.objects.filter(
+            next_billing_date__lte=TODAY).exists()
+        reference = reference or elapsed
+        print("%s workers  %7.2fs  %7.1f charges/s  speedup %.2f  %s" % (
+            workers, elapsed, count / elapsed, reference / elapsed, charged))
+
+
+if __name__ == '__main__':
+    main()
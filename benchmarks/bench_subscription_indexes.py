@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Query plans and timings of the hot subscription queries, before and after
+the subscription indexes migration (plans 0002).
+
+    python benchmarks/bench_subscription_indexes.py [subscriptions] [db file]
+
+The table is seeded with ten subscriptions per vault, one of them running.
+"""
+from __future__ import print_function
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+from datetime import date, timedelta
+
+import _django
+
+database = (sys.argv[2] if len(sys.argv) > 2 else
+            os.path.join(tempfile.mkdtemp(), "subscriptions.sqlite3"))
+_django.setup(database)
+
+from django.db import connection, transaction
+
+from plans.models import Subscription
+
+RUNNING = list(Subscription.RUNNING_STATUSES)
+STOPPED = [Subscription.EXPIRED, Subscription.CANCELED]
+TODAY = date(2020, 3, 10)
+
+
+def seed(count):
+    rand = random.Random(42)
+    vaults = max(count // 10, 1)
+    now = "2020-01-01 00:00:00"
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO auth_user (id, password, is_superuser, username, "
+            "first_name, last_name, email, is_staff, is_active, date_joined) "
+            "VALUES (%s, '', 0, %s, '', '', '', 0, 1, %s)",
+            [(i, "user%s" % i, now) for i in range(1, vaults + 1)])
+        cursor.executemany(
+            "INSERT INTO plans_uservault (id, user_id, vault_id, token, "
+            "created, modified) VALUES (%s, %s, %s, '', %s, %s)",
+            [(i, i, "v%s" % i, now, now) for i in range(1, vaults + 1)])
+        cursor.execute(
+            "INSERT INTO plans_plan (id, name, plan_id, description, active, "
+            "\"default\", trial_period, price, currency, created, modified) "
+            "VALUES (1, 'Basic', 'basic', '', 1, 1, 0, 9.90, 'EUR', %s, %s)",
+            [now, now])
+        rows = []
+        for i in range(1, count + 1):
+            vault = (i - 1) % vaults + 1
+            status = (rand.choice(RUNNING) if i <= vaults
+                      else rand.choice(STOPPED))
+            billing = TODAY + timedelta(days=rand.randint(-5, 60))
+            rows.append((i, "s%s" % i, vault, status, billing, now, now))
+        cursor.executemany(
+            "INSERT INTO plans_subscription (id, subscription_id, "
+            "user_vault_id, plan_id, status, start_date, next_billing_date, "
+            "created, modified) VALUES (%s, %s, %s, 1, %s, '2020-01-01', "
+            "%s, %s, %s)", rows)
+        cursor.execute("ANALYZE")
+    return vaults
+
+
+def explain(queryset):
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def timed(func, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        func()
+    return (time.time() - start) / repeat
+
+
+def measure(label, vaults):
+    rand = random.Random(1)
+    vault_ids = [rand.randint(1, vaults) for _ in range(1000)]
+    queries = [
+        ("running subscription of a vault",
+         lambda vault_id=1: Subscription.objects.filter(
+             user_vault_id=vault_id, status__in=RUNNING),
+         lambda: [list(Subscription.objects.filter(
+             user_vault_id=vault_id, status__in=RUNNING))
+             for vault_id in vault_ids], 1000),
+        ("due subscriptions",
+         lambda: Subscription.objects.filter(
+             status__in=RUNNING, next_billing_date__lte=TODAY),
+         lambda: Subscription.objects.filter(
+             status__in=RUNNING, next_billing_date__lte=TODAY).count(), 1),
+    ]
+    print("== %s" % label)
+    for name, queryset, run, calls in queries:
+        elapsed = timed(run, 3) / calls
+        print("%-32s %10.3fms" % (name, elapsed * 1000))
+        for line in explain(queryset()):
+            print("    %s" % line)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    _django.migrate("0001")
+    print("Seeding %s subscriptions in %s" % (count, database))
+    vaults = seed(count)
+    measure("before (0001_initial)", vaults)
+    start = time.time()
+    _django.migrate("0002")
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    print("\nIndexes created in %.1fs" % (time.time() - start))
+    measure("after (0002_subscription_indexes)", vaults)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compare Gateway.validate_many with the per-card Gateway.validate loop.
+
+    python benchmarks/bench_validate_many.py [number of cards]
+"""
+from __future__ import print_function
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from plans.gateway.base import Gateway
+from plans.utils.credit_card import (
+    CardNotSupported,
+    CreditCard,
+    cards as card_types,
+)
+
+
+class BenchGateway(Gateway):
+    name = "Bench Gateway"
+    supported_card_types = card_types
+
+
+def random_card(rand):
+    prefix, length = rand.choice([("4", 16), ("4", 13), ("55", 16),
+                                  ("37", 15), ("6011", 16), ("9", 16)])
+    digits = [rand.choice("0123456789")
+              for _ in range(length - len(prefix))]
+    return CreditCard("John Doe", prefix + "".join(digits), "111",
+                      rand.randint(2000, 2040), rand.randint(1, 12))
+
+
+def per_card_loop(gateway, credit_cards):
+    results = []
+    for credit_card in credit_cards:
+        try:
+            results.append(gateway.validate(credit_card))
+        except CardNotSupported:
+            results.append(False)
+    return results
+
+
+def bulk(gateway, credit_cards):
+    return [r.is_valid for r in gateway.validate_many(credit_cards)]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rand = random.Random(42)
+    credit_cards = [random_card(rand) for _ in range(count)]
+    gateway = BenchGateway()
+    assert per_card_loop(gateway, credit_cards) == bulk(gateway, credit_cards)
+
+    for label, func in [("validate loop", per_card_loop),
+                        ("validate_many", bulk)]:
+        best = min(timeit.repeat(lambda: func(gateway, credit_cards),
+                                 repeat=3, number=1))
+        print("%-14s %8.3fs  %10.0f cards/s" % (label, best, count / best))
+
+
+if __name__ == '__main__':
+    main()
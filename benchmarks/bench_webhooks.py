@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Time a replay of webhook events by the gateway: every event is posted to
+the webhook view twice, a few events per request, then the stored events
+are processed in batches.
+
+    python benchmarks/bench_webhooks.py [subscriptions] [events per request]
+
+Each subscription receives a declined charge, a successful charge and a
+cancellation. With SQLite, small requests are bound by the commit of each
+new event; replayed events are dropped without writing.
+"""
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import _django
+
+directory = tempfile.mkdtemp()
+_django.setup(
+    os.path.join(directory, "webhooks.sqlite3"),
+    ROOT_URLCONF="plans.urls",
+    ALLOWED_HOSTS=["testserver"],
+    PLANS={"BILLING_GATEWAY": "plans.gateway.dummy.DummyGateway"},
+)
+
+from django.db import connection, transaction
+from django.test import Client
+
+from plans.gateway import base
+from plans.models import PaymentLog, Plan, Subscription, WebhookEvent
+from plans.webhooks import WebhookProcessor
+
+
+def seed(count):
+    now = "2020-03-01 00:00:00"
+    plan = Plan.objects.create(name="Basic", plan_id="basic", price="9.90")
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO auth_user (id, password, is_superuser, username, "
+            "first_name, last_name, email, is_staff, is_active, date_joined) "
+            "VALUES (%s, '', 0, %s, '', '', '', 0, 1, %s)",
+            [(i, "user%s" % i, now) for i in range(1, count + 1)])
+        cursor.executemany(
+            "INSERT INTO plans_uservault (id, user_id, vault_id, token, "
+            "created, modified) VALUES (%s, %s, %s, '', %s, %s)",
+            [(i, i, "v%s" % i, now, now) for i in range(1, count + 1)])
+        cursor.executemany(
+            "INSERT INTO plans_subscription (id, subscription_id, "
+            "user_vault_id, plan_id, status, start_date, next_billing_date, "
+            "created, modified) VALUES (%s, %s, %s, %s, 'active', "
+            "'2020-02-01', '2020-03-01', %s, %s)",
+            [(i, "s%s" % i, i, plan.pk, now, now)
+             for i in range(1, count + 1)])
+
+
+def events(count):
+    for i in range(1, count + 1):
+        yield {"id": "d%s" % i, "kind": base.DECLINED,
+               "subscription_id": "s%s" % i}
+        yield {"id": "c%s" % i, "kind": base.CHARGED,
+               "subscription_id": "s%s" % i, "transaction_id": "t%s" % i,
+               "amount": "9.90", "next_billing_date": "2020-04-01"}
+        yield {"id": "x%s" % i, "kind": base.CANCELED,
+               "subscription_id": "s%s" % i}
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    per_request = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    _django.migrate()
+    seed(count)
+    all_events = list(events(count))
+    bodies = [json.dumps(all_events[start:start + per_request])
+              for start in range(0, len(all_events), per_request)]
+    client = Client()
+    try:
+        start = time.time()
+        for _ in range(2):
+            for body in bodies:
+                response = client.post("/webhook/", body,
+                                       content_type="application/json")
+                assert response.status_code == 200
+        receive_time = time.time() - start
+        start = time.time()
+        processor = WebhookProcessor(delay=0).run()
+        process_time = time.time() - start
+        assert WebhookEvent.objects.count() == len(all_events)
+        assert PaymentLog.objects.count() == count
+        assert not Subscription.objects.exclude(status="canceled").exists()
+    finally:
+        shutil.rmtree(directory)
+    received = 2 * len(all_events)
+    print("%s events posted twice, %s per request" % (len(all_events),
+                                                      per_request))
+    print("receive %7.2fs  %8.0f events/s" % (receive_time,
+                                              received / receive_time))
+    print("process %7.2fs  %8.0f events/s" % (process_time,
+                                              processor.events / process_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite of the hot paths, compared to stored baselines.
+
+    python benchmarks/run.py [--save] [--threshold 0.25] [--repeat 5]
+                             [--baselines FILE] [name ...]
+
+Each case calls a function `number` times per run. It reports the wall time
+per call, the best of `repeat` runs, and the number of queries of the first
+run. The results are compared to the baselines of the running Python
+version in benchmarks/baselines.json. A case regresses when:
+
+* its time per call exceeds its baseline by more than the threshold, or
+* it makes more queries than its baseline.
+
+The exit status is 1 when a case regresses. Query counts do not depend on
+the machine, but times do: record the baselines with --save on the machine
+the comparisons run on, and commit them with the change that moves them.
+Names select the cases whose name contains one of them.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import sys
+
+from collections import namedtuple
+from datetime import date
+from timeit import default_timer
+
+import _django
+
+_django.setup()
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from plans.billing import BillingRun
+from plans.catalog import plan_catalog
+from plans.gateway.base import Gateway
+from plans.models import PaymentLog, Plan, Subscription, UserVault
+from plans.utils.credit_card import CreditCard, Visa, cards
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "baselines.json")
+BILLING_DATE = date(2020, 3, 1)
+USERS = 2000
+
+Case = namedtuple("Case", "name number setup")
+Result = namedtuple("Result", "time queries")
+
+CASES = []
+
+
+def case(name, number):
+    """
+    Registers a case. The decorated function prepares it outside of the
+    timing and returns the function to time, or a (function, reset) pair
+    whose reset is called after each run.
+    """
+    def register(setup):
+        CASES.append(Case(name, number, setup))
+        return setup
+    return register
+
+
+class FakeGateway(Gateway):
+    name = "Fake Gateway"
+    supported_card_types = cards
+
+    def charge(self, credit_card, amount, options=None):
+        return "tx-%s" % options["subscription_id"]
+
+
+def seed(count):
+    now = "2020-02-01 00:00:00"
+    basic = Plan.objects.create(name="Basic", plan_id="basic", price="9.90",
+                                active=True, default=True)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO auth_user (id, password, is_superuser, username, "
+            "first_name, last_name, email, is_staff, is_active, date_joined) "
+            "VALUES (%s, '', 0, %s, '', '', '', 0, 1, %s)",
+            [(i, "user%s" % i, now) for i in range(1, count + 1)])
+        cursor.executemany(
+            "INSERT INTO plans_uservault (id, user_id, vault_id, token, "
+            "created, modified) VALUES (%s, %s, %s, 'tok', %s, %s)",
+            [(i, i, "v%s" % i, now, now) for i in range(1, count + 1)])
+        cursor.executemany(
+            "INSERT INTO plans_subscription (id, subscription_id, "
+            "user_vault_id, plan_id, status, start_date, next_billing_date, "
+            "created, modified) VALUES (%s, %s, %s, %s, 'active', "
+            "'2020-02-01', %s, %s, %s)",
+            [(i, "s%s" % i, i, basic.pk, BILLING_DATE, now, now)
+             for i in range(1, count + 1)])
+
+
+@case("credit_card.is_luhn_valid", number=20000)
+def luhn():
+    return Visa("John Doe", "4111111111111111", "123", 2040, 1).is_luhn_valid
+
+
+@case("credit_card.accept", number=20000)
+def accept():
+    return lambda: Visa.accept("4111111111111111")
+
+
+@case("gateway.validate", number=10000)
+def validate():
+    gateway = FakeGateway()
+    # The last supported card type
+    credit_card = CreditCard("John Doe", "6011111111111117", "123", 2040, 1)
+    return lambda: gateway.validate(credit_card)
+
+
+@case("plan.get_default_plan", number=20000)
+def default_plan():
+    plan_catalog.invalidate()
+    return Plan.get_default_plan
+
+
+@case("user_vault.subscription", number=500)
+def subscription():
+    vaults = list(UserVault.objects.order_by('pk')[:50])
+    state = {"index": 0}
+
+    def lookup():
+        # The first lookup of each vault queries its subscription, the
+        # next ones are served from the instance
+        vault = vaults[state["index"] % len(vaults)]
+        state["index"] += 1
+        if state["index"] <= len(vaults):
+            vault.__dict__.pop('_running_subscription', None)
+        return vault.subscription
+
+    def reset():
+        state["index"] = 0
+
+    return lookup, reset
+
+
+@case("billing.run", number=1)
+def billing():
+    gateway = FakeGateway()
+
+    def run():
+        BillingRun(BILLING_DATE, gateway, concurrency=1).run()
+
+    def reset():
+        PaymentLog.objects.all().delete()
+        Subscription.objects.update(status=Subscription.ACTIVE,
+                                    next_billing_date=BILLING_DATE)
+
+    return run, reset
+
+
+def measure(bench, repeat):
+    prepared = bench.setup()
+    func, reset = prepared if isinstance(prepared, tuple) else (prepared,
+                                                                None)
+    best = None
+    queries = None
+    for run in range(repeat):
+        with CaptureQueriesContext(connection) as context:
+            start = default_timer()
+            for _ in range(bench.number):
+                func()
+            elapsed = default_timer() - start
+        if queries is None:
+            queries = len(context)
+        if best is None or elapsed < best:
+            best = elapsed
+        if reset is not None:
+            reset()
+    return Result(best / bench.number, queries)
+
+
+def format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3)):
+        if seconds >= scale:
+            return "%.2f%s" % (seconds / scale, unit)
+    return "%.2fus" % (seconds * 1e6)
+
+
+def compare(result, baseline, threshold):
+    """
+    Returns the status of a result against its baseline.
+    """
+    if baseline is None:
+        return "new"
+    if result.queries > baseline["queries"]:
+        return "REGRESSION (queries)"
+    if result.time > baseline["time"] * (1 + threshold):
+        return "REGRESSION"
+    if result.time < baseline["time"] * (1 - threshold):
+        return "faster"
+    return "ok"
+
+
+def load_baselines(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as baselines_file:
+        return json.load(baselines_file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the benchmarks.")
+    parser.add_argument("names", nargs="*")
+    parser.add_argument("--save", action="store_true",
+                        help="Store the results as the new baselines.")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Allowed slowdown, as a fraction.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baselines", default=BASELINES)
+    options = parser.parse_args(argv)
+
+    _django.migrate()
+    seed(USERS)
+    version = "%s.%s" % sys.version_info[:2]
+    baselines = load_baselines(options.baselines)
+    python_baselines = baselines.get(version, {})
+
+    regressions = 0
+    print("%-28s %10s %10s %8s %8s  %s" % (
+        "case", "time/call", "baseline", "queries", "baseline", "status"))
+    for bench in CASES:
+        if options.names and not any(name in bench.name
+                                     for name in options.names):
+            continue
+        result = measure(bench, options.repeat)
+        baseline = python_baselines.get(bench.name)
+        status = compare(result, baseline, options.threshold)
+        regressions += status.startswith("REGRESSION")
+        print("%-28s %10s %10s %8d %8s  %s" % (
+            bench.name, format_time(result.time),
+            format_time(baseline["time"]) if baseline else "-",
+            result.queries, baseline["queries"] if baseline else "-",
+            status))
+        python_baselines[bench.name] = result._asdict()
+
+    if options.save:
+        baselines[version] = python_baselines
+        with open(options.baselines, "w") as baselines_file:
+            json.dump(baselines, baselines_file, indent=2, sort_keys=True,
+                      separators=(",", ": "))
+            baselines_file.write("\n")
+        print("Baselines of Python %s saved (%s)" % (
+            version, platform.python_implementation()))
+    return 1 if regressions and not options.save else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,5 @@
 # -*- coding: utf-8 -*-
 
 __version__ = '0.0.0'
+
+default_app_config = 'plans.apps.PlansConfig'
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Admin of the plans application.
+
+Listings follow their relations in the list query, are ordered by primary
+key and do not count the whole table, so that they stay cheap on large
+tables. Foreign keys are edited as raw ids rather than select boxes of all
+the users, vaults or payments.
+"""
+from django.contrib import admin
+
+from .models import (
+    BillingInfo,
+    Entitlement,
+    Invoice,
+    PaymentLog,
+    Plan,
+    Subscription,
+    UsageRate,
+    UsageRecord,
+    UserVault,
+    WebhookEvent,
+)
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    ordering = ('-pk',)
+    list_per_page = 100
+    show_full_result_count = False
+
+
+class EntitlementInline(admin.TabularInline):
+    model = Entitlement
+    extra = 0
+
+
+class UsageRateInline(admin.TabularInline):
+    model = UsageRate
+    extra = 0
+
+
+@admin.register(Plan)
+class PlanAdmin(admin.ModelAdmin):
+    inlines = (EntitlementInline, UsageRateInline)
+    list_display = ('name', 'plan_id', 'price', 'currency', 'active',
+                    'default')
+    list_filter = ('active', 'default')
+
+
+@admin.register(BillingInfo)
+class BillingInfoAdmin(LargeTableAdmin):
+    list_display = ('__str__', 'name', 'tax_number', 'country')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    search_fields = ('name', 'tax_number')
+
+
+@admin.register(UserVault)
+class UserVaultAdmin(LargeTableAdmin):
+    list_display = ('__str__', 'vault_id', 'created')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    search_fields = ('=vault_id',)
+
+
+@admin.register(Subscription)
+class SubscriptionAdmin(LargeTableAdmin):
+    list_display = ('__str__', 'plan', 'status', 'next_billing_date')
+    list_filter = ('status',)
+    list_select_related = ('user_vault__user', 'plan')
+    raw_id_fields = ('user_vault',)
+    search_fields = ('=subscription_id',)
+
+
+@admin.register(PaymentLog)
+class PaymentLogAdmin(LargeTableAdmin):
+    list_display = ('__str__', 'status', 'created')
+    list_filter = ('status',)
+    list_select_related = ('vault__user',)
+    raw_id_fields = ('vault',)
+    search_fields = ('=transaction_id',)
+
+
+@admin.register(Invoice)
+class InvoiceAdmin(LargeTableAdmin):
+    list_display = ('number', 'name', 'amount', 'currency', 'issued')
+    raw_id_fields = ('payment_log', 'user')
+    search_fields = ('=number',)
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(LargeTableAdmin):
+    list_display = ('event_id', 'provider', 'kind', 'subscription_id',
+                    'received')
+    list_filter = ('provider', 'kind')
+    search_fields = ('=event_id', '=subscription_id')
+
+
+@admin.register(UsageRecord)
+class UsageRecordAdmin(LargeTableAdmin):
+    list_display = ('subscription', 'metric', 'period_start', 'quantity')
+    list_filter = ('metric',)
+    list_select_related = ('subscription__user_vault__user',)
+    raw_id_fields = ('subscription',)
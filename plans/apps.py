@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+from django.apps import AppConfig
+
+
+class PlansConfig(AppConfig):
+    name = 'plans'
+    verbose_name = "Plans"
+
+    def ready(self):
+        from .conf import plan_settings
+        from .taxation import get_tax_policy
+        # Fail early on invalid settings rather than on first use
+        plan_settings.reload()
+        get_tax_policy()
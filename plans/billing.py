@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+"""
+Recurring billing of the subscriptions.
+"""
+import logging
+import uuid
+
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, CharField, Q, Value, When
+from django.utils import timezone
+
+from .gateway import get_gateway
+from .gateway.base import GatewayError, GatewayNotSent
+from .gateway.concurrency import ConcurrentGateway
+from .metering import flush_usage, usage_charges
+from .models import PaymentLog, Subscription, UserVault
+from .utils.dates import renewal_date
+
+
+_logger = logging.getLogger("plans.billing")
+
+# Keys per CASE update of the charged logs: each key binds three parameters,
+# and SQLite before 3.32 accepts at most 999 per query
+UPDATE_BATCH_SIZE = 300
+
+ZERO = Decimal("0.00")
+
+
+class BillingRun(object):
+    """
+    Charges the running subscriptions due at the given date.
+
+    Subscriptions are fetched in chunks ordered by primary key, so that the
+    run never holds more than one chunk in memory. The charges of a chunk
+    are reserved with one bulk insert of pending PaymentLog rows, made
+    concurrently (see the GATEWAY_CONCURRENCY setting), then written back
+    with one update of the logs and one per new billing date.
+
+    Declined charges move the subscription to past due. Subscriptions whose
+    charge failed otherwise (e.g. timed out) are left unchanged and counted
+    as errors: their reservation stays pending, and is charged again with
+    the same idempotency key by the first run after lease_seconds (see
+    stale_reservations). Charges never sent to the gateway are released at
+    once.
+    """
+    def __init__(self, billing_date=None, gateway=None, chunk_size=500,
+                 concurrency=None, worker_id=None, lease_seconds=600):
+        self.billing_date = billing_date or date.today()
+        self.gateway = gateway or get_gateway()
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.charged = 0
+        self.failed = 0
+        self.errors = 0
+        self.skipped = 0
+
+    def due_subscriptions(self):
+        """
+        Yields chunks of the subscriptions due at the billing date.
+
+        With a worker_id, chunks are claimed with claim_due_subscriptions so
+        that several workers can drain the due subscriptions in parallel.
+        """
+        if self.worker_id is not None:
+            while True:
+                chunk = claim_due_subscriptions(
+                    self.worker_id, self.billing_date, self.chunk_size,
+                    self.lease_seconds)
+                if not chunk:
+                    return
+                yield chunk
+        queryset = due_subscriptions(self.billing_date).select_related(
+            'plan', 'user_vault').order_by('pk')
+        last_pk = 0
+        while True:
+            chunk = list(queryset.filter(pk__gt=last_pk)[:self.chunk_size])
+            if not chunk:
+                return
+            yield chunk
+            last_pk = chunk[-1].pk
+
+    def charge_arguments(self, subscription, idempotency_key, amount=None):
+        """
+        Returns the arguments of the Gateway.charge call for a subscription,
+        charged the plan price unless amount is given.
+        """
+        vault = subscription.user_vault
+        plan = subscription.plan
+        if amount is None:
+            amount = plan.price
+        return (None, amount, {
+            "vault_id": vault.vault_id,
+            "token": vault.token,
+            "currency": plan.currency,
+            "subscription_id": subscription.subscription_id,
+            "idempotency_key": idempotency_key,
+        })
+
+    def stale_reservations(self, keys):
+        """
+        Returns {idempotency key: amount} of the pending logs among the
+        given keys not updated for lease_seconds, whose charge outcome is
+        unknown, and touches them so that the next runs wait for this one.
+
+        They are charged again with the same idempotency key, which keeps
+        the gateway from charging twice.
+        """
+        if not keys:
+            return {}
+        now = timezone.now()
+        amounts = dict(PaymentLog.objects.filter(
+            idempotency_key__in=keys, status=PaymentLog.PENDING,
+            modified__lt=now - timedelta(seconds=self.lease_seconds),
+        ).values_list('idempotency_key', 'amount'))
+        if amounts:
+            PaymentLog.objects.filter(
+                idempotency_key__in=list(amounts),
+                status=PaymentLog.PENDING,
+            ).update(modified=now)
+        return amounts
+
+    def process_chunk(self, gateway, subscriptions):
+        """
+        Charges a chunk of subscriptions in three steps:
+
+        1. reserve a pending PaymentLog per subscription, keyed by the
+           subscription and its billing period, and commit them;
+        2. charge the subscriptions whose reservation succeeded, or is
+           stale;
+        3. in one transaction, mark the charged logs as succeeded, delete
+           the reservations of the declined charges and of the charges not
+           sent, and update the subscriptions.
+
+        Subscriptions are charged their plan price, the usage of the
+        period (see plans.metering) and the outstanding ADJUSTMENT logs of
+        their vault in the currency of the plan (see plans.proration);
+        adjustments in other currencies are left outstanding. The
+        adjustments are marked as applied to the charge in the transaction
+        of its reservation, and released with it. When the credits exceed
+        the amount due, nothing is charged and the remaining credit is
+        recorded as a new adjustment.
+
+        A retry after a crash skips the subscriptions already reserved, so
+        a subscription is never charged twice for the same period, except
+        for the stale reservations charged again with their idempotency key
+        and amount. Reservations of the charges not sent to the gateway are
+        deleted, as for declined charges.
+        """
+        usage = usage_charges(subscriptions)
+        adjustments = outstanding_adjustments(
+            [subscription.user_vault_id for subscription in subscriptions])
+        keys = [PaymentLog.idempotency_key_for(subscription,
+                                               subscription.next_billing_date)
+                for subscription in subscriptions]
+        applied = [adjustments.get((subscription.user_vault_id,
+                                    subscription.plan.currency), [])
+                   for subscription in subscriptions]
+        amounts = []
+        # {charge key: credit left after the charge}
+        credits = {}
+        for subscription, key, logs in zip(subscriptions, keys, applied):
+            amount = (subscription.plan.price +
+                      usage.get(subscription.pk, 0) +
+                      sum(adjustment for _, adjustment in logs))
+            if amount < 0:
+                credits[key] = PaymentLog(
+                    vault=subscription.user_vault, amount=amount,
+                    idempotency_key="%s:credit" % key,
+                    status=PaymentLog.ADJUSTMENT,
+                    currency=subscription.plan.currency)
+                amount = ZERO
+            amounts.append(amount)
+        # The adjustments are applied by the reservations that include them
+        with transaction.atomic() if adjustments else _no_transaction():
+            reserved = reserve_payments([
+                PaymentLog(vault=subscription.user_vault,
+                           idempotency_key=key, status=PaymentLog.PENDING,
+                           amount=amount, currency=subscription.plan.currency)
+                for subscription, key, amount
+                in zip(subscriptions, keys, amounts)
+            ])
+            _apply_adjustments([
+                (pk, key) for key, logs in zip(keys, applied)
+                if key in reserved for pk, _ in logs])
+            if credits:
+                reserve_payments([log for key, log in credits.items()
+                                  if key in reserved])
+        stale = self.stale_reservations(
+            [key for key in keys if key not in reserved])
+        charges = [(subscription, key, stale.get(key, amount))
+                   for subscription, key, amount
+                   in zip(subscriptions, keys, amounts)
+                   if key in reserved or key in stale]
+        self.skipped += len(subscriptions) - len(charges)
+
+        transactions = {}
+        renewed = defaultdict(list)
+        declined = []
+        released = []
+        # Charges covered by credits are not sent to the gateway
+        covered = [charge for charge in charges if not charge[2]]
+        charges = [charge for charge in charges if charge[2]]
+        for subscription, key, _ in covered:
+            transactions[key] = ""
+            next_billing_date = renewal_date(
+                subscription.first_billing_date,
+                subscription.next_billing_date)
+            renewed[next_billing_date].append(subscription.pk)
+        results = gateway.map("charge", [
+            self.charge_arguments(subscription, key, amount)
+            for subscription, key, amount in charges])
+        for (subscription, key, _), result in zip(charges, results):
+            if isinstance(result.error, GatewayNotSent):
+                # Released, to be charged by the next run
+                _logger.warning("Did not charge subscription %s: %s",
+                                subscription.subscription_id, result.error)
+                released.append(key)
+                self.errors += 1
+                continue
+            elif isinstance(result.error, GatewayError):
+                _logger.warning("Failed to charge subscription %s: %s",
+                                subscription.subscription_id, result.error)
+                declined.append((subscription.pk, key))
+                continue
+            elif result.error is not None:
+                # The outcome is unknown, the reservation stays pending
+                _logger.error("Error charging subscription %s: %r",
+                              subscription.subscription_id, result.error)
+                self.errors += 1
+                continue
+            transactions[key] = result.value
+            next_billing_date = renewal_date(
+                subscription.first_billing_date,
+                subscription.next_billing_date)
+            renewed[next_billing_date].append(subscription.pk)
+
+        with transaction.atomic():
+            charged = sorted(transactions.items())
+            for start in range(0, len(charged), UPDATE_BATCH_SIZE):
+                batch = charged[start:start + UPDATE_BATCH_SIZE]
+                PaymentLog.objects.filter(
+                    idempotency_key__in=[key for key, _ in batch],
+                ).update(
+                    status=PaymentLog.SUCCEEDED,
+                    transaction_id=Case(*[
+                        When(idempotency_key=key, then=Value(transaction_id))
+                        for key, transaction_id in batch
+                    ], output_field=CharField()),
+                )
+            for next_billing_date, pks in renewed.items():
+                Subscription.objects.filter(pk__in=pks).update(
+                    status=Subscription.ACTIVE,
+                    next_billing_date=next_billing_date,
+                    lease_owner=None,
+                    lease_expires=None,
+                )
+            released += [key for pk, key in declined]
+            if released:
+                PaymentLog.objects.filter(
+                    idempotency_key__in=released,
+                    status=PaymentLog.PENDING,
+                ).delete()
+                if adjustments or stale:
+                    PaymentLog.objects.filter(
+                        applied_to__in=released,
+                    ).update(applied_to=None)
+            if declined:
+                Subscription.objects.filter(
+                    pk__in=[pk for pk, key in declined],
+                ).update(status=Subscription.PAST_DUE)
+        UserVault.invalidate_subscription_caches(
+            [subscription.user_vault_id for subscription in subscriptions])
+        self.charged += len(transactions)
+        self.failed += len(declined)
+
+    def run(self):
+        # Usage recorded by this process is charged by this run
+        flush_usage()
+        with ConcurrentGateway(self.gateway, self.concurrency) as gateway:
+            for chunk in self.due_subscriptions():
+                self.process_chunk(gateway, chunk)
+        _logger.info("Billing run of %s: %s charged, %s failed, %s errors, "
+                     "%s already reserved", self.billing_date, self.charged,
+                     self.failed, self.errors, self.skipped)
+        return self
+
+
+def due_subscriptions(billing_date):
+    """
+    Returns the running subscriptions due at the given date.
+    """
+    return Subscription.objects.filter(
+        status__in=Subscription.RUNNING_STATUSES,
+        next_billing_date__lte=billing_date,
+    )
+
+
+def claim_due_subscriptions(worker_id, billing_date, limit,
+                            lease_seconds=600):
+    """
+    Leases up to limit due subscriptions to the given worker for
+    lease_seconds and returns them.
+
+    Subscriptions leased to another worker are skipped until their lease
+    expires, so a crashed worker only delays its subscriptions. Candidates
+    are locked with SELECT ... FOR UPDATE SKIP LOCKED where supported, so
+    that concurrent workers pick disjoint rows. The lease is taken by an
+    update re-checking that the rows are still free, which makes the claim
+    safe on the other databases too: there, workers racing for the same
+    candidates retry with the next ones.
+
+    Subscriptions still due once processed (declined, or already reserved)
+    keep their lease, so they are not claimed again by the same run. The
+    lease owner is the worker id, truncated to fit the column, followed by
+    a random suffix unique to each claim.
+    """
+    skip_locked = connection.features.has_select_for_update_skip_locked
+    max_length = Subscription._meta.get_field('lease_owner').max_length
+    prefix = ("%s" % worker_id)[:max_length - 17]
+    while True:
+        now = timezone.now()
+        token = "%s:%s" % (prefix, uuid.uuid4().hex[:16])
+        free = due_subscriptions(billing_date).filter(
+            Q(lease_expires__isnull=True) | Q(lease_expires__lt=now))
+        # Without row locks, the select is kept out of the transaction:
+        # SQLite cannot upgrade a read transaction to a write one while
+        # another process reads.
+        with transaction.atomic() if skip_locked else _no_transaction():
+            candidates = free.order_by('pk')
+            if skip_locked:
+                candidates = candidates.select_for_update(skip_locked=True)
+            pks = list(candidates.values_list('pk', flat=True)[:limit])
+            if not pks:
+                return []
+            claimed = free.filter(pk__in=pks).update(
+                lease_owner=token,
+                lease_expires=now + timedelta(seconds=lease_seconds),
+            )
+        if claimed:
+            return list(Subscription.objects.filter(
+                pk__in=pks, lease_owner=token,
+            ).select_related('plan', 'user_vault').order_by('pk'))
+
+
+@contextmanager
+def _no_transaction():
+    yield
+
+
+def outstanding_adjustments(vault_ids):
+    """
+    Returns the ADJUSTMENT logs of the given vaults not applied to a charge
+    yet, as {(vault pk, currency): [(log pk, amount)]}.
+    """
+    adjustments = defaultdict(list)
+    for pk, vault_id, currency, amount in PaymentLog.objects.filter(
+            vault_id__in=vault_ids, status=PaymentLog.ADJUSTMENT,
+            applied_to__isnull=True,
+    ).order_by('pk').values_list('pk', 'vault_id', 'currency', 'amount'):
+        adjustments[vault_id, currency].append((pk, amount))
+    return adjustments
+
+
+def _apply_adjustments(applied):
+    """
+    Marks the given (adjustment pk, charge key) adjustments as applied.
+    """
+    for start in range(0, len(applied), UPDATE_BATCH_SIZE):
+        batch = applied[start:start + UPDATE_BATCH_SIZE]
+        PaymentLog.objects.filter(
+            pk__in=[pk for pk, _ in batch],
+            applied_to__isnull=True,
+        ).update(applied_to=Case(*[
+            When(pk=pk, then=Value(key)) for pk, key in batch
+        ], output_field=CharField()))
+
+
+def reserve_payments(logs):
+    """
+    Inserts the given pending payment logs, skipping those whose idempotency
+    key is already used, and returns the set of keys reserved by this call.
+
+    The logs are inserted in savepoints, and committed with the transaction
+    of the caller: called outside of a transaction, the reservations are
+    committed before returning, so that they are seen by concurrent runs.
+    Duplicates are detected through the unique index on the idempotency
+    key: in the rare case of a race with another run, the logs are inserted
+    one by one.
+    """
+    keys = [log.idempotency_key for log in logs]
+    existing = set(PaymentLog.objects.filter(
+        idempotency_key__in=keys,
+    ).values_list('idempotency_key', flat=True))
+    logs = [log for log in logs if log.idempotency_key not in existing]
+    try:
+        with transaction.atomic():
+            PaymentLog.objects.bulk_create(logs)
+        return set(log.idempotency_key for log in logs)
+    except IntegrityError:
+        pass
+    reserved = set()
+    for log in logs:
+        try:
+            with transaction.atomic():
+                log.save(force_insert=True)
+        except IntegrityError:
+            continue
+        reserved.add(log.idempotency_key)
+    return reserved
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Caching helpers shared by the plans application.
+"""
+import threading
+import time
+
+from django.core.cache import caches
+
+from .conf import plan_settings
+
+
+class CacheStats(object):
+    """
+    Hit and miss counters of a cache, to verify its effect under load.
+
+    Local hits are served from process or instance memory, shared hits from
+    the Django cache configured by the CACHE_ALIAS setting.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @property
+    def hits(self):
+        return self.local_hits + self.shared_hits
+
+    def as_dict(self):
+        return {
+            "local_hits": self.local_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+        }
+
+
+subscription_cache_stats = CacheStats()
+
+
+class TTLCache(object):
+    """
+    Thread-safe in-process mapping whose entries expire after the given
+    number of seconds. Once maxsize entries are stored, expired entries are
+    evicted, then the oldest ones.
+    """
+    def __init__(self, timeout, maxsize=10000, clock=time.time):
+        self.timeout = timeout
+        self.maxsize = maxsize
+        self.clock = clock
+        self.stats = CacheStats()
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is not None and entry[0] > self.clock():
+            self.stats.local_hits += 1
+            return entry[1]
+        self.stats.misses += 1
+        return default
+
+    def set(self, key, value):
+        now = self.clock()
+        with self._lock:
+            if key not in self._data and len(self._data) >= self.maxsize:
+                self._evict(now)
+            self._data[key] = (now + self.timeout, value)
+
+    def _evict(self, now):
+        expired = [key for key, (expires, _) in self._data.items()
+                   if expires <= now]
+        for key in expired:
+            del self._data[key]
+        if len(self._data) >= self.maxsize:
+            # Entries share the same timeout, so the oldest expire first
+            oldest = sorted(self._data, key=lambda key: self._data[key][0])
+            for key in oldest[:len(self._data) - self.maxsize + 1]:
+                del self._data[key]
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def get_shared_cache():
+    """
+    Returns the Django cache shared between processes, or None if the
+    CACHE_ALIAS setting is not set.
+    """
+    if plan_settings.CACHE_ALIAS:
+        return caches[plan_settings.CACHE_ALIAS]
+    return None
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+In-process catalog of plans.
+
+Plans rarely change, so they are loaded once per process and reloaded when
+a plan is saved or deleted, once the change is committed. If the CACHE_ALIAS
+setting is set, a catalog version is kept in the shared cache so that the
+other processes reload their catalog too.
+"""
+import threading
+
+from django.apps import apps
+
+from .cache import CacheStats, get_shared_cache
+from .conf import plan_settings
+
+
+class _Catalog(object):
+    """
+    Immutable snapshot of the plans table.
+    """
+    def __init__(self, plans, version):
+        self.version = version
+        self.plans = plans
+        self.active_plans = [plan for plan in plans if plan.active]
+        self.by_plan_id = {}
+        self.by_name = {}
+        for plan in plans:
+            self.by_plan_id.setdefault(plan.plan_id, plan)
+            self.by_name.setdefault(plan.name, plan)
+        defaults = [plan for plan in plans if plan.default]
+        # The most recent default plan, see Plan.get_default_plan
+        self.default_plan = defaults[-1] if defaults else None
+
+
+class PlanCatalog(object):
+    """
+    Lookups over all the plans, served from memory.
+
+    The returned Plan instances are shared by all the callers and should
+    not be modified.
+    """
+    version_key = "plans:catalog:version"
+
+    def __init__(self):
+        self._catalog = None
+        # Incremented by invalidate(), so that a catalog loaded meanwhile is
+        # not kept
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.stats = CacheStats()
+
+    def _get_catalog(self):
+        catalog = self._catalog
+        cache = get_shared_cache()
+        version = cache.get(self.version_key, 0) if cache is not None else 0
+        if catalog is not None and catalog.version == version:
+            self.stats.local_hits += 1
+            return catalog
+        with self._lock:
+            catalog = self._catalog
+            if catalog is None or catalog.version != version:
+                self.stats.misses += 1
+                generation = self._generation
+                plan_model = apps.get_model('plans', 'Plan')
+                plans = list(plan_model.objects.order_by('pk'))
+                catalog = _Catalog(plans, version)
+                if generation == self._generation:
+                    self._catalog = catalog
+        return catalog
+
+    def invalidate(self):
+        """
+        Drop the catalog of this process, and of the other ones if the
+        CACHE_ALIAS setting is set. Plan changes invalidate the catalog once
+        committed.
+        """
+        self._generation += 1
+        self._catalog = None
+        cache = get_shared_cache()
+        if cache is not None:
+            cache.add(self.version_key, 0, None)
+            try:
+                cache.incr(self.version_key)
+            except ValueError:
+                # Evicted between add() and incr()
+                cache.set(self.version_key, 1, None)
+
+    @property
+    def plans(self):
+        return self._get_catalog().plans
+
+    @property
+    def active_plans(self):
+        return self._get_catalog().active_plans
+
+    def get(self, plan_id):
+        """
+        Returns the plan with the given plan_id, or None.
+        """
+        return self._get_catalog().by_plan_id.get(plan_id)
+
+    def get_by_name(self, name):
+        """
+        Returns the plan with the given name, or None.
+        """
+        return self._get_catalog().by_name.get(name)
+
+    def get_default_plan(self):
+        """
+        Returns the default plan named in settings or the most recent
+        default plan, like Plan.get_default_plan.
+        """
+        catalog = self._get_catalog()
+        if plan_settings.DEFAULT_PLAN:
+            try:
+                return catalog.by_name[plan_settings.DEFAULT_PLAN]
+            except KeyError:
+                plan_model = apps.get_model('plans', 'Plan')
+                raise plan_model.DoesNotExist(
+                    "Default plan %r does not exist" %
+                    plan_settings.DEFAULT_PLAN)
+        return catalog.default_plan
+
+
+plan_catalog = PlanCatalog()
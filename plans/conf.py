@@ -5,35 +5,111 @@ For exemple:
 
     PLANS = {
         "DEFAULT_PLAN": "plan_name",
-        "BILLING_GATEWAY": "plans.gateway.BraintreeGateway",
+        "BILLING_GATEWAY": "plans.gateway.braintree_payements_gateway.BraintreeGateway",
+        "GATEWAY_SETTINGS": {
+            "MERCHANT_ACCOUNT_ID": "merchant_id",
+            "PUBLIC_KEY": "public_key",
+            "PRIVATE_KEY": "private_key",
+        },
         "TEST_MODE": False,
         "STORE_CUSTOMER_INFO": False,
         "TAXATION_POLICY": "plans.taxation.EUTaxationPolicy",
         "TAX_PERCENT": "10", # Tax is 10%
+        "TAX_COUNTRY": "FR",
+        "VAT_VALIDATION_TIMEOUT": 86400,
+        "CACHE_ALIAS": "default",
+        "SUBSCRIPTION_CACHE_TIMEOUT": 300,
+        "GATEWAY_CONCURRENCY": 8,
+        "GATEWAY_TIMEOUT": 30,
+        "DUNNING_GRACE_DAYS": 14,
+        "USAGE_FLUSH_INTERVAL": 10,
+        "USAGE_BUFFER_SIZE": 10000,
+        "ENTITLEMENT_CACHE_TIMEOUT": 60,
     }
+
+CACHE_ALIAS is the Django cache shared between processes. Running
+subscriptions and the plan catalog are only cached in process memory when it
+is None.
+
+TAXATION_POLICY computes the tax rate of each customer, see plans.taxation.
+TAX_PERCENT is the default rate, and TAX_COUNTRY the country the seller is
+established in. VAT numbers validation results are cached in process memory
+for VAT_VALIDATION_TIMEOUT seconds, or not at all when it is 0.
+
+GATEWAY_CONCURRENCY is the number of gateway calls kept in flight by billing
+runs, and GATEWAY_TIMEOUT the number of seconds to wait for each call, also
+applied when calls are made one at a time. A call that times out is not
+interrupted: it keeps its thread until the gateway answers.
+
+DUNNING_GRACE_DAYS is the number of days past due subscriptions are retried
+before they expire, see plans.transitions.sweep.
+
+Metered usage is buffered in process memory and written to the database
+every USAGE_FLUSH_INTERVAL seconds, or once USAGE_BUFFER_SIZE counters are
+buffered, see plans.metering.
+
+The entitlements of users are computed once and kept in process memory for
+ENTITLEMENT_CACHE_TIMEOUT seconds, see plans.entitlements.
+
+The settings are validated once, when the application is ready, and read
+from plan_settings: a read-only view on a frozen snapshot of them, which is
+rebuilt when the PLANS setting changes (e.g. with override_settings). The
+gateway module, which may import a heavy SDK, is only loaded by the first
+call to plans.gateway.get_gateway().
 """
+from decimal import Decimal, InvalidOperation
 
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 
-from utils.loader import load_class
-from gateway.base import Gateway
-
+from .utils.loader import load_class
 
-USER_SETTINGS = getattr(settings, "PLANS", None)
 
 DEFAULT_SETTINGS = {
     "DEFAULT_PLAN": None,
+    "BILLING_GATEWAY": None,
+    "TAXATION_POLICY": None,
+    "GATEWAY_SETTINGS": None,
     "TEST_MODE": False,
     "STORE_CUSTOMER_INFO": True,
     "TAX_PERCENT": 0,
+    "TAX_COUNTRY": None,
+    "VAT_VALIDATION_TIMEOUT": 86400,
+    "CACHE_ALIAS": None,
+    "SUBSCRIPTION_CACHE_TIMEOUT": 300,
+    "GATEWAY_CONCURRENCY": 1,
+    "GATEWAY_TIMEOUT": None,
+    "DUNNING_GRACE_DAYS": 14,
+    "USAGE_FLUSH_INTERVAL": 10,
+    "USAGE_BUFFER_SIZE": 10000,
+    "ENTITLEMENT_CACHE_TIMEOUT": 60,
 }
 
 
-class NotFoundAttribute(Exception):
+class NotFoundAttribute(AttributeError):
     pass
 
 
+def load_gateway_class(path):
+    """
+    Load the gateway class at the given dotted path, or raise
+    ImproperlyConfigured.
+    """
+    from .gateway.base import Gateway
+    if not path:
+        raise ImproperlyConfigured("No billing gateway specified in your "
+                                   "settings.")
+    try:
+        gateway = load_class(path)
+    except (ImportError, AttributeError):
+        raise ImproperlyConfigured("Missing gateway: %s" % path)
+    # check if the gateway inherits from the Gateway abstract class
+    assert isinstance(gateway, type) and issubclass(gateway, Gateway)
+    return gateway
+
+
 class Settings(object):
     """
     A settings object that allows us to access to all settings as properties.
@@ -48,42 +124,116 @@ class Settings(object):
         1) the gateway is required and should be a class
         2) the gateway should inherits from the Gateway base class
         """
-        try:
-            self.gateway = load_class(self.BILLING_GATEWAY)
-        except NotFoundAttribute:
-            raise ImproperlyConfigured("No billing gateway specified in your "
-                                       "settings.")
-        except ImportError:
-            raise ImproperlyConfigured("Missing gateway: %s" % (
-                                            self.BILLING_GATEWAY
-                                      )
-            )
-        # check if the gateway inherits from the Gateway abstract class
-        assert isinstance(self.gateway, Gateway)
+        self.gateway = load_gateway_class(self.BILLING_GATEWAY)
 
     def _check_tax_percent(self):
         """Check the value of TAX_PERCENT setting"""
-        assert 0 <= self.TAX_PERCENT <= 100
+        try:
+            self.tax_percent = Decimal(str(self.TAX_PERCENT))
+        except InvalidOperation:
+            raise ImproperlyConfigured("Invalid tax percent: %s" % (
+                                            self.TAX_PERCENT
+                                      )
+            )
+        assert 0 <= self.tax_percent <= 100
 
     def _check_tax_policy(self):
         """Check TAXATION_POLICY setting"""
+        self.tax_policy = None
         if self.TAXATION_POLICY:
             try:
                 self.tax_policy = load_class(self.TAXATION_POLICY)
-            except ImportError:
+            except (ImportError, AttributeError):
                 raise ImproperlyConfigured("Missing taxation policy: %s" % (
                                                 self.TAXATION_POLICY
                                           )
                 )
 
+    def freeze(self):
+        """
+        Validate the settings and return them as a SettingsSnapshot. The
+        gateway is not loaded here, see load_gateway_class().
+        """
+        self._check_tax_policy()
+        self._check_tax_percent()
+        values = dict((name, getattr(self, name))
+                      for name in self.default_settings)
+        return SettingsSnapshot(tax_policy=self.tax_policy,
+                                tax_percent=self.tax_percent,
+                                **values)
+
     def __getattr__(self, attr):
+        if attr in self.user_settings:
+            val = self.user_settings[attr]
+        elif attr in self.default_settings:
+            val = self.default_settings[attr]
+        else:
+            raise NotFoundAttribute("Unknown plans setting: %s" % attr)
+        # Cache the result
+        setattr(self, attr, val)
+        return val
+
+
+class SettingsSnapshot(object):
+    """
+    Immutable, validated settings. Besides the settings themselves, holds
+    the resolved taxation policy class and tax percent.
+    """
+    __slots__ = tuple(DEFAULT_SETTINGS) + ("tax_policy", "tax_percent")
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            object.__setattr__(self, name, values[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError("plans settings are read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError("plans settings are read-only")
+
+
+class PlanSettings(object):
+    """
+    Read-only view on the current settings snapshot. Attributes are copied
+    into the instance dict on first access, so that later lookups are plain
+    attribute lookups.
+    """
+    _snapshot = None
+
+    def __getattr__(self, attr):
+        if self._snapshot is None:
+            self.reload()
         try:
-            val = self.user_settings.get(attr, self.default_settings[attr])
-            # Cache the result
-            setattr(self, attr, val)
-            return val
-        except KeyError:
-            raise NotFoundAttribute
+            val = getattr(self._snapshot, attr)
+        except AttributeError:
+            raise NotFoundAttribute("Unknown plans setting: %s" % attr)
+        self.__dict__[attr] = val
+        return val
+
+    def __setattr__(self, name, value):
+        raise AttributeError("plans settings are read-only, change the PLANS "
+                             "setting instead")
+
+    def reload(self):
+        """
+        Validate the PLANS setting and take a new snapshot of it.
+        """
+        snapshot = Settings(getattr(settings, "PLANS", None),
+                            DEFAULT_SETTINGS).freeze()
+        self.__dict__.clear()
+        self.__dict__["_snapshot"] = snapshot
+
+
+plan_settings = PlanSettings()
 
 
-plan_settings = Settings(USER_SETTINGS, DEFAULT_SETTINGS)
+@receiver(setting_changed)
+def reload_plan_settings(setting, **kwargs):
+    if setting == "PLANS":
+        from .entitlements import entitlement_map
+        from .gateway import reset_gateway
+        from .taxation import reset_tax_policy
+        plan_settings.reload()
+        entitlement_map.reset()
+        reset_gateway()
+        reset_tax_policy()
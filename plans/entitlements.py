@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Features and quotas granted to users by their plans.
+
+Each plan grants features through its Entitlement rows, with an optional
+quota (e.g. "projects", 10). A user is entitled to the features of the
+plans of their running subscriptions, or of the default plan if they have
+none:
+
+    if has_entitlement(request.user, "export"):
+        ...
+    if not has_entitlement(request.user, "projects", usage=count):
+        raise QuotaExceeded
+
+Checks are served from process memory: the entitlements of every plan are
+loaded with one query, and the entitlements of each user are computed with
+one more query on first use, then kept for ENTITLEMENT_CACHE_TIMEOUT
+seconds. Saving or deleting a plan, an entitlement, a vault or a
+subscription drops the affected entries of this process once the
+transaction commits; the other processes see the change once their entries
+expire.
+"""
+import threading
+import time
+
+from django.apps import apps
+
+from .cache import TTLCache, get_shared_cache
+from .catalog import plan_catalog
+from .conf import plan_settings
+
+
+def merge_entitlements(entitlements):
+    """
+    Returns the union of {feature: limit} mappings, keeping the highest
+    limit of each feature. A None limit is unlimited.
+    """
+    merged = {}
+    for features in entitlements:
+        for feature, limit in features.items():
+            if feature not in merged:
+                merged[feature] = limit
+            elif merged[feature] is not None:
+                merged[feature] = (None if limit is None
+                                   else max(merged[feature], limit))
+    return merged
+
+
+class EntitlementMap(object):
+    """
+    In-process map of the entitlements of plans and users.
+
+    The returned mappings are shared by all the callers and should not be
+    modified.
+    """
+    version_key = "plans:entitlements:version"
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Drop all the entitlements of this process.
+        """
+        with self._lock:
+            # {plan pk: {feature: limit}}, with its shared version
+            self._plans = None
+            self._version = None
+            self._loaded = 0
+            # {user pk: {feature: limit}}, created on first use as the
+            # settings may not be loaded yet
+            self._users = None
+            self._vault_users = {}
+            # Incremented by each invalidation, so that entitlements loaded
+            # meanwhile are not kept
+            self._generation = 0
+
+    @property
+    def users(self):
+        users = self._users
+        if users is None:
+            with self._lock:
+                if self._users is None:
+                    self._users = TTLCache(
+                        plan_settings.ENTITLEMENT_CACHE_TIMEOUT)
+                users = self._users
+        return users
+
+    def in_use(self):
+        """
+        Returns whether entitlements were computed in this process, i.e.
+        whether changes of subscriptions need to be reported to this map.
+        """
+        return self._users is not None
+
+    @property
+    def stats(self):
+        return self.users.stats
+
+    def _get_plans(self):
+        cache = get_shared_cache()
+        if cache is not None:
+            version = cache.get(self.version_key, 0)
+            fresh = version == self._version
+        else:
+            version = None
+            fresh = (self.clock() - self._loaded <
+                     plan_settings.ENTITLEMENT_CACHE_TIMEOUT)
+        plans = self._plans
+        if plans is None or not fresh:
+            generation = self._generation
+            plans = {}
+            entitlement_model = apps.get_model('plans', 'Entitlement')
+            for plan_id, feature, limit in (
+                    entitlement_model.objects.values_list(
+                        'plan_id', 'feature', 'limit')):
+                plans.setdefault(plan_id, {})[feature] = limit
+            with self._lock:
+                if generation == self._generation:
+                    self._plans, self._version = plans, version
+                    self._loaded = self.clock()
+        return plans
+
+    def _load_user(self, user_id):
+        vault_model = apps.get_model('plans', 'UserVault')
+        subscription_model = apps.get_model('plans', 'Subscription')
+        generation = self._generation
+        plans = self._get_plans()
+        vault_ids = set()
+        plan_ids = set()
+        for vault_id, plan_id, status in vault_model.objects.filter(
+                user_id=user_id,
+        ).values_list('pk', 'subscription__plan_id', 'subscription__status'):
+            vault_ids.add(vault_id)
+            if status in subscription_model.RUNNING_STATUSES:
+                plan_ids.add(plan_id)
+        if not plan_ids:
+            default_plan = plan_catalog.get_default_plan()
+            if default_plan is not None:
+                plan_ids.add(default_plan.pk)
+        entitlements = merge_entitlements(plans.get(plan_id, {})
+                                          for plan_id in sorted(plan_ids))
+        users = self.users
+        with self._lock:
+            if generation != self._generation:
+                # Invalidated while loading, possibly from stale rows
+                return entitlements
+            for vault_id in vault_ids:
+                self._vault_users[vault_id] = user_id
+            users.set(user_id, entitlements)
+        return entitlements
+
+    def get(self, user):
+        """
+        Returns the {feature: limit} entitlements of the user.
+        """
+        user_id = user.pk
+        users = self._users
+        if users is not None:
+            entitlements = users.get(user_id)
+            if entitlements is not None:
+                return entitlements
+        if user_id is None:
+            # Anonymous users get the default plan
+            default_plan = plan_catalog.get_default_plan()
+            return self._get_plans().get(
+                default_plan.pk if default_plan else None, {})
+        return self._load_user(user_id)
+
+    def invalidate(self):
+        """
+        Drop the entitlements of all the plans and users of this process,
+        and the plans of the other ones if the CACHE_ALIAS setting is set.
+        """
+        with self._lock:
+            self._generation += 1
+            self._plans = None
+            if self._users is not None:
+                self._users.clear()
+            self._vault_users.clear()
+        cache = get_shared_cache()
+        if cache is not None:
+            cache.add(self.version_key, 0, None)
+            try:
+                cache.incr(self.version_key)
+            except ValueError:
+                # Evicted between add() and incr()
+                cache.set(self.version_key, 1, None)
+
+    def invalidate_users(self, user_ids):
+        """
+        Drop the entitlements of the given users.
+        """
+        users = self.users
+        with self._lock:
+            self._generation += 1
+            for user_id in user_ids:
+                users.delete(user_id)
+
+    def invalidate_vaults(self, vault_ids):
+        """
+        Drop the entitlements of the owners of the given vaults, after their
+        subscriptions changed.
+        """
+        with self._lock:
+            self._generation += 1
+            user_ids = set(self._vault_users.pop(vault_id, None)
+                           for vault_id in vault_ids)
+        user_ids.discard(None)
+        self.invalidate_users(user_ids)
+
+
+entitlement_map = EntitlementMap()
+
+
+def get_entitlements(user):
+    """
+    Returns the {feature: limit} entitlements of the user, see
+    EntitlementMap.
+    """
+    return entitlement_map.get(user)
+
+
+def has_entitlement(user, feature, usage=0):
+    """
+    Returns whether the plans of the user grant the feature and, if it has
+    a quota, whether usage is below it.
+    """
+    entitlements = entitlement_map.get(user)
+    if feature not in entitlements:
+        return False
+    limit = entitlements[feature]
+    return limit is None or usage < limit
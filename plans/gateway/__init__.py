@@ -1 +1,27 @@
 # -*- coding: utf-8 -*-
+
+_gateway = None
+
+
+def get_gateway():
+    """
+    Returns the instance of the billing gateway configured by the
+    BILLING_GATEWAY setting.
+
+    The gateway module is imported on the first call only, so that
+    processes which never charge do not pay for its dependencies.
+    """
+    global _gateway
+    if _gateway is None:
+        from plans.conf import load_gateway_class, plan_settings
+        _gateway = load_gateway_class(plan_settings.BILLING_GATEWAY)()
+    return _gateway
+
+
+def reset_gateway():
+    """
+    Drop the gateway instance of this process, e.g. after a change of
+    settings.
+    """
+    global _gateway
+    _gateway = None
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio interface of the billing gateways, for ASGI applications.
+
+This module requires Python 3.5 or later.
+"""
+import asyncio
+import functools
+import weakref
+
+from concurrent.futures import ThreadPoolExecutor
+
+from plans.conf import plan_settings
+from .base import Gateway, GatewayTimeout
+
+
+class AsyncGateway(object):
+    """
+    Base class for asynchronous billing gateways.
+
+    The number of concurrent calls is limited to max_concurrency, which
+    defaults to the GATEWAY_CONCURRENCY setting; the other calls wait for a
+    slot without using a thread. Each call is given timeout seconds, the
+    GATEWAY_TIMEOUT setting by default, before raising GatewayTimeout.
+
+    Subclasses implement the underscored coroutines (_charge, _refund...).
+    """
+    name = None
+    default_currency = None
+    # list of supported card types
+    supported_card_types = []
+
+    validate = Gateway.validate
+    validate_many = Gateway.validate_many
+
+    def __init__(self, max_concurrency=None, timeout=None):
+        self.max_concurrency = (max_concurrency or
+                                plan_settings.GATEWAY_CONCURRENCY)
+        if timeout is None:
+            timeout = plan_settings.GATEWAY_TIMEOUT
+        self.timeout = timeout
+        # Semaphores are bound to the event loop they are used in
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _semaphore(self):
+        loop = asyncio.get_event_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(
+                self.max_concurrency)
+        return semaphore
+
+    async def _limit(self, coroutine_function, *args):
+        async with self._semaphore():
+            try:
+                return await asyncio.wait_for(coroutine_function(*args),
+                                              self.timeout)
+            except asyncio.TimeoutError:
+                raise GatewayTimeout("No response from %s in %s seconds" % (
+                    self.name, self.timeout))
+
+    async def charge(self, credit_card, amount, options=None):
+        """
+        Charges the credit card with the provided amount, see Gateway.charge.
+        """
+        return await self._limit(self._charge, credit_card, amount, options)
+
+    async def refund(self, transaction_id, amount=None):
+        """
+        Refund transaction with the given ID, see Gateway.refund.
+        """
+        return await self._limit(self._refund, transaction_id, amount)
+
+    async def void(self, transaction_id):
+        """
+        Void transaction, see Gateway.void.
+        """
+        return await self._limit(self._void, transaction_id)
+
+    async def subscribe(self, credit_card, options=None):
+        """
+        Subscribe customer, see Gateway.subscribe.
+        """
+        return await self._limit(self._subscribe, credit_card, options)
+
+    async def unsubscribe(self, credit_card, options=None):
+        """
+        Unsubscribe customer, see Gateway.unsubscribe.
+        """
+        return await self._limit(self._unsubscribe, credit_card, options)
+
+    async def store(self, credit_card, options=None):
+        """
+        Store the credit card and customer information, see Gateway.store.
+        """
+        return await self._limit(self._store, credit_card, options)
+
+    async def unstore(self, credit_card, options=None):
+        """
+        Remove the stored credit card, see Gateway.unstore.
+        """
+        return await self._limit(self._unstore, credit_card, options)
+
+    async def _charge(self, credit_card, amount, options):
+        raise NotImplementedError
+
+    async def _refund(self, transaction_id, amount):
+        raise NotImplementedError
+
+    async def _void(self, transaction_id):
+        raise NotImplementedError
+
+    async def _subscribe(self, credit_card, options):
+        raise NotImplementedError
+
+    async def _unsubscribe(self, credit_card, options):
+        raise NotImplementedError
+
+    async def _store(self, credit_card, options):
+        raise NotImplementedError
+
+    async def _unstore(self, credit_card, options):
+        raise NotImplementedError
+
+
+class SyncGatewayAdapter(AsyncGateway):
+    """
+    Runs the calls of a synchronous Gateway in a thread pool sized to
+    max_concurrency, e.g.:
+
+        gateway = SyncGatewayAdapter(BraintreeGateway())
+        transaction_id = await gateway.charge(None, amount, options)
+    """
+    def __init__(self, gateway, max_concurrency=None, timeout=None,
+                 executor=None):
+        super(SyncGatewayAdapter, self).__init__(max_concurrency, timeout)
+        self.gateway = gateway
+        self.name = gateway.name
+        self.default_currency = gateway.default_currency
+        self.supported_card_types = gateway.supported_card_types
+        self.executor = executor or ThreadPoolExecutor(self.max_concurrency)
+
+    def _run(self, method, *args):
+        return asyncio.get_event_loop().run_in_executor(
+            self.executor, functools.partial(getattr(self.gateway, method),
+                                             *args))
+
+    def close(self):
+        """
+        Shuts the thread pool down, waiting for the running calls.
+        """
+        self.executor.shutdown()
+
+    async def _charge(self, credit_card, amount, options):
+        return await self._run("charge", credit_card, amount, options)
+
+    async def _refund(self, transaction_id, amount):
+        return await self._run("refund", transaction_id, amount)
+
+    async def _void(self, transaction_id):
+        return await self._run("void", transaction_id)
+
+    async def _subscribe(self, credit_card, options):
+        return await self._run("subscribe", credit_card, options)
+
+    async def _unsubscribe(self, credit_card, options):
+        return await self._run("unsubscribe", credit_card, options)
+
+    async def _store(self, credit_card, options):
+        return await self._run("store", credit_card, options)
+
+    async def _unstore(self, credit_card, options):
+        return await self._run("unstore", credit_card, options)
@@ -1,12 +1,68 @@
 # -*- coding: utf-8 -*-
+from collections import namedtuple
 
-from plans.utils.credit_card import CardNotSupported
+from plans.utils.credit_card import (
+    CardNotSupported,
+    CardValidation,
+    expiry_checker,
+    get_iin_trie,
+    luhn_valid,
+)
 
 
 class GatewayNotConfigured(Exception):
     pass
 
 
+class GatewayError(Exception):
+    """
+    Raised by gateways when a transaction is declined or fails.
+    """
+    pass
+
+
+class GatewayTimeout(Exception):
+    """
+    Raised when a gateway call did not complete in time. The outcome of the
+    call is unknown.
+    """
+    pass
+
+
+class GatewayNotSent(Exception):
+    """
+    Returned for a gateway call canceled before it was made: the gateway
+    never received it, so it can be retried.
+    """
+    pass
+
+
+class InvalidWebhook(Exception):
+    """
+    Raised when a webhook request can not be verified or parsed.
+    """
+    pass
+
+
+# Event pushed by a gateway, see Gateway.parse_webhook. event_id is unique
+# per gateway; amount and next_billing_date may be None.
+GatewayEvent = namedtuple(
+    "GatewayEvent",
+    "event_id kind subscription_id transaction_id amount currency "
+    "next_billing_date payload")
+
+# Kinds of GatewayEvent
+CHARGED, DECLINED, ACTIVATED, PAST_DUE, CANCELED, EXPIRED = (
+    "charged",
+    "declined",
+    "activated",
+    "past_due",
+    "canceled",
+    "expired",
+)
+EVENT_KINDS = (CHARGED, DECLINED, ACTIVATED, PAST_DUE, CANCELED, EXPIRED)
+
+
 class Gateway(object):
     """
     Base class for all billing gateways.
@@ -33,9 +89,39 @@ class Gateway(object):
         # Check if credit card is valid
         return credit_card.is_valid()
 
+    def validate_many(self, credit_cards, today=None):
+        """
+        Validate the given credit cards in bulk and return a list of
+        CardValidation results, in the same order.
+
+        Card types are resolved through a prefix tree built once from the
+        supported card types, and the current date is computed once for
+        the whole batch. Unsupported cards get a None card_type instead of
+        raising CardNotSupported.
+        """
+        trie = get_iin_trie(self.supported_card_types)
+        is_expired = expiry_checker(today)
+        results = []
+        for credit_card in credit_cards:
+            card_type = trie.lookup(credit_card.number)
+            if card_type is not None:
+                credit_card.card_type = card_type
+            results.append(CardValidation(
+                card_type,
+                luhn_valid(credit_card.number),
+                is_expired(credit_card.year, credit_card.month),
+            ))
+        return results
+
     def charge(self, credit_card, amount, options=None):
         """
-        Charges the credit card with the provided amount.
+        Charges the credit card with the provided amount and returns the
+        transaction ID, or raise GatewayError.
+
+        credit_card is None when charging a stored vault, identified by the
+        "vault_id" and "token" options. The "idempotency_key" option is the
+        same when a charge whose outcome is unknown is made again, gateways
+        supporting it should not charge twice for one key.
         """
         raise NotImplementedError
 
@@ -75,3 +161,10 @@ class Gateway(object):
         Store the credit card and customer information on the gateway.
         """
         raise NotImplementedError
+
+    def parse_webhook(self, request):
+        """
+        Verifies a webhook request of the gateway and returns the list of
+        GatewayEvent it carries, or raise InvalidWebhook.
+        """
+        raise NotImplementedError
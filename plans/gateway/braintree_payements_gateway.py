@@ -1,9 +1,125 @@
 # -*- coding: utf-8 -*-
+import functools
+import hashlib
+import threading
+
 import braintree
+import requests
+
+from braintree.exceptions.braintree_error import BraintreeError
+from braintree.util.http import Http
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 
 from plans.conf import plan_settings
 from plans.utils.credit_card import Visa, MasterCard, AmericanExpress, Discover
-from .base import Gateway, GatewayNotConfigured
+from . import base
+from .base import (
+    Gateway,
+    GatewayError,
+    GatewayEvent,
+    GatewayNotConfigured,
+    InvalidWebhook,
+)
+
+
+class SessionHttp(Http):
+
+    """
+    Braintree HTTP strategy sending the requests through a shared
+    requests.Session, so that connections to Braintree are kept alive and
+    reused instead of paying a TLS handshake per request.
+    """
+
+    def __init__(self, config, environment=None, session=None):
+        super(SessionHttp, self).__init__(config, environment)
+        self.session = session
+
+    def http_do(self, http_verb, path, headers, request_body):
+        data = request_body
+        files = None
+        if type(request_body) is tuple:
+            data, files = request_body
+        if self.config.environment == braintree.Environment.Development:
+            verify = False
+        else:
+            verify = self.environment.ssl_certificate
+        response = self.session.request(http_verb, path, headers=headers,
+                                        data=data, files=files,
+                                        verify=verify,
+                                        timeout=self.config.timeout)
+        return [response.status_code, response.text]
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Returns the braintree.BraintreeGateway client of this process.
+
+    It is built once from the GATEWAY_SETTINGS setting, with a pool of
+    GATEWAY_CONCURRENCY keep-alive connections, and is shared by all the
+    threads: Braintree's global configuration is never modified.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _build_client()
+    return _client
+
+
+def reset_client():
+    """
+    Drop the client of this process, e.g. after a change of settings.
+    """
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.config.http_strategy().session.close()
+        _client = None
+
+
+@receiver(setting_changed)
+def reset_client_on_setting_changed(setting, **kwargs):
+    if setting == "PLANS":
+        reset_client()
+
+
+def _build_client():
+    if plan_settings.TEST_MODE:
+        env = braintree.Environment.Sandbox
+    else:
+        env = braintree.Environment.Production
+    gateway_settings = plan_settings.GATEWAY_SETTINGS
+    pool_size = max(plan_settings.GATEWAY_CONCURRENCY, 10)
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                            pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return braintree.BraintreeGateway(braintree.Configuration(
+        env,
+        gateway_settings['MERCHANT_ACCOUNT_ID'],
+        gateway_settings['PUBLIC_KEY'],
+        gateway_settings['PRIVATE_KEY'],
+        http_strategy=functools.partial(SessionHttp, session=session),
+    ))
+
+
+_Kind = braintree.WebhookNotification.Kind
+
+# Kinds of the Braintree notifications consumed, see parse_webhook
+WEBHOOK_KINDS = {
+    _Kind.SubscriptionChargedSuccessfully: base.CHARGED,
+    _Kind.SubscriptionChargedUnsuccessfully: base.DECLINED,
+    _Kind.SubscriptionWentActive: base.ACTIVATED,
+    _Kind.SubscriptionWentPastDue: base.PAST_DUE,
+    _Kind.SubscriptionCanceled: base.CANCELED,
+    _Kind.SubscriptionExpired: base.EXPIRED,
+}
 
 
 class BraintreeGateway(Gateway):
@@ -17,11 +133,6 @@ class BraintreeGateway(Gateway):
     supported_card_types = [Visa, MasterCard, AmericanExpress, Discover]
 
     def __init__(self):
-        test_mode = plan_settings.TEST_MODE
-        if test_mode:
-            env = braintree.Environment.Sandbox
-        else:
-            env = braintree.Environment.Production
         gateway_settings = plan_settings.GATEWAY_SETTINGS
         if (not gateway_settings
                 or not gateway_settings.get("MERCHANT_ACCOUNT_ID")
@@ -30,9 +141,81 @@ class BraintreeGateway(Gateway):
             ):
             raise GatewayNotConfigured("'%s' gateway is not correctly "
                                        "configured." % self.name)
-        braintree.Configuration.configure(
-            env,
-            gateway_settings['MERCHANT_ACCOUNT_ID'],
-            gateway_settings['PUBLIC_KEY'],
-            gateway_settings['PRIVATE_KEY']
-        )
+
+    @property
+    def client(self):
+        return get_client()
+
+    def _check(self, result):
+        if not result.is_success:
+            raise GatewayError(result.message)
+        return result.transaction.id
+
+    def charge(self, credit_card, amount, options=None):
+        """
+        Sales are submitted for settlement at once, in the currency of the
+        merchant account. Braintree has no idempotency keys: the
+        idempotency_key option is sent as the order id, so that a charge
+        made again can be found in the Control Panel, but the gateway does
+        not refuse it, and a charge whose outcome is unknown may be made
+        twice.
+        """
+        options = options or {}
+        params = {
+            "amount": str(amount),
+            "options": {"submit_for_settlement": True},
+        }
+        if options.get("idempotency_key"):
+            params["order_id"] = options["idempotency_key"]
+        if credit_card is None:
+            params["payment_method_token"] = options["token"]
+        else:
+            params["credit_card"] = {
+                "cardholder_name": credit_card.name,
+                "number": credit_card.number,
+                "cvv": credit_card.cvv,
+                "expiration_month": "%02d" % credit_card.month,
+                "expiration_year": str(credit_card.year),
+            }
+        return self._check(self.client.transaction.sale(params))
+
+    def refund(self, transaction_id, amount=None):
+        if amount is not None:
+            amount = str(amount)
+        return self._check(self.client.transaction.refund(transaction_id,
+                                                          amount))
+
+    def void(self, transaction_id):
+        return self._check(self.client.transaction.void(transaction_id))
+
+    def parse_webhook(self, request):
+        """
+        Parses a Braintree notification, POSTed as the bt_signature and
+        bt_payload form fields. Notifications carry no id, the hash of the
+        payload is used instead. Other kinds of notifications are ignored.
+        """
+        payload = request.POST.get("bt_payload", "")
+        try:
+            notification = self.client.webhook_notification.parse(
+                request.POST.get("bt_signature", ""), payload)
+        except (BraintreeError, ValueError) as e:
+            raise InvalidWebhook(str(e))
+        kind = WEBHOOK_KINDS.get(notification.kind)
+        if kind is None:
+            return []
+        subscription = notification.subscription
+        transaction = None
+        if kind in (base.CHARGED, base.DECLINED) and subscription.transactions:
+            transaction = subscription.transactions[0]
+        return [GatewayEvent(
+            event_id=hashlib.sha256(payload.encode("utf-8")).hexdigest(),
+            kind=kind,
+            subscription_id=subscription.id,
+            transaction_id=transaction.id if transaction else "",
+            amount=transaction.amount if transaction else None,
+            currency=getattr(transaction, "currency_iso_code", None)
+            or self.default_currency,
+            next_billing_date=getattr(subscription, "next_billing_date",
+                                      None),
+            payload=payload,
+        )]
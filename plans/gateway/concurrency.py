@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent gateway calls.
+
+Gateway calls are network-bound, so a billing run spends most of its time
+waiting for the payment processor. ConcurrentGateway keeps several calls in
+flight using a bounded pool of threads.
+"""
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from plans.conf import plan_settings
+from .base import GatewayNotSent, GatewayTimeout
+
+
+class CallResult(namedtuple('CallResult', 'value error')):
+    """
+    Result of a gateway call: its return value, or the exception it raised.
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class ConcurrentGateway(object):
+    """
+    Runs the calls of a gateway in a pool of threads.
+
+    The number of threads defaults to the GATEWAY_CONCURRENCY setting, and
+    the number of seconds to wait for each call to GATEWAY_TIMEOUT. With a
+    concurrency of 1 and no timeout, calls are made in the calling thread;
+    with a timeout, they are made one at a time in a worker thread, so that
+    the caller stops waiting for a call once it times out.
+
+    A timed out call cannot be interrupted: it keeps running, and holding
+    its worker thread, until the gateway returns or fails. Its result is a
+    GatewayTimeout, the outcome of the call being unknown, while a call
+    still waiting for a thread when it times out is canceled and its result
+    is a GatewayNotSent.
+
+    Gateway methods should not use the database: threads of the pool do not
+    share the connection of the calling thread.
+    """
+    def __init__(self, gateway, concurrency=None, timeout=None):
+        self.gateway = gateway
+        self.concurrency = concurrency or plan_settings.GATEWAY_CONCURRENCY
+        if timeout is None:
+            timeout = plan_settings.GATEWAY_TIMEOUT
+        self.timeout = timeout
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Shuts the pool down, waiting for the running calls.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.concurrency)
+        return self._executor
+
+    def imap(self, method, calls):
+        """
+        Calls the given gateway method with each tuple of positional
+        arguments in calls and yields CallResult in the same order.
+
+        At most twice the concurrency calls are submitted ahead, so calls can
+        be a generator of any length.
+        """
+        func = getattr(self.gateway, method)
+        if self.concurrency <= 1:
+            for args in calls:
+                if self.timeout is None:
+                    yield _call(func, args)
+                    continue
+                result = self._result(self.executor.submit(_call, func, args))
+                if isinstance(result.error, GatewayTimeout):
+                    # The next calls must not wait for the one still running
+                    # in the worker thread
+                    self._executor.shutdown(wait=False)
+                    self._executor = None
+                yield result
+            return
+        pending = deque()
+        for args in calls:
+            pending.append(self.executor.submit(_call, func, args))
+            if len(pending) >= 2 * self.concurrency:
+                yield self._result(pending.popleft())
+        while pending:
+            yield self._result(pending.popleft())
+
+    def map(self, method, calls):
+        """
+        Like imap, but returns a list.
+        """
+        return list(self.imap(method, calls))
+
+    def _result(self, future):
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # Only cancels a call still waiting for a thread, a running call
+            # keeps its thread until it returns
+            if future.cancel():
+                return CallResult(None, GatewayNotSent(
+                    "No thread for %s in %s seconds" % (self.gateway.name,
+                                                        self.timeout)))
+            return CallResult(None, GatewayTimeout(
+                "No response from %s in %s seconds" % (self.gateway.name,
+                                                      self.timeout)))
+
+
+def _call(func, args):
+    try:
+        return CallResult(func(*args), None)
+    except Exception as e:
+        return CallResult(None, e)
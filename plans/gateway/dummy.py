@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import hmac
+import json
+import time
+import uuid
+
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from plans.utils.credit_card import Visa, MasterCard, AmericanExpress, Discover
+from .base import (
+    EVENT_KINDS,
+    Gateway,
+    GatewayError,
+    GatewayEvent,
+    InvalidWebhook,
+)
+
+
+class DummyGateway(Gateway):
+
+    """
+    In-process gateway accepting every transaction, for tests, development
+    and benchmarks. Each call sleeps for `latency` seconds to simulate the
+    round trip to a payment processor, and charges of the vaults listed in
+    `declined_vaults` are declined.
+
+    Webhooks are JSON lists of events, signed with the hex HMAC-SHA256 of
+    the body in the X-Signature header if `webhook_secret` is set.
+    """
+
+    name = "Dummy Gateway"
+    default_currency = "USD"
+    supported_card_types = [Visa, MasterCard, AmericanExpress, Discover]
+
+    def __init__(self, latency=0, declined_vaults=(), webhook_secret=None):
+        self.latency = latency
+        self.declined_vaults = set(declined_vaults)
+        self.webhook_secret = webhook_secret
+
+    def _transaction(self):
+        if self.latency:
+            time.sleep(self.latency)
+        return uuid.uuid4().hex
+
+    def charge(self, credit_card, amount, options=None):
+        options = options or {}
+        transaction_id = self._transaction()
+        if options.get("vault_id") in self.declined_vaults:
+            raise GatewayError("Charge declined")
+        return transaction_id
+
+    def refund(self, transaction_id, amount=None):
+        return self._transaction()
+
+    def void(self, transaction_id):
+        return self._transaction()
+
+    def subscribe(self, credit_card, options=None):
+        return self._transaction()
+
+    def unsubscribe(self, credit_card, options=None):
+        return self._transaction()
+
+    def store(self, credit_card, options=None):
+        return self._transaction()
+
+    def unstore(self, credit_card, options=None):
+        return self._transaction()
+
+    def sign_webhook(self, body):
+        return hmac.new(self.webhook_secret.encode("utf-8"), body,
+                        hashlib.sha256).hexdigest()
+
+    def parse_webhook(self, request):
+        body = request.body
+        if self.webhook_secret is not None:
+            signature = request.META.get("HTTP_X_SIGNATURE", "")
+            if not hmac.compare_digest(self.sign_webhook(body), signature):
+                raise InvalidWebhook("Invalid signature")
+        try:
+            events = json.loads(body.decode("utf-8"))
+            return [self._event(event) for event in events]
+        except (ValueError, TypeError, KeyError, InvalidOperation) as e:
+            raise InvalidWebhook("Invalid payload: %s" % e)
+
+    def _event(self, event):
+        if event["kind"] not in EVENT_KINDS:
+            raise ValueError("unknown kind %r" % event["kind"])
+        amount = event.get("amount")
+        next_billing_date = event.get("next_billing_date")
+        return GatewayEvent(
+            event_id=event["id"],
+            kind=event["kind"],
+            subscription_id=event["subscription_id"],
+            transaction_id=event.get("transaction_id") or "",
+            amount=Decimal(amount) if amount is not None else None,
+            currency=event.get("currency") or self.default_currency,
+            next_billing_date=datetime.strptime(
+                next_billing_date, "%Y-%m-%d").date()
+            if next_billing_date else None,
+            payload=json.dumps(event, sort_keys=True),
+        )
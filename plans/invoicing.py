@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Invoicing of the charges recorded in PaymentLog.
+
+Invoices are created in batches: each batch reserves its numbers with one
+update of the InvoiceSequence counter of the year and is inserted with
+bulk_create, in one transaction, so that numbers have no gaps. Invoices are
+then rendered one at a time from a template compiled once, and streamed to
+files or to a response, so that memory does not grow with the number of
+invoices.
+"""
+import io
+import os
+
+from datetime import date
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import F
+from django.http import StreamingHttpResponse
+from django.template.loader import get_template
+
+from .models import BillingInfo, Invoice, InvoiceSequence
+from .reporting import payment_logs
+from .taxation import get_tax_policy
+
+
+INVOICE_TEMPLATE = "plans/invoice.html"
+
+DOCUMENT_HEADER = (
+    '<!DOCTYPE html>\n<html><head><meta charset="utf-8">'
+    '<style>.invoice { page-break-after: always; }</style>'
+    '</head><body>\n'
+)
+DOCUMENT_FOOTER = "</body></html>\n"
+
+
+def invoice_number(year, number):
+    return "%s-%06d" % (year, number)
+
+
+def reserve_invoice_numbers(name, count):
+    """
+    Reserves count numbers of the given sequence and returns the first one.
+    Should be called in the transaction creating the invoices.
+    """
+    sequence, _ = InvoiceSequence.objects.select_for_update().get_or_create(
+        name=name)
+    InvoiceSequence.objects.filter(pk=sequence.pk).update(
+        last_number=F('last_number') + count)
+    return sequence.last_number + 1
+
+
+def _billing_info(payment_log):
+    try:
+        return payment_log.vault.user.billinginfo
+    except BillingInfo.DoesNotExist:
+        return BillingInfo(user=payment_log.vault.user)
+
+
+def build_invoices(payment_logs, issued, first_number, tax_policy=None):
+    """
+    Returns unsaved invoices of the given payment logs, numbered from
+    first_number.
+    """
+    tax_policy = tax_policy or get_tax_policy()
+    billing_infos = [_billing_info(log) for log in payment_logs]
+    taxes = tax_policy.compute_included_taxes(
+        (billing_info, log.amount)
+        for billing_info, log in zip(billing_infos, payment_logs))
+    invoices = []
+    for i, (log, billing_info, tax) in enumerate(
+            zip(payment_logs, billing_infos, taxes)):
+        invoices.append(Invoice(
+            number=invoice_number(issued.year, first_number + i),
+            payment_log=log,
+            user=billing_info.user,
+            issued=issued,
+            name=billing_info.name or billing_info.user.get_username(),
+            street=billing_info.street,
+            zipcode=billing_info.zipcode,
+            city=billing_info.city,
+            country=billing_info.country,
+            tax_number=billing_info.tax_number,
+            currency=log.currency,
+            net_amount=log.amount - tax.amount,
+            tax_rate=tax.rate,
+            tax_amount=tax.amount,
+            amount=log.amount,
+        ))
+    return invoices
+
+
+def create_invoices(queryset=None, issued=None, batch_size=1000):
+    """
+    Creates the invoices of the uninvoiced payment logs of the queryset,
+    defaulting to the succeeded ones, and returns their number.
+    """
+    if queryset is None:
+        queryset = payment_logs()
+    issued = issued or date.today()
+    queryset = queryset.filter(invoice__isnull=True).select_related(
+        'vault__user__billinginfo').order_by('pk')
+    tax_policy = get_tax_policy()
+    created = 0
+    last_pk = None
+    while True:
+        chunk = queryset
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        logs = list(chunk[:batch_size])
+        if not logs:
+            return created
+        last_pk = logs[-1].pk
+        with transaction.atomic():
+            first_number = reserve_invoice_numbers(str(issued.year),
+                                                   len(logs))
+            Invoice.objects.bulk_create(build_invoices(
+                logs, issued, first_number, tax_policy))
+        created += len(logs)
+
+
+def iter_invoices(queryset, chunk_size=2000):
+    """
+    Yields the invoices of the queryset, using a server-side cursor where
+    the database supports it.
+    """
+    queryset = queryset.select_related('payment_log').order_by('pk')
+    try:
+        return queryset.iterator(chunk_size=chunk_size)
+    except TypeError:
+        # Django < 2.0 fetches a fixed number of rows at a time
+        return queryset.iterator()
+
+
+def render_invoices(invoices, template_name=INVOICE_TEMPLATE):
+    """
+    Yields (invoice, html) pairs, the template being loaded once.
+    """
+    template = get_template(template_name)
+    for invoice in invoices:
+        yield invoice, template.render({"invoice": invoice})
+
+
+def html_lines(invoices, template_name=INVOICE_TEMPLATE):
+    """
+    Yields an HTML document of the invoices, one invoice at a time.
+    """
+    yield DOCUMENT_HEADER
+    for _, html in render_invoices(invoices, template_name):
+        yield html
+    yield DOCUMENT_FOOTER
+
+
+def invoices_response(queryset, filename=None,
+                      template_name=INVOICE_TEMPLATE):
+    """
+    Returns a StreamingHttpResponse of an HTML document of the invoices.
+    """
+    response = StreamingHttpResponse(
+        html_lines(iter_invoices(queryset), template_name),
+        content_type="text/html; charset=utf-8")
+    if filename:
+        response['Content-Disposition'] = (
+            'attachment; filename="%s"' % filename)
+    return response
+
+
+def html_to_pdf(html, path):
+    """
+    Writes the HTML document as a PDF file. Requires WeasyPrint.
+    """
+    try:
+        from weasyprint import HTML
+    except ImportError:
+        raise ImproperlyConfigured("WeasyPrint is required to render "
+                                   "invoices as PDF.")
+    HTML(string=html).write_pdf(path)
+
+
+def write_invoices(queryset, directory, format="html",
+                   template_name=INVOICE_TEMPLATE):
+    """
+    Writes each invoice of the queryset to its own file of the directory,
+    named after its number, as HTML or PDF. Returns the number of files.
+    """
+    if format not in ("html", "pdf"):
+        raise ValueError("Unknown invoice format: %s" % format)
+    invoices = iter_invoices(queryset)
+    count = 0
+    for invoice, html in render_invoices(invoices, template_name):
+        document = DOCUMENT_HEADER + html + DOCUMENT_FOOTER
+        path = os.path.join(directory, "%s.%s" % (invoice.number, format))
+        if format == "pdf":
+            html_to_pdf(document, path)
+        else:
+            with io.open(path, "w", encoding="utf-8") as output:
+                output.write(document)
+        count += 1
+    return count
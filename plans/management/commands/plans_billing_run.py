@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from plans.billing import BillingRun
+
+
+class Command(BaseCommand):
+    help = "Charges the subscriptions due at the given date (today)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--date", dest="billing_date",
+            type=lambda value: datetime.strptime(value, "%Y-%m-%d").date(),
+            help="Billing date, as YYYY-MM-DD. Defaults to today.")
+        parser.add_argument(
+            "--chunk-size", dest="chunk_size", type=int, default=500,
+            help="Number of subscriptions charged per chunk.")
+        parser.add_argument(
+            "--concurrency", dest="concurrency", type=int,
+            help="Number of concurrent gateway calls. Defaults to the "
+                 "GATEWAY_CONCURRENCY setting.")
+        parser.add_argument(
+            "--worker-id", dest="worker_id",
+            help="Name of this worker, to run several workers in parallel. "
+                 "Each worker then leases the subscriptions it charges.")
+        parser.add_argument(
+            "--lease-seconds", dest="lease_seconds", type=int, default=600,
+            help="Duration of the leases taken by a worker.")
+
+    def handle(self, *args, **options):
+        run = BillingRun(billing_date=options["billing_date"],
+                         chunk_size=options["chunk_size"],
+                         concurrency=options["concurrency"],
+                         worker_id=options["worker_id"],
+                         lease_seconds=options["lease_seconds"]).run()
+        self.stdout.write("%s subscriptions charged, %s failed, %s errors, "
+                          "%s already reserved." % (run.charged, run.failed,
+                                                    run.errors, run.skipped))
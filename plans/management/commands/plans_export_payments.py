@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from plans.reporting import (
+    PERIODS,
+    csv_lines,
+    export_lines,
+    jsonl_lines,
+    payment_logs,
+    revenue_totals,
+)
+
+
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d")
+
+
+class Command(BaseCommand):
+    help = ("Exports the payment logs as CSV or JSON lines, or their totals "
+            "per currency and period.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--format", dest="format", choices=["csv", "jsonl"],
+            default="csv", help="Output format.")
+        parser.add_argument(
+            "--output", dest="output",
+            help="Output file. Defaults to the standard output.")
+        parser.add_argument(
+            "--start", dest="start", type=parse_date,
+            help="Export the payments made from this date, as YYYY-MM-DD.")
+        parser.add_argument(
+            "--end", dest="end", type=parse_date,
+            help="Export the payments made before this date, as YYYY-MM-DD.")
+        parser.add_argument(
+            "--totals", dest="totals", choices=sorted(PERIODS),
+            help="Export the totals per currency and per period instead.")
+        parser.add_argument(
+            "--chunk-size", dest="chunk_size", type=int, default=2000,
+            help="Number of rows fetched at a time.")
+
+    def handle(self, *args, **options):
+        queryset = payment_logs(options["start"], options["end"])
+        if options["totals"]:
+            fields = ("period", "currency", "total", "count")
+            totals = revenue_totals(queryset, options["totals"])
+            write_lines = {"csv": csv_lines, "jsonl": jsonl_lines}
+            lines = write_lines[options["format"]](
+                totals.values_list(*fields).iterator(), fields)
+        else:
+            lines = export_lines(queryset, options["format"],
+                                 chunk_size=options["chunk_size"])
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                output.writelines(lines)
+        else:
+            output = self.stdout
+            for line in lines:
+                output.write(line, ending="")
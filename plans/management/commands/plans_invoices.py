@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from plans.invoicing import create_invoices, write_invoices
+from plans.models import Invoice
+
+
+class Command(BaseCommand):
+    help = ("Creates the invoices of the uninvoiced payments, and optionally "
+            "writes the invoices issued at the given date to a directory.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--date", dest="issued",
+            type=lambda value: datetime.strptime(value, "%Y-%m-%d").date(),
+            help="Issue date, as YYYY-MM-DD. Defaults to today.")
+        parser.add_argument(
+            "--batch-size", dest="batch_size", type=int, default=1000,
+            help="Number of invoices created per batch.")
+        parser.add_argument(
+            "--output-dir", dest="output_dir",
+            help="Write the invoices issued at the date to this directory, "
+                 "one file per invoice.")
+        parser.add_argument(
+            "--format", dest="format", choices=["html", "pdf"],
+            default="html", help="Format of the written invoices.")
+
+    def handle(self, *args, **options):
+        issued = options["issued"] or datetime.today().date()
+        created = create_invoices(issued=issued,
+                                  batch_size=options["batch_size"])
+        self.stdout.write("%s invoices created." % created)
+        if options["output_dir"]:
+            written = write_invoices(Invoice.objects.filter(issued=issued),
+                                     options["output_dir"], options["format"])
+            self.stdout.write("%s invoices written." % written)
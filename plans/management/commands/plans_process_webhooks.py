@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+
+from plans.webhooks import WebhookProcessor
+
+
+class Command(BaseCommand):
+    help = "Applies the webhook events received from the billing gateway."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", dest="batch_size", type=int, default=500,
+            help="Number of events applied per transaction.")
+        parser.add_argument(
+            "--delay", dest="delay", type=int, default=5,
+            help="Leave the events received in the last seconds to the "
+                 "next run.")
+
+    def handle(self, *args, **options):
+        processor = WebhookProcessor(batch_size=options["batch_size"],
+                                     delay=options["delay"]).run()
+        self.stdout.write(
+            "%s events: %s transitions, %s billing dates, %s payments, "
+            "%s unknown" % (processor.events, processor.transitions,
+                            processor.billing_dates, processor.payments,
+                            processor.unknown))
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from plans.models import Plan
+from plans.proration import reprice
+
+
+class Command(BaseCommand):
+    help = ("Moves the running subscriptions of a plan to another one, "
+            "recording the prorated differences as adjustments.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("old_plan", help="plan_id of the current plan.")
+        parser.add_argument("new_plan", help="plan_id of the new plan.")
+        parser.add_argument(
+            "--date", dest="change_date",
+            type=lambda value: datetime.strptime(value, "%Y-%m-%d").date(),
+            help="Date of the change, as YYYY-MM-DD. Defaults to today.")
+        parser.add_argument(
+            "--no-prorate", dest="prorate", action="store_false",
+            help="Change the plans without recording adjustments.")
+        parser.add_argument(
+            "--chunk-size", dest="chunk_size", type=int, default=500,
+            help="Number of subscriptions moved per transaction.")
+
+    def get_plan(self, plan_id):
+        try:
+            return Plan.objects.get(plan_id=plan_id)
+        except Plan.DoesNotExist:
+            raise CommandError("Unknown plan: %s" % plan_id)
+
+    def handle(self, *args, **options):
+        repricing = reprice(self.get_plan(options["old_plan"]),
+                            self.get_plan(options["new_plan"]),
+                            options["change_date"], options["prorate"],
+                            options["chunk_size"])
+        self.stdout.write("%s subscriptions moved, %s adjustments, total %s"
+                          % (repricing.moved, repricing.adjustments,
+                             repricing.total))
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from plans.transitions import sweep
+
+
+class Command(BaseCommand):
+    help = ("Moves overdue subscriptions to past due, and expires the past "
+            "due ones at the end of their grace period.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--date", dest="today",
+            type=lambda value: datetime.strptime(value, "%Y-%m-%d").date(),
+            help="Date of the sweep, as YYYY-MM-DD. Defaults to today.")
+        parser.add_argument(
+            "--grace-days", dest="grace_days", type=int,
+            help="Defaults to the DUNNING_GRACE_DAYS setting.")
+
+    def handle(self, *args, **options):
+        moved = sweep(options["today"], options["grace_days"])
+        for (source, target), count in sorted(moved.items()):
+            self.stdout.write("%s -> %s: %s" % (source, target, count))
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from plans.trials import convert_trials
+
+
+class Command(BaseCommand):
+    help = ("Converts the ended trials to active subscriptions, or expires "
+            "them if their vault has no payment token.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--date", dest="today",
+            type=lambda value: datetime.strptime(value, "%Y-%m-%d").date(),
+            help="Date of the run, as YYYY-MM-DD. Defaults to today.")
+        parser.add_argument(
+            "--lookback", dest="lookback", type=int, default=30,
+            help="Number of days before the date to look for ended trials.")
+        parser.add_argument(
+            "--chunk-size", dest="chunk_size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        scheduler = convert_trials(options["today"], options["lookback"],
+                                   options["chunk_size"])
+        self.stdout.write("%s converted, %s expired" % (scheduler.converted,
+                                                       scheduler.expired))
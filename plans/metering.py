@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Metered usage (API calls, seats, GB...) of subscriptions.
+
+record_usage() only adds the quantity to a counter in process memory,
+keyed by subscription, metric and billing period. The counters are written
+to UsageRecord, one row per subscription, metric and period, every
+USAGE_FLUSH_INTERVAL seconds, by a background thread if the process is
+idle, or once USAGE_BUFFER_SIZE counters are buffered: existing rows are
+incremented with one UPDATE per chunk, and the missing ones are bulk
+inserted. The buffer is also flushed when the process exits; increments
+buffered by a process that is killed are lost.
+
+Billing runs charge the usage of the billing period ending at the billing
+date, priced with the UsageRate of the plan, on top of the plan price. A
+run flushes the buffer of its own process first. The other processes write
+their counters at most twice USAGE_FLUSH_INTERVAL seconds after recording
+them, so the run should start at least that long after the end of the
+period.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import BigIntegerField, Case, F, Q, Value, When
+
+from .conf import plan_settings
+from .models import UsageRate, UsageRecord
+from .taxation import quantize
+from .utils.dates import billing_period
+
+
+_logger = logging.getLogger("plans.metering")
+
+
+def usage_period(start_date, next_billing_date):
+    """
+    Returns the start date of the billing period usage is recorded in.
+    """
+    if next_billing_date is None:
+        return start_date
+    return billing_period(start_date, next_billing_date)[0]
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def write_usage(counts, chunk_size=250):
+    """
+    Adds the given {(subscription pk, metric, period start): quantity}
+    counts to the usage records, committing each chunk on its own.
+
+    The written counts are removed from counts, so that it holds the
+    unwritten ones if an exception is raised.
+    """
+    # Sorted, so that concurrent flushes lock the records in the same order
+    for chunk in _chunks(sorted(counts.items()), chunk_size):
+        try:
+            with transaction.atomic():
+                _write_chunk(chunk)
+        except IntegrityError:
+            # Some records were inserted concurrently by another process,
+            # they are incremented instead
+            with transaction.atomic():
+                _write_chunk(chunk)
+        for key, quantity in chunk:
+            del counts[key]
+
+
+def _write_chunk(chunk):
+    counts = dict(chunk)
+    existing = {}
+    rows = UsageRecord.objects.filter(
+        subscription_id__in=set(key[0] for key in counts),
+        period_start__in=set(key[2] for key in counts),
+    ).values_list('pk', 'subscription_id', 'metric', 'period_start')
+    for pk, subscription_id, metric, period_start in rows:
+        key = (subscription_id, metric, period_start)
+        if key in counts:
+            existing[key] = pk
+    if existing:
+        UsageRecord.objects.filter(pk__in=list(existing.values())).update(
+            quantity=F('quantity') + Case(*[
+                When(pk=pk, then=Value(counts[key]))
+                for key, pk in existing.items()
+            ], output_field=BigIntegerField()))
+    UsageRecord.objects.bulk_create([
+        UsageRecord(subscription_id=subscription_id, metric=metric,
+                    period_start=period_start, quantity=quantity)
+        for (subscription_id, metric, period_start), quantity
+        in chunk if (subscription_id, metric, period_start) not in existing
+    ])
+
+
+class UsageBuffer(object):
+    """
+    Thread-safe usage counters of a process, see record_usage().
+
+    While counters are buffered, a daemon thread flushes them once they
+    have been left unflushed for USAGE_FLUSH_INTERVAL seconds, so that an
+    idle process does not keep them.
+    """
+    def __init__(self, clock=time.time, chunk_size=250):
+        self.clock = clock
+        self.chunk_size = chunk_size
+        self._counts = defaultdict(int)
+        self._lock = threading.Lock()
+        self._flushed = clock()
+        self._timer = None
+
+    def __len__(self):
+        return len(self._counts)
+
+    def add(self, subscription, metric, quantity=1):
+        key = (subscription.pk, metric,
+               usage_period(subscription.start_date,
+                            subscription.next_billing_date))
+        with self._lock:
+            self._counts[key] += quantity
+            size = len(self._counts)
+            if self._timer is None:
+                self._timer = threading.Thread(target=self._run_timer,
+                                               name="plans-usage-flush")
+                self._timer.daemon = True
+                self._timer.start()
+        if (size >= plan_settings.USAGE_BUFFER_SIZE or
+                self.clock() - self._flushed >=
+                plan_settings.USAGE_FLUSH_INTERVAL):
+            self.flush()
+
+    def _run_timer(self):
+        while True:
+            interval = plan_settings.USAGE_FLUSH_INTERVAL
+            time.sleep(interval)
+            with self._lock:
+                if not self._counts:
+                    # Started again by the next add()
+                    self._timer = None
+                    return
+                due = self.clock() - self._flushed >= interval
+            if due:
+                try:
+                    self.flush()
+                except Exception:
+                    _logger.exception("Failed to flush the usage counters")
+                finally:
+                    # The connection of this thread
+                    connection.close()
+
+    def flush(self):
+        """
+        Writes the buffered counters and returns their number. The counters
+        not written are kept in the buffer if the write fails.
+        """
+        with self._lock:
+            counts, self._counts = self._counts, defaultdict(int)
+            self._flushed = self.clock()
+        size = len(counts)
+        if not size:
+            return 0
+        try:
+            write_usage(counts, self.chunk_size)
+        except Exception:
+            with self._lock:
+                for key, quantity in counts.items():
+                    self._counts[key] += quantity
+            raise
+        return size
+
+
+usage_buffer = UsageBuffer()
+atexit.register(usage_buffer.flush)
+
+
+def record_usage(subscription, metric, quantity=1):
+    """
+    Records that the subscription used quantity units of the metric, in
+    the current billing period of the subscription.
+    """
+    usage_buffer.add(subscription, metric, quantity)
+
+
+def flush_usage():
+    """
+    Writes the usage buffered by this process.
+    """
+    return usage_buffer.flush()
+
+
+def usage_charges(subscriptions):
+    """
+    Returns the usage charges of the subscriptions for the billing period
+    ending at their next billing date, as {subscription pk: Decimal}, with
+    one query for the usage records and one for the rates of their plans.
+    """
+    periods = defaultdict(list)
+    plans = {}
+    for subscription in subscriptions:
+        periods[usage_period(subscription.start_date,
+                             subscription.next_billing_date)].append(
+            subscription.pk)
+        plans[subscription.pk] = subscription.plan_id
+    if not periods:
+        return {}
+    # Subscriptions of a chunk mostly share a few billing periods
+    query = Q()
+    for period_start, pks in periods.items():
+        query |= Q(period_start=period_start, subscription_id__in=pks)
+    usage = list(UsageRecord.objects.filter(query).values_list(
+        'subscription_id', 'metric', 'quantity'))
+    if not usage:
+        return {}
+    rates = dict(((plan_id, metric), unit_price)
+                 for plan_id, metric, unit_price
+                 in UsageRate.objects.filter(
+                     plan_id__in=set(plans.values()),
+                 ).values_list('plan_id', 'metric', 'unit_price'))
+    charges = defaultdict(Decimal)
+    for subscription_id, metric, quantity in usage:
+        unit_price = rates.get((plans[subscription_id], metric))
+        if unit_price is not None:
+            charges[subscription_id] += unit_price * quantity
+    return dict((pk, quantize(amount)) for pk, amount in charges.items())
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:23
+from __future__ import unicode_literals
+
+import datetime
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django_countries.fields
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillingInfo',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tax_number', models.CharField(blank=True, db_index=True, max_length=200, verbose_name='VAT')),
+                ('name', models.CharField(db_index=True, max_length=200, verbose_name='Name')),
+                ('street', models.CharField(max_length=200, verbose_name='Street')),
+                ('zipcode', models.CharField(max_length=200, verbose_name='Zip code')),
+                ('city', models.CharField(max_length=200, verbose_name='City')),
+                ('country', django_countries.fields.CountryField(max_length=2, verbose_name='Country')),
+                ('shipping_name', models.CharField(blank=True, help_text='optional', max_length=200, verbose_name='Name (shipping)')),
+                ('shipping_street', models.CharField(blank=True, help_text='optional', max_length=200, verbose_name='Street (shipping)')),
+                ('shipping_zipcode', models.CharField(blank=True, help_text='optional', max_length=200, verbose_name='Zip code (shipping)')),
+                ('shipping_city', models.CharField(blank=True, help_text='optional', max_length=200, verbose_name='City (shipping)')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PaymentLog',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_id', models.CharField(max_length=128)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=7, verbose_name='Amount')),
+                ('currency', models.CharField(default='EUR', max_length=3, verbose_name='Currency')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Plan',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=30, verbose_name='Name')),
+                ('plan_id', models.SlugField(editable=False, max_length=20)),
+                ('description', models.TextField(blank=True, verbose_name='Description')),
+                ('active', models.BooleanField(db_index=True, default=False, verbose_name='Active')),
+                ('default', models.BooleanField(db_index=True, default=False, verbose_name='Default')),
+                ('trial_period', models.BooleanField(default=False, help_text='Is there a trial period', verbose_name='Trial Period')),
+                ('trial_period_amount', models.IntegerField(null=True)),
+                ('trial_period_unit', models.CharField(choices=[('day', 'Day'), ('month', 'Month')], max_length=6, null=True)),
+                ('price', models.DecimalField(db_index=True, decimal_places=2, max_digits=7)),
+                ('currency', models.CharField(default='EUR', max_length=3, verbose_name='Currency')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Subscription',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subscription_id', models.CharField(max_length=10, unique=True, verbose_name='Subscription')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('active', 'Active'), ('past_due', 'Past due'), ('expired', 'Expired'), ('canceled', 'Canceled')], max_length=10, verbose_name='Status')),
+                ('start_date', models.DateField(default=datetime.date.today, verbose_name='Start date')),
+                ('next_billing_date', models.DateField(editable=False, null=True, verbose_name='Next billing date')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+                ('plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='plans.Plan', verbose_name='Plan')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserVault',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vault_id', models.CharField(max_length=64, unique=True, verbose_name='Vault ID')),
+                ('token', models.CharField(editable=False, help_text='A token generated by the gateway', max_length=10, verbose_name='Token')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='subscription',
+            name='user_vault',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='plans.UserVault', verbose_name="User's vault"),
+        ),
+        migrations.AddField(
+            model_name='paymentlog',
+            name='vault',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='plans.UserVault', verbose_name='Vault'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:23
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+# Partial index over the running subscriptions only, on the backends
+# supporting it. Most subscriptions end up expired or canceled, so it is
+# much smaller than the composite index on (status, next_billing_date).
+PARTIAL_INDEX_VENDORS = ('postgresql', 'sqlite')
+PARTIAL_INDEX_NAME = 'plans_subscription_running_billing_idx'
+
+
+def create_partial_index(apps, schema_editor):
+    if schema_editor.connection.vendor not in PARTIAL_INDEX_VENDORS:
+        return
+    schema_editor.execute(
+        "CREATE INDEX %s ON plans_subscription (next_billing_date) "
+        "WHERE status IN ('pending', 'active', 'past_due')" %
+        PARTIAL_INDEX_NAME
+    )
+
+
+def drop_partial_index(apps, schema_editor):
+    if schema_editor.connection.vendor not in PARTIAL_INDEX_VENDORS:
+        return
+    schema_editor.execute("DROP INDEX %s" % PARTIAL_INDEX_NAME)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['user_vault', 'status'], name='plans_subsc_user_va_585e88_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['status', 'next_billing_date'], name='plans_subsc_status_a40af3_idx'),
+        ),
+        migrations.RunPython(create_partial_index, drop_partial_index),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:26
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0002_subscription_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentlog',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True, verbose_name='Idempotency key'),
+        ),
+        migrations.AddField(
+            model_name='paymentlog',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('succeeded', 'Succeeded')], default='succeeded', max_length=10, verbose_name='Status'),
+        ),
+        migrations.AlterField(
+            model_name='paymentlog',
+            name='transaction_id',
+            field=models.CharField(blank=True, db_index=True, max_length=128),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:27
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0003_paymentlog_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscription',
+            name='lease_expires',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='Lease expires'),
+        ),
+        migrations.AddField(
+            model_name='subscription',
+            name='lease_owner',
+            field=models.CharField(editable=False, max_length=64, null=True, verbose_name='Lease owner'),
+        ),
+    ]
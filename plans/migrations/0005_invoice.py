@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:40
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django_countries.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('plans', '0004_subscription_lease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Invoice',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.CharField(max_length=20, unique=True, verbose_name='Number')),
+                ('issued', models.DateField(db_index=True, verbose_name='Issued')),
+                ('name', models.CharField(blank=True, max_length=200, verbose_name='Name')),
+                ('street', models.CharField(blank=True, max_length=200, verbose_name='Street')),
+                ('zipcode', models.CharField(blank=True, max_length=200, verbose_name='Zip code')),
+                ('city', models.CharField(blank=True, max_length=200, verbose_name='City')),
+                ('country', django_countries.fields.CountryField(blank=True, max_length=2, verbose_name='Country')),
+                ('tax_number', models.CharField(blank=True, max_length=200, verbose_name='VAT')),
+                ('currency', models.CharField(max_length=3, verbose_name='Currency')),
+                ('net_amount', models.DecimalField(decimal_places=2, max_digits=7, verbose_name='Net amount')),
+                ('tax_rate', models.DecimalField(blank=True, decimal_places=2, max_digits=4, null=True, verbose_name='Tax rate')),
+                ('tax_amount', models.DecimalField(decimal_places=2, max_digits=7, verbose_name='Tax amount')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=7, verbose_name='Amount')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('payment_log', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, related_name='invoice', to='plans.PaymentLog', verbose_name='Payment')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='InvoiceSequence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=20, unique=True, verbose_name='Name')),
+                ('last_number', models.PositiveIntegerField(default=0, verbose_name='Last number')),
+            ],
+        ),
+    ]
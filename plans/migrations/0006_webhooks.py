@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:48
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0005_invoice'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookCursor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Name')),
+                ('last_event_id', models.PositiveIntegerField(default=0, verbose_name='Last event')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(max_length=50, verbose_name='Provider')),
+                ('event_id', models.CharField(max_length=128, verbose_name='Event ID')),
+                ('kind', models.CharField(choices=[('charged', 'charged'), ('declined', 'declined'), ('activated', 'activated'), ('past_due', 'past_due'), ('canceled', 'canceled'), ('expired', 'expired')], max_length=20, verbose_name='Kind')),
+                ('subscription_id', models.CharField(max_length=10, verbose_name='Subscription')),
+                ('transaction_id', models.CharField(blank=True, max_length=128, verbose_name='Transaction ID')),
+                ('amount', models.DecimalField(blank=True, decimal_places=2, max_digits=7, null=True, verbose_name='Amount')),
+                ('currency', models.CharField(blank=True, max_length=3, verbose_name='Currency')),
+                ('next_billing_date', models.DateField(blank=True, null=True, verbose_name='Next billing date')),
+                ('payload', models.TextField(blank=True, verbose_name='Payload')),
+                ('received', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='webhookevent',
+            unique_together=set([('provider', 'event_id')]),
+        ),
+    ]
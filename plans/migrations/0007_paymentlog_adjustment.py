@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:54
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0006_webhooks'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='paymentlog',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('succeeded', 'Succeeded'), ('adjustment', 'Adjustment')], default='succeeded', max_length=10, verbose_name='Status'),
+        ),
+    ]
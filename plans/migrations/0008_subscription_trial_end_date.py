@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:56
+from __future__ import unicode_literals
+
+import calendar
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def add_period(date, amount, unit):
+    """
+    Returns the given date shifted by amount days or months, as
+    plans.utils.dates.add_period did when this migration was written.
+    """
+    if unit == "day":
+        return date + timedelta(days=amount)
+    if unit == "month":
+        month = date.month - 1 + amount
+        year = date.year + month // 12
+        month = month % 12 + 1
+        day = min(date.day, calendar.monthrange(year, month)[1])
+        return date.replace(year=year, month=month, day=day)
+    raise ValueError("Unknown period unit: %s" % unit)
+
+
+def compute_trial_end_dates(apps, schema_editor):
+    """
+    Computes the trial end dates of the pending subscriptions of the plans
+    with a trial period, one update per plan and start date. As in
+    Plan.trial_end(), a trial period without an amount or a unit is no
+    trial.
+    """
+    Plan = apps.get_model('plans', 'Plan')
+    Subscription = apps.get_model('plans', 'Subscription')
+    plans = Plan.objects.filter(
+        trial_period=True, trial_period_amount__isnull=False,
+        trial_period_unit__isnull=False,
+    ).exclude(trial_period_amount=0).exclude(trial_period_unit="")
+    for plan in plans:
+        trials = Subscription.objects.filter(plan=plan, status='pending')
+        start_dates = trials.order_by().values_list(
+            'start_date', flat=True).distinct()
+        for start_date in list(start_dates):
+            trials.filter(start_date=start_date).update(
+                trial_end_date=add_period(start_date,
+                                          plan.trial_period_amount,
+                                          plan.trial_period_unit))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0007_paymentlog_adjustment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscription',
+            name='trial_end_date',
+            field=models.DateField(editable=False, null=True, verbose_name='Trial end date'),
+        ),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['status', 'trial_end_date'], name='plans_subsc_status_bed41a_idx'),
+        ),
+        migrations.RunPython(compute_trial_end_dates,
+                             migrations.RunPython.noop),
+    ]
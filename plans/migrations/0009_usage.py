@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:58
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0008_subscription_trial_end_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageRate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=30, verbose_name='Metric')),
+                ('unit_price', models.DecimalField(decimal_places=4, max_digits=10, verbose_name='Unit price')),
+                ('plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage_rates', to='plans.Plan', verbose_name='Plan')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UsageRecord',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=30, verbose_name='Metric')),
+                ('period_start', models.DateField(verbose_name='Period start')),
+                ('quantity', models.BigIntegerField(default=0, verbose_name='Quantity')),
+                ('subscription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage_records', to='plans.Subscription', verbose_name='Subscription')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='usagerecord',
+            unique_together=set([('subscription', 'period_start', 'metric')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='usagerate',
+            unique_together=set([('plan', 'metric')]),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0009_usage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Entitlement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('feature', models.CharField(max_length=50, verbose_name='Feature')),
+                ('limit', models.PositiveIntegerField(blank=True, help_text='Leave empty for an unlimited feature', null=True, verbose_name='Limit')),
+                ('plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entitlements', to='plans.Plan', verbose_name='Plan')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='entitlement',
+            unique_together=set([('plan', 'feature')]),
+        ),
+    ]
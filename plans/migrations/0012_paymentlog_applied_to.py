@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:35
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0011_invoice_tax_rate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentlog',
+            name='applied_to',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, verbose_name='Applied to'),
+        ),
+    ]
@@ -4,21 +4,44 @@ from __future__ import unicode_literals
 import six
 import logging
 
-from datetime import datetime
+from datetime import date, timedelta
+from functools import partial
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.auth.models import User
 
 from django_countries.fields import CountryField
 
+from .cache import get_shared_cache, subscription_cache_stats
+from .catalog import plan_catalog
+from .entitlements import entitlement_map
 from .conf import plan_settings
+from .gateway import base as gateway_base, get_gateway
+from .utils.dates import add_period
+from .utils.db import DaysUntil
 
 
 _logger = logging.getLogger("plans.models")
 
 
+class SelectRelatedManager(models.Manager):
+    """
+    Manager following the given relations in the same query, so that
+    listings and __str__ do not query them row by row.
+    """
+    def __init__(self, *related):
+        super(SelectRelatedManager, self).__init__()
+        self.related = related
+
+    def get_queryset(self):
+        return super(SelectRelatedManager, self).get_queryset(
+        ).select_related(*self.related)
+
+
 class NotSubscribedError(Exception):
     pass
 
@@ -54,6 +77,18 @@ class Plan(models.Model):
     def __str__(self):
         return self.name
 
+    def trial_end(self, start_date):
+        """
+        Returns the end date of a trial of this plan starting at the given
+        date, or None if the plan has no trial period. A trial period
+        without an amount or a unit is no trial.
+        """
+        if (not self.trial_period or not self.trial_period_amount or
+                not self.trial_period_unit):
+            return None
+        return add_period(start_date, self.trial_period_amount,
+                          self.trial_period_unit)
+
     def __unicode__(self):
         return six.u('%s' % self.name)
 
@@ -61,13 +96,9 @@ class Plan(models.Model):
     def get_default_plan(cls):
         """
         Returns the defined default plan in settings or the recent default plan.
+        Plans are served from the in-process catalog, see plans.catalog.
         """
-        if plan_settings.DEFAULT_PLAN:
-            return cls.objects.get(name=plan_settings.DEFAULT_PLAN)
-        try:
-            return cls.objects.filter(default=True).order_by('-pk')[0]
-        except IndexError:
-            return None
+        return plan_catalog.get_default_plan()
 
 
 @python_2_unicode_compatible
@@ -98,6 +129,8 @@ class BillingInfo(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
 
+    objects = SelectRelatedManager('user')
+
     def __str__(self):
         return self.user.get_username()
 
@@ -114,19 +147,56 @@ class UserVault(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
 
-    def charge(self, amount):
+    objects = SelectRelatedManager('user')
+
+    def charge(self, amount, currency=None, options=None):
         """
         Charges the users credit card, with he provided amount.
+        Returns the transaction ID or raise GatewayError.
         """
-        raise NotImplementedError
+        options = dict(options or {}, vault_id=self.vault_id,
+                       token=self.token)
+        if currency:
+            options["currency"] = currency
+        return get_gateway().charge(None, amount, options)
 
     @property
     def subscription(self):
+        """
+        Returns the running subscription of this vault, or None.
+
+        The result is cached on the instance and, if the CACHE_ALIAS setting
+        is set, in the shared cache until a subscription of this vault is
+        saved or deleted.
+        """
+        if '_running_subscription' in self.__dict__:
+            subscription_cache_stats.local_hits += 1
+            return self._running_subscription
+        cache = get_shared_cache()
+        if cache is not None:
+            # Cached as a 1-tuple, to tell a cached None from a cache miss
+            cached = cache.get(self.subscription_cache_key(self.pk))
+            if cached is not None:
+                subscription_cache_stats.shared_hits += 1
+                return self._cache_subscription(cached[0])
+        subscription_cache_stats.misses += 1
+        subscription = self._get_running_subscription()
+        if cache is not None:
+            cache.set(self.subscription_cache_key(self.pk), (subscription,),
+                      plan_settings.SUBSCRIPTION_CACHE_TIMEOUT)
+        return self._cache_subscription(subscription)
+
+    def _cache_subscription(self, subscription):
+        self._running_subscription = subscription
+        if subscription is not None:
+            # Saving the subscription then invalidates this instance's cache
+            subscription.user_vault = self
+        return subscription
+
+    def _get_running_subscription(self):
         try:
-            running = [Subscription.PENDING, Subscription.ACTIVE,
-                       Subscription.PAST_DUE]
-            return Subscription.objects.get(user_vault=self,
-                                            status__in=running)
+            return Subscription.objects.get(
+                user_vault=self, status__in=Subscription.RUNNING_STATUSES)
         except Subscription.DoesNotExist:
             return None
         except Subscription.MultipleObjectsReturned:
@@ -134,6 +204,33 @@ class UserVault(models.Model):
                 "User {} is subscribed to many plans".format(self.user)
             )
 
+    @staticmethod
+    def subscription_cache_key(vault_id):
+        return "plans:vault:%s:subscription" % vault_id
+
+    def invalidate_subscription_cache(self):
+        """
+        Forget the cached running subscription of this vault.
+        """
+        self.__dict__.pop('_running_subscription', None)
+        cache = get_shared_cache()
+        if cache is not None:
+            cache.delete(self.subscription_cache_key(self.pk))
+
+    @classmethod
+    def invalidate_subscription_caches(cls, vault_ids):
+        """
+        Forget the running subscriptions of the given vaults from the shared
+        cache, and the entitlements of their users once the transaction
+        commits, after a bulk update of their subscriptions.
+        """
+        transaction.on_commit(partial(entitlement_map.invalidate_vaults,
+                                      list(vault_ids)))
+        cache = get_shared_cache()
+        if cache is not None:
+            cache.delete_many([cls.subscription_cache_key(vault_id)
+                               for vault_id in vault_ids])
+
     def __str__(self):
         return '%s (%s)' % (
             self.user.get_username(),
@@ -142,39 +239,134 @@ class UserVault(models.Model):
 
     def subscribe(self, plan):
         """
-        Subscribe user to the provided plan.
-        :param plan: plan's slug.
-        :type plan: str.
+        Subscribe user to the provided plan, or move his running
+        subscription to it, see plans.proration. Returns the subscription.
+        :param plan: plan or plan's slug.
+        :type plan: Plan or str.
         """
-        raise NotImplementedError
+        from .proration import change_plan, subscribe
+        if isinstance(plan, six.string_types):
+            plan_id, plan = plan, plan_catalog.get(plan)
+            if plan is None:
+                raise Plan.DoesNotExist("Plan %r does not exist" % plan_id)
+        subscription = self.subscription
+        if subscription is None:
+            return subscribe(self, plan)
+        if subscription.plan_id != plan.pk:
+            change_plan(subscription, plan)
+        return subscription
 
     def unsubscribe(self):
         """
         Unsubscribe user or raise NotSubscribedError if he does not have
         any running subscription.
         """
-        if self.subscription:
-            return self.subscription.cancel()
-        return NotSubscribedError
+        subscription = self.subscription
+        if subscription:
+            return subscription.cancel()
+        raise NotSubscribedError
 
 
 @python_2_unicode_compatible
 class PaymentLog(models.Model):
     """
     Logging raw charges made to a users credit card.
+
+    Charges made with an idempotency key are first reserved as pending logs,
+    see plans.billing. A pending log whose charge outcome is unknown (e.g.
+    the worker crashed) blocks any new charge with the same key until it is
+    reconciled with the gateway.
+
+    Adjustments are amounts owed (or credited, if negative) after a change
+    of plan, see plans.proration. They are added to the next charge of the
+    vault by the billing run, which sets their applied_to key.
     """
+    PENDING, SUCCEEDED, ADJUSTMENT = "pending", "succeeded", "adjustment"
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (SUCCEEDED, 'Succeeded'),
+        (ADJUSTMENT, 'Adjustment'),
+    )
     vault = models.ForeignKey(UserVault, verbose_name=_('Vault'))
-    transaction_id = models.CharField(max_length=128)
+    transaction_id = models.CharField(max_length=128, blank=True,
+                                      db_index=True)
+    idempotency_key = models.CharField(_('Idempotency key'), max_length=64,
+                                       unique=True, null=True, blank=True)
+    # Idempotency key of the charge an adjustment was added to
+    applied_to = models.CharField(_('Applied to'), max_length=64, null=True,
+                                  blank=True, editable=False)
+    status = models.CharField(_('Status'), max_length=10,
+                              choices=STATUS_CHOICES, default=SUCCEEDED)
     amount = models.DecimalField(_('Amount'), max_digits=7, decimal_places=2)
     currency = models.CharField(_('Currency'), max_length=3, default='EUR')
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
 
+    objects = SelectRelatedManager('vault__user')
+
+    @staticmethod
+    def idempotency_key_for(subscription, billing_date):
+        """
+        Returns the idempotency key of the charge of a subscription for the
+        billing period starting at the given date.
+        """
+        return "%s:%s" % (subscription.subscription_id,
+                          billing_date.isoformat())
+
     def __str__(self):
         return (
-            '%s charged %s %s - %s' % (self.user, self.amount,
+            '%s charged %s %s - %s' % (self.vault.user, self.amount,
                                        self.currency, self.transaction_id)
-       )
+        )
+
+
+class SubscriptionQuerySet(models.QuerySet):
+    """
+    Subscription lookups computed by the database.
+
+    Filters compare next_billing_date to dates computed once, so that they
+    can use the (status, next_billing_date) index. Ordering by remaining
+    days is ordering by next_billing_date.
+    """
+    def running(self):
+        return self.filter(status__in=Subscription.RUNNING_STATUSES)
+
+    def expired(self, today=None):
+        """
+        Subscriptions expired, or whose billing date has passed, see
+        Subscription.is_expired.
+        """
+        today = today or date.today()
+        return self.filter(models.Q(status=Subscription.EXPIRED) |
+                           models.Q(next_billing_date__lt=today))
+
+    def trials_ending(self, until, since=None):
+        """
+        Trials ending up to until, or between since and until, included.
+        """
+        trials = self.filter(status=Subscription.PENDING,
+                             trial_end_date__lte=until)
+        if since is not None:
+            trials = trials.filter(trial_end_date__gte=since)
+        return trials
+
+    def due_within(self, days, today=None):
+        """
+        Running subscriptions to be billed in the next given days, today
+        included.
+        """
+        today = today or date.today()
+        return self.running().filter(
+            next_billing_date__gte=today,
+            next_billing_date__lte=today + timedelta(days=days))
+
+    def with_days_left(self, today=None):
+        """
+        Annotates the number of days until the next billing date as
+        remaining_days, see Subscription.days_left.
+        """
+        return self.annotate(remaining_days=DaysUntil(
+            'next_billing_date', today or date.today()))
 
 
 @python_2_unicode_compatible
@@ -191,6 +383,7 @@ class Subscription(models.Model):
         "expired",
         "canceled",
     )
+    RUNNING_STATUSES = (PENDING, ACTIVE, PAST_DUE)
     STATUS_CHOICES = (
         (PENDING, 'Pending'),
         (ACTIVE, 'Active'),
@@ -204,14 +397,43 @@ class Subscription(models.Model):
     plan = models.ForeignKey(Plan, verbose_name=_("Plan"))
     # Subscription state fields
     status = models.CharField(_('Status'), max_length=10, choices=STATUS_CHOICES)
-    start_date = models.DateField(_('Start date'), default=datetime.now().date())
+    start_date = models.DateField(_('Start date'), default=date.today)
     next_billing_date = models.DateField(_('Next billing date'), null=True,
                                          editable=False)
+    # Computed from the plan when the subscription is created, see
+    # plans.trials
+    trial_end_date = models.DateField(_('Trial end date'), null=True,
+                                      editable=False)
     # TODO remove end_date
     # end_date = models.DateField(_('End date'), blank=True, null=True)
+    # Billing workers lease the subscriptions they process, see
+    # plans.billing.claim_due_subscriptions
+    lease_owner = models.CharField(_('Lease owner'), max_length=64,
+                                   null=True, editable=False)
+    lease_expires = models.DateTimeField(_('Lease expires'), null=True,
+                                         editable=False)
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
 
+    objects = SelectRelatedManager.from_queryset(SubscriptionQuerySet)(
+        'user_vault__user', 'plan')
+
+    class Meta:
+        indexes = [
+            # Running subscription of a vault, see UserVault.subscription
+            models.Index(fields=['user_vault', 'status']),
+            # Renewal sweeps, see plans.billing
+            models.Index(fields=['status', 'next_billing_date']),
+            # Ending trials, see plans.trials
+            models.Index(fields=['status', 'trial_end_date']),
+        ]
+
+    def save(self, *args, **kwargs):
+        if (self._state.adding and self.status == self.PENDING
+                and self.trial_end_date is None):
+            self.trial_end_date = self.plan.trial_end(self.start_date)
+        return super(Subscription, self).save(*args, **kwargs)
+
     def __str__(self):
         return "%s: %s: %s" % (
             self.user_vault.user,
@@ -220,28 +442,39 @@ class Subscription(models.Model):
         )
 
     def is_running(self):
-        return (self.status in [Subscription.PENDING,
-                                Subscription.ACTIVE,
-                                Subscription.PAST_DUE])
+        return self.status in self.RUNNING_STATUSES
 
     def cancel(self):
         """
-        Cancel this subscription instantly.
+        Cancel this subscription instantly, or raise InvalidTransition if
+        it is not running.
         """
-        raise NotImplementedError
+        from .transitions import CANCELED, InvalidTransition, transition
+        moved = transition(Subscription.objects.filter(pk=self.pk), CANCELED)
+        if not moved:
+            raise InvalidTransition("%s -> %s" % (self.status, CANCELED))
+        self.status = CANCELED
+        return self
 
     @property
     def first_billing_date(self):
         """
-        Returns first billing date.
+        Returns first billing date: the end of the trial, if any, else the
+        start date.
         """
-        raise NotImplementedError
+        return self.trial_end_date or self.start_date
+
+    def is_trial(self):
+        return self.status == self.PENDING and self.trial_end_date is not None
 
     def days_left(self):
+        if hasattr(self, 'remaining_days'):
+            # Annotated by SubscriptionQuerySet.with_days_left
+            return self.remaining_days
         if self.next_billing_date is None:
             return None
         else:
-            return (self.next_billing_date - datetime.today()).days
+            return (self.next_billing_date - date.today()).days
 
     def is_expired(self):
         if self.status == self.EXPIRED:
@@ -249,4 +482,187 @@ class Subscription(models.Model):
         if self.next_billing_date is None:
             return False
         else:
-            return self.next_billing_date < datetime.today()
+            return self.next_billing_date < date.today()
+
+
+@python_2_unicode_compatible
+class Entitlement(models.Model):
+    """
+    Feature granted by a plan, with an optional quota (e.g. the number of
+    projects), see plans.entitlements.
+    """
+    plan = models.ForeignKey(Plan, verbose_name=_('Plan'),
+                             related_name='entitlements')
+    feature = models.CharField(_('Feature'), max_length=50)
+    limit = models.PositiveIntegerField(
+        _('Limit'), null=True, blank=True,
+        help_text=_('Leave empty for an unlimited feature'))
+
+    class Meta:
+        unique_together = [('plan', 'feature')]
+
+    def __str__(self):
+        if self.limit is None:
+            return self.feature
+        return '%s: %s' % (self.feature, self.limit)
+
+
+class UsageRate(models.Model):
+    """
+    Price of a unit of a metered metric (e.g. API calls) on a plan, charged
+    on top of the plan price, see plans.metering.
+    """
+    plan = models.ForeignKey(Plan, verbose_name=_('Plan'),
+                             related_name='usage_rates')
+    metric = models.CharField(_('Metric'), max_length=30)
+    unit_price = models.DecimalField(_('Unit price'), max_digits=10,
+                                     decimal_places=4)
+
+    class Meta:
+        unique_together = [('plan', 'metric')]
+
+
+class UsageRecord(models.Model):
+    """
+    Usage of a metric by a subscription during the billing period starting
+    at period_start, in units of the metric. Written in bulk by
+    plans.metering.
+    """
+    subscription = models.ForeignKey(Subscription,
+                                     verbose_name=_('Subscription'),
+                                     related_name='usage_records')
+    metric = models.CharField(_('Metric'), max_length=30)
+    period_start = models.DateField(_('Period start'))
+    quantity = models.BigIntegerField(_('Quantity'), default=0)
+
+    class Meta:
+        unique_together = [('subscription', 'period_start', 'metric')]
+
+
+class InvoiceSequence(models.Model):
+    """
+    Counter of the invoice numbers of a year, see plans.invoicing.
+    """
+    name = models.CharField(_('Name'), max_length=20, unique=True)
+    last_number = models.PositiveIntegerField(_('Last number'), default=0)
+
+
+@python_2_unicode_compatible
+class Invoice(models.Model):
+    """
+    Invoice of a charge. The billing information are copied from the
+    user's BillingInfo when the invoice is issued.
+    """
+    number = models.CharField(_('Number'), max_length=20, unique=True)
+    # Invoices are kept with their payment: deleting an invoiced payment is
+    # refused by the foreign key constraint. Payments without an invoice,
+    # e.g. declined reservations, are deleted without looking up invoices.
+    payment_log = models.OneToOneField(PaymentLog, verbose_name=_('Payment'),
+                                       related_name='invoice',
+                                       on_delete=models.DO_NOTHING)
+    user = models.ForeignKey(User, verbose_name=_('User'))
+    issued = models.DateField(_('Issued'), db_index=True)
+    name = models.CharField(_('Name'), max_length=200, blank=True)
+    street = models.CharField(_('Street'), max_length=200, blank=True)
+    zipcode = models.CharField(_('Zip code'), max_length=200, blank=True)
+    city = models.CharField(_('City'), max_length=200, blank=True)
+    country = CountryField(_("Country"), blank=True)
+    tax_number = models.CharField(_('VAT'), max_length=200, blank=True)
+    currency = models.CharField(_('Currency'), max_length=3)
+    net_amount = models.DecimalField(_('Net amount'), max_digits=7,
+                                     decimal_places=2)
+    tax_rate = models.DecimalField(_('Tax rate'), max_digits=5,
+                                   decimal_places=2, null=True, blank=True)
+    tax_amount = models.DecimalField(_('Tax amount'), max_digits=7,
+                                     decimal_places=2)
+    amount = models.DecimalField(_('Amount'), max_digits=7, decimal_places=2)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.number
+
+
+@python_2_unicode_compatible
+class WebhookEvent(models.Model):
+    """
+    Event pushed by a gateway, see plans.webhooks. Events are only
+    inserted, once per provider event id, and processed in order of pk.
+    """
+    KIND_CHOICES = [(kind, kind) for kind in gateway_base.EVENT_KINDS]
+    provider = models.CharField(_('Provider'), max_length=50)
+    event_id = models.CharField(_('Event ID'), max_length=128)
+    kind = models.CharField(_('Kind'), max_length=20, choices=KIND_CHOICES)
+    subscription_id = models.CharField(_('Subscription'), max_length=10)
+    transaction_id = models.CharField(_('Transaction ID'), max_length=128,
+                                      blank=True)
+    amount = models.DecimalField(_('Amount'), max_digits=7, decimal_places=2,
+                                 null=True, blank=True)
+    currency = models.CharField(_('Currency'), max_length=3, blank=True)
+    next_billing_date = models.DateField(_('Next billing date'), null=True,
+                                         blank=True)
+    payload = models.TextField(_('Payload'), blank=True)
+    received = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [('provider', 'event_id')]
+
+    def __str__(self):
+        return "%s %s: %s %s" % (self.provider, self.event_id, self.kind,
+                                 self.subscription_id)
+
+
+class WebhookCursor(models.Model):
+    """
+    Last WebhookEvent processed by a webhook processor.
+    """
+    name = models.CharField(_('Name'), max_length=50, unique=True)
+    last_event_id = models.PositiveIntegerField(_('Last event'), default=0)
+
+
+@receiver(post_save, sender=Plan)
+@receiver(post_delete, sender=Plan)
+def invalidate_plan_catalog(sender, **kwargs):
+    # Reloading before the commit would keep the previous plans, and
+    # reloading a rolled back change would keep plans that do not exist
+    transaction.on_commit(plan_catalog.invalidate)
+
+
+@receiver(post_save, sender=Plan)
+@receiver(post_delete, sender=Plan)
+@receiver(post_save, sender=Entitlement)
+@receiver(post_delete, sender=Entitlement)
+def invalidate_entitlements(sender, **kwargs):
+    transaction.on_commit(entitlement_map.invalidate)
+
+
+@receiver(post_save, sender=UserVault)
+@receiver(post_delete, sender=UserVault)
+def invalidate_vault_entitlements(sender, instance, **kwargs):
+    """
+    Invalidate the entitlements of the vault's user, and of its previous
+    user if the vault was moved, once the transaction commits.
+    """
+    vault_id, user_id = instance.pk, instance.user_id
+
+    def invalidate():
+        entitlement_map.invalidate_vaults([vault_id])
+        entitlement_map.invalidate_users([user_id])
+    transaction.on_commit(invalidate)
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def invalidate_running_subscription(sender, instance, **kwargs):
+    """
+    Invalidate the cached running subscription of the subscription's vault,
+    and the entitlements of its user once the transaction commits.
+    """
+    transaction.on_commit(partial(entitlement_map.invalidate_vaults,
+                                  [instance.user_vault_id]))
+    if Subscription.user_vault.is_cached(instance):
+        instance.user_vault.invalidate_subscription_cache()
+    else:
+        cache = get_shared_cache()
+        if cache is not None:
+            cache.delete(UserVault.subscription_cache_key(
+                instance.user_vault_id))
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+Plan changes and proration.
+
+A subscription is billed monthly, for the period ending at its next billing
+date. When it changes plan during a period, the unused part of the period
+is credited at the old price and charged at the new one, in proportion of
+the days left:
+
+    credit = old price * days left / days in period
+    charge = new price * days left / days in period
+
+Amounts are Decimals rounded once, to the cent.
+
+change_plan() changes one subscription, charging an upgrade at once and
+recording a downgrade as a negative ADJUSTMENT PaymentLog (a credit).
+reprice() moves all the subscribers of a plan to another one with a few
+set-based queries per chunk of subscriptions, recording the differences
+as ADJUSTMENT logs with bulk inserts instead of charging them. Adjustments
+are settled with the next charge of the subscription, see plans.billing.
+"""
+import uuid
+
+from collections import namedtuple
+from datetime import date
+from decimal import Decimal
+
+from django.db import transaction
+
+from .billing import reserve_payments
+from .gateway import get_gateway
+from .gateway.base import GatewayError
+from .models import PaymentLog, Subscription, UserVault
+from .taxation import quantize
+from .transitions import CANCELED, transition
+from .utils.dates import add_months, billing_period
+
+
+ZERO = Decimal("0.00")
+
+Proration = namedtuple("Proration", "credit charge amount")
+
+
+def prorate(old_price, new_price, period, change_date):
+    """
+    Returns the Proration of a change from old_price to new_price on
+    change_date, during the given (start, end) billing period.
+    """
+    start, end = period
+    days = (end - start).days
+    left = min(max((end - max(change_date, start)).days, 0), days)
+    if not left:
+        return Proration(ZERO, ZERO, ZERO)
+    credit = quantize(Decimal(old_price) * left / days)
+    charge = quantize(Decimal(new_price) * left / days)
+    return Proration(credit, charge, charge - credit)
+
+
+def prorate_subscription(subscription, plan, change_date=None):
+    """
+    Returns the Proration of a change of the subscription to plan.
+    """
+    if subscription.next_billing_date is None:
+        return Proration(ZERO, ZERO, ZERO)
+    return prorate(subscription.plan.price, plan.price,
+                   billing_period(subscription.start_date,
+                                  subscription.next_billing_date),
+                   change_date or date.today())
+
+
+class DuplicatePlanChange(Exception):
+    pass
+
+
+def change_key(subscription_id, old_plan, new_plan, change_date):
+    return "%s:plan:%s:%s:%s" % (subscription_id, old_plan.pk, new_plan.pk,
+                                 change_date.isoformat())
+
+
+def _charge(gateway, vault, amount, currency, options):
+    options = dict(options, vault_id=vault.vault_id, token=vault.token,
+                   currency=currency)
+    return gateway.charge(None, amount, options)
+
+
+def _pay(gateway, subscription, log):
+    """
+    Charges a reserved pending log, marks it succeeded and returns it.
+    The reservation is deleted if the charge is declined.
+    """
+    try:
+        transaction_id = _charge(gateway, subscription.user_vault,
+                                 log.amount, log.currency, {
+                                     "subscription_id":
+                                         subscription.subscription_id,
+                                     "idempotency_key": log.idempotency_key,
+                                 })
+    except GatewayError:
+        PaymentLog.objects.filter(idempotency_key=log.idempotency_key,
+                                  status=PaymentLog.PENDING).delete()
+        raise
+    PaymentLog.objects.filter(idempotency_key=log.idempotency_key).update(
+        status=PaymentLog.SUCCEEDED, transaction_id=transaction_id)
+    log.status, log.transaction_id = PaymentLog.SUCCEEDED, transaction_id
+    return log
+
+
+def subscribe(vault, plan, today=None, gateway=None):
+    """
+    Subscribes the vault to plan, charging its first month, and returns the
+    active subscription. If the charge is declined, the subscription is
+    canceled and GatewayError is raised. If the plan has a trial period,
+    the subscription is returned pending, uncharged.
+    """
+    today = today or date.today()
+    trial_end_date = plan.trial_end(today)
+    subscription = Subscription.objects.create(
+        subscription_id=uuid.uuid4().hex[:10], user_vault=vault, plan=plan,
+        status=Subscription.PENDING, start_date=today,
+        trial_end_date=trial_end_date,
+        next_billing_date=None if trial_end_date else today)
+    if trial_end_date:
+        # Converted at the end of the trial, see plans.trials
+        return subscription
+    gateway = gateway or get_gateway()
+    log = PaymentLog.objects.create(
+        vault=vault, status=PaymentLog.PENDING, amount=plan.price,
+        currency=plan.currency,
+        idempotency_key=PaymentLog.idempotency_key_for(subscription, today))
+    try:
+        _pay(gateway, subscription, log)
+    except GatewayError:
+        transition(Subscription.objects.filter(pk=subscription.pk), CANCELED)
+        raise
+    subscription.status = Subscription.ACTIVE
+    subscription.next_billing_date = add_months(today, 1)
+    subscription.save(update_fields=['status', 'next_billing_date',
+                                     'modified'])
+    return subscription
+
+
+def change_plan(subscription, plan, change_date=None, gateway=None):
+    """
+    Moves the subscription to plan, charging the prorated difference at
+    once for an upgrade, or recording it as a credit for a downgrade.
+    Returns the Proration. On a declined charge, GatewayError is raised
+    and the plan is left unchanged.
+
+    Changes are keyed by subscription, old and new plan and date. A change
+    whose charge or credit was already recorded, by a concurrent call or by
+    the same change earlier that day (e.g. upgrade, downgrade, upgrade),
+    raises DuplicatePlanChange and leaves the plan unchanged.
+    """
+    change_date = change_date or date.today()
+    proration = prorate_subscription(subscription, plan, change_date)
+    if proration.amount:
+        key = change_key(subscription.subscription_id, subscription.plan,
+                         plan, change_date)
+        log = PaymentLog(vault=subscription.user_vault,
+                         idempotency_key=key, amount=proration.amount,
+                         currency=plan.currency)
+        log.status = (PaymentLog.PENDING if proration.amount > 0
+                      else PaymentLog.ADJUSTMENT)
+        if not reserve_payments([log]):
+            raise DuplicatePlanChange(
+                "The change of %s to %s was already made on %s" % (
+                    subscription.subscription_id, plan.plan_id,
+                    change_date))
+        if proration.amount > 0:
+            _pay(gateway or get_gateway(), subscription, log)
+    subscription.plan = plan
+    subscription.save(update_fields=['plan', 'modified'])
+    return proration
+
+
+class Repricing(object):
+    """
+    Moves the running subscriptions of old_plan to new_plan.
+
+    Subscriptions are processed in chunks of pk. Each chunk is locked and
+    moved with one update, and, if prorate is set, the prorated differences
+    are recorded as ADJUSTMENT logs with one bulk insert, in one
+    transaction. Adjustments are keyed by subscription, plans and date, so
+    a repricing run again after a crash skips them.
+    """
+    def __init__(self, old_plan, new_plan, change_date=None, prorate=True,
+                 chunk_size=500):
+        self.old_plan = old_plan
+        self.new_plan = new_plan
+        self.change_date = change_date or date.today()
+        self.prorate = prorate
+        self.chunk_size = chunk_size
+        self.moved = 0
+        self.adjustments = 0
+        self.total = ZERO
+        # Subscriptions of a chunk mostly share their billing periods
+        self._prorations = {}
+
+    def proration(self, start_date, next_billing_date):
+        if next_billing_date is None:
+            return Proration(ZERO, ZERO, ZERO)
+        period = billing_period(start_date, next_billing_date)
+        if period not in self._prorations:
+            self._prorations[period] = prorate(
+                self.old_plan.price, self.new_plan.price, period,
+                self.change_date)
+        return self._prorations[period]
+
+    def process_chunk(self, rows):
+        logs = []
+        for _, subscription_id, vault_id, start_date, billing_date in rows:
+            proration = self.proration(start_date, billing_date)
+            if self.prorate and proration.amount:
+                logs.append(PaymentLog(
+                    vault_id=vault_id, status=PaymentLog.ADJUSTMENT,
+                    amount=proration.amount, currency=self.new_plan.currency,
+                    idempotency_key=change_key(subscription_id,
+                                               self.old_plan, self.new_plan,
+                                               self.change_date)))
+        Subscription.objects.filter(
+            pk__in=[row[0] for row in rows],
+        ).update(plan=self.new_plan)
+        reserved = reserve_payments(logs)
+        for log in logs:
+            if log.idempotency_key in reserved:
+                self.total += log.amount
+        self.adjustments += len(reserved)
+        self.moved += len(rows)
+        UserVault.invalidate_subscription_caches(
+            set(row[2] for row in rows))
+
+    def run(self):
+        queryset = Subscription.objects.running().filter(
+            plan=self.old_plan).order_by('pk')
+        last_pk = 0
+        while True:
+            with transaction.atomic():
+                rows = list(queryset.filter(
+                    pk__gt=last_pk,
+                ).select_for_update().values_list(
+                    'pk', 'subscription_id', 'user_vault_id', 'start_date',
+                    'next_billing_date',
+                )[:self.chunk_size])
+                if not rows:
+                    return self
+                self.process_chunk(rows)
+            last_pk = rows[-1][0]
+
+
+def reprice(old_plan, new_plan, change_date=None, prorate=True,
+            chunk_size=500):
+    """
+    Moves the running subscriptions of old_plan to new_plan, see Repricing.
+    """
+    return Repricing(old_plan, new_plan, change_date, prorate,
+                     chunk_size).run()
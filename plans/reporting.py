@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Revenue reporting over PaymentLog.
+
+Exports stream rows from the database in chunks and yield one line at a
+time, so they can be written to a file or given to a StreamingHttpResponse
+without loading the table in memory. Totals are aggregated by the database.
+"""
+import csv
+import json
+
+import six
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, DateField, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncYear
+from django.http import StreamingHttpResponse
+
+from .models import PaymentLog
+
+
+EXPORT_FIELDS = ('id', 'created', 'vault__vault_id', 'transaction_id',
+                 'amount', 'currency')
+
+PERIODS = {
+    'day': TruncDay,
+    'month': TruncMonth,
+    'year': TruncYear,
+}
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+def payment_logs(start=None, end=None):
+    """
+    Returns the succeeded payment logs created in [start, end).
+    """
+    queryset = PaymentLog.objects.filter(status=PaymentLog.SUCCEEDED)
+    if start is not None:
+        queryset = queryset.filter(created__gte=start)
+    if end is not None:
+        queryset = queryset.filter(created__lt=end)
+    return queryset
+
+
+def iter_rows(queryset, fields=EXPORT_FIELDS, chunk_size=2000):
+    """
+    Yields the given fields of each row of the queryset, as tuples, using a
+    server-side cursor where the database supports it.
+    """
+    queryset = queryset.order_by('pk').values_list(*fields)
+    try:
+        return queryset.iterator(chunk_size=chunk_size)
+    except TypeError:
+        # Django < 2.0 fetches a fixed number of rows at a time
+        return queryset.iterator()
+
+
+class _Echo(object):
+    """
+    File-like object returning what is written, to get csv lines one by one.
+    """
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows, fields=EXPORT_FIELDS):
+    """
+    Yields the header and the rows as CSV lines.
+    """
+    writer = csv.writer(_Echo())
+    for row in _chain([fields], rows):
+        if six.PY2:
+            row = [six.text_type(value).encode('utf-8') for value in row]
+        yield writer.writerow(row)
+
+
+def jsonl_lines(rows, fields=EXPORT_FIELDS):
+    """
+    Yields the rows as JSON objects, one per line.
+    """
+    for row in rows:
+        yield json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder) + "\n"
+
+
+def _chain(*iterables):
+    for iterable in iterables:
+        for item in iterable:
+            yield item
+
+
+def export_lines(queryset, format='csv', fields=EXPORT_FIELDS,
+                 chunk_size=2000):
+    """
+    Yields the rows of the queryset as lines in the given format, "csv" or
+    "jsonl" (JSON lines).
+    """
+    rows = iter_rows(queryset, fields, chunk_size)
+    if format == 'csv':
+        return csv_lines(rows, fields)
+    if format == 'jsonl':
+        return jsonl_lines(rows, fields)
+    raise ValueError("Unknown export format: %s" % format)
+
+
+def export_response(queryset, format='csv', filename=None):
+    """
+    Returns a StreamingHttpResponse exporting the queryset.
+    """
+    response = StreamingHttpResponse(export_lines(queryset, format),
+                                     content_type=CONTENT_TYPES[format])
+    if filename:
+        response['Content-Disposition'] = (
+            'attachment; filename="%s"' % filename)
+    return response
+
+
+def revenue_totals(queryset=None, period='month'):
+    """
+    Returns the total amount and number of payments per currency and per
+    period ("day", "month" or "year"), computed by the database, as a
+    queryset of dicts with "period", "currency", "total" and "count" keys.
+    """
+    if queryset is None:
+        queryset = payment_logs()
+    trunc = PERIODS[period]
+    return queryset.annotate(
+        period=trunc('created', output_field=DateField()),
+    ).order_by().values('period', 'currency').annotate(
+        total=Sum('amount'),
+        count=Count('pk'),
+    ).order_by('period', 'currency')
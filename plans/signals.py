@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+"""
+Signals of the plans application.
+"""
+from django.dispatch import Signal
+
+
+# Sent by Subscription once per group of subscriptions moved from a status
+# to another by plans.transitions, with the ids of the subscriptions, once
+# the transaction commits.
+subscriptions_transitioned = Signal(
+    providing_args=["source", "target", "subscription_ids"])
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+Taxation policies, computing the tax rate of customers from their billing
+information.
+
+The policy configured by the TAXATION_POLICY setting is built once per
+process by get_tax_policy(), with its rate table and VAT number formats
+compiled, and reused by all the billing runs. Rates are percents, as
+Decimal, or None when no tax applies.
+"""
+import re
+
+from collections import namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+
+from .cache import TTLCache
+from .conf import plan_settings
+
+
+CENT = Decimal("0.01")
+
+# Standard VAT rates, by ISO country code
+EU_VAT_RATES = {
+    "AT": "20", "BE": "21", "BG": "20", "CY": "19", "CZ": "21",
+    "DE": "19", "DK": "25", "EE": "24", "ES": "21", "FI": "25.5",
+    "FR": "20", "GR": "24", "HR": "25", "HU": "27", "IE": "23",
+    "IT": "22", "LT": "21", "LU": "17", "LV": "21", "MT": "18",
+    "NL": "21", "PL": "23", "PT": "23", "RO": "21", "SE": "25",
+    "SI": "22", "SK": "23",
+}
+
+# VAT number formats, without the country prefix
+EU_VAT_FORMATS = {
+    "AT": r"U\d{8}",
+    "BE": r"[01]\d{9}",
+    "BG": r"\d{9,10}",
+    "CY": r"\d{8}[A-Z]",
+    "CZ": r"\d{8,10}",
+    "DE": r"\d{9}",
+    "DK": r"\d{8}",
+    "EE": r"\d{9}",
+    "ES": r"[A-Z0-9]\d{7}[A-Z0-9]",
+    "FI": r"\d{8}",
+    "FR": r"[A-HJ-NP-Z0-9]{2}\d{9}",
+    "GR": r"\d{9}",
+    "HR": r"\d{11}",
+    "HU": r"\d{8}",
+    "IE": r"\d{7}[A-W][A-I]?|\d[A-Z+*]\d{5}[A-W]",
+    "IT": r"\d{11}",
+    "LT": r"\d{9}|\d{12}",
+    "LU": r"\d{8}",
+    "LV": r"\d{11}",
+    "MT": r"\d{8}",
+    "NL": r"\d{9}B\d{2}",
+    "PL": r"\d{10}",
+    "PT": r"\d{9}",
+    "RO": r"\d{2,10}",
+    "SE": r"\d{12}",
+    "SI": r"\d{8}",
+    "SK": r"\d{10}",
+}
+
+# VAT number prefixes differing from the ISO country code
+VAT_PREFIXES = {"GR": "EL"}
+
+_SEPARATORS = re.compile(r"[\s.\-]")
+
+
+Tax = namedtuple("Tax", "rate amount")
+
+
+def country_code(country):
+    """
+    Returns the ISO code of a country, given as a code or as the Country of
+    a CountryField.
+    """
+    return (getattr(country, "code", country) or "").upper()
+
+
+def quantize(amount):
+    return amount.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+class TaxationPolicy(object):
+    """
+    Base taxation policy, applying the default rate to every customer.
+
+    Subclasses set `rates` to a mapping of country codes to rates and
+    override get_tax_rate(). VAT numbers are checked by
+    check_tax_number(), whose results are cached for vat_cache_timeout
+    seconds.
+    """
+    rates = {}
+    formats = {}
+
+    def __init__(self, default_rate=None, issuer_country=None,
+                 vat_cache_timeout=None):
+        self.default_rate = self._rate(default_rate)
+        self.issuer_country = country_code(issuer_country) or None
+        # Compiled once, the policy is shared by the whole process
+        self.rate_table = dict((code.upper(), self._rate(rate))
+                               for code, rate in self.rates.items())
+        self.format_table = dict(
+            (code.upper(), re.compile(r"(?:%s)\Z" % pattern))
+            for code, pattern in self.formats.items())
+        self.vat_cache = None
+        if vat_cache_timeout:
+            self.vat_cache = TTLCache(vat_cache_timeout)
+
+    @staticmethod
+    def _rate(rate):
+        return None if rate is None else Decimal(str(rate))
+
+    def get_tax_rate(self, tax_number, country):
+        """
+        Returns the tax rate of a customer, or None if not taxed.
+        """
+        return self.default_rate
+
+    def get_rate_for(self, billing_info):
+        return self.get_tax_rate(billing_info.tax_number, billing_info.country)
+
+    def normalize_tax_number(self, tax_number, country):
+        """
+        Returns the VAT number without separators nor country prefix.
+        """
+        code = country_code(country)
+        number = _SEPARATORS.sub("", tax_number or "").upper()
+        prefix = VAT_PREFIXES.get(code, code)
+        if prefix and number.startswith(prefix):
+            number = number[len(prefix):]
+        return number
+
+    def is_valid_tax_number(self, tax_number, country):
+        """
+        Returns whether the VAT number is valid, using the cached result of
+        a previous check if any.
+        """
+        number = self.normalize_tax_number(tax_number, country)
+        if not number:
+            return False
+        key = (country_code(country), number)
+        if self.vat_cache is not None:
+            valid = self.vat_cache.get(key)
+            if valid is not None:
+                return valid
+        valid = self.check_tax_number(number, key[0])
+        if self.vat_cache is not None:
+            self.vat_cache.set(key, valid)
+        return valid
+
+    def check_tax_number(self, number, country_code):
+        """
+        Checks a normalized VAT number against the format of its country.
+        Subclasses may query a registry (e.g. VIES) here instead.
+        """
+        pattern = self.format_table.get(country_code)
+        return pattern is not None and pattern.match(number) is not None
+
+    def get_tax_rates(self, customers):
+        """
+        Returns the tax rates of many (tax_number, country) pairs, computing
+        the rate of each distinct customer once.
+        """
+        rates = {}
+        result = []
+        for tax_number, country in customers:
+            key = (tax_number or "", country_code(country))
+            if key not in rates:
+                rates[key] = self.get_tax_rate(*key)
+            result.append(rates[key])
+        return result
+
+    def _rates_for(self, items):
+        return self.get_tax_rates(
+            (billing_info.tax_number, billing_info.country)
+            for billing_info, _ in items)
+
+    def compute_taxes(self, items):
+        """
+        Returns a Tax for each (billing_info, amount) pair, the amount of
+        tax being rounded to the cent.
+        """
+        items = list(items)
+        rates = self._rates_for(items)
+        return [
+            Tax(rate, quantize(Decimal(amount) * rate / 100)
+                if rate is not None else Decimal("0.00"))
+            for rate, (_, amount) in zip(rates, items)
+        ]
+
+    def compute_included_taxes(self, items):
+        """
+        Returns a Tax for each (billing_info, amount) pair, the amount being
+        tax inclusive, e.g. the amount of a charge.
+        """
+        items = list(items)
+        rates = self._rates_for(items)
+        taxes = []
+        for rate, (_, amount) in zip(rates, items):
+            amount = Decimal(amount)
+            if rate is None:
+                taxes.append(Tax(rate, Decimal("0.00")))
+            else:
+                net = quantize(amount * 100 / (100 + rate))
+                taxes.append(Tax(rate, amount - net))
+        return taxes
+
+
+class EUTaxationPolicy(TaxationPolicy):
+    """
+    European Union VAT:
+
+    * customers in the issuer country pay the issuer country rate;
+    * businesses in other member states, with a valid VAT number, are not
+      taxed (reverse charge);
+    * consumers in other member states pay the rate of their country;
+    * customers outside the EU are not taxed.
+    """
+    rates = EU_VAT_RATES
+    formats = EU_VAT_FORMATS
+
+    def get_tax_rate(self, tax_number, country):
+        code = country_code(country)
+        if code not in self.rate_table:
+            return None
+        if code == self.issuer_country:
+            return self.rate_table[code]
+        if tax_number and self.is_valid_tax_number(tax_number, code):
+            return None
+        return self.rate_table[code]
+
+
+_policy = None
+
+
+def get_tax_policy():
+    """
+    Returns the taxation policy configured by the TAXATION_POLICY setting,
+    or a TaxationPolicy applying TAX_PERCENT if it is not set.
+    """
+    global _policy
+    if _policy is None:
+        policy_class = plan_settings.tax_policy or TaxationPolicy
+        _policy = policy_class(
+            default_rate=plan_settings.tax_percent,
+            issuer_country=plan_settings.TAX_COUNTRY,
+            vat_cache_timeout=plan_settings.VAT_VALIDATION_TIMEOUT,
+        )
+    return _policy
+
+
+def reset_tax_policy():
+    """
+    Drop the taxation policy of this process, e.g. after a change of
+    settings.
+    """
+    global _policy
+    _policy = None
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Subscription state machine.
+
+Subscriptions move between statuses following TRANSITIONS:
+
+    pending -> active -> past_due -> expired
+                  ^          |
+                  +----------+
+    pending (trial not converted) -> expired
+    pending, active, past_due -> canceled
+
+Transitions are applied to sets of subscriptions with a few UPDATE queries
+instead of saving each row, so post_save is not sent. Instead, the
+subscriptions_transitioned signal is sent once per (source, target) group,
+after the transaction commits.
+"""
+from collections import defaultdict
+from datetime import date, timedelta
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .cache import get_shared_cache
+from .conf import plan_settings
+from .entitlements import entitlement_map
+from .models import Subscription, UserVault
+from .signals import subscriptions_transitioned
+
+
+PENDING, ACTIVE, PAST_DUE, EXPIRED, CANCELED = (
+    Subscription.PENDING,
+    Subscription.ACTIVE,
+    Subscription.PAST_DUE,
+    Subscription.EXPIRED,
+    Subscription.CANCELED,
+)
+
+TRANSITIONS = {
+    PENDING: frozenset([ACTIVE, EXPIRED, CANCELED]),
+    ACTIVE: frozenset([PAST_DUE, EXPIRED, CANCELED]),
+    PAST_DUE: frozenset([ACTIVE, EXPIRED, CANCELED]),
+    EXPIRED: frozenset(),
+    CANCELED: frozenset(),
+}
+
+
+class InvalidTransition(Exception):
+    pass
+
+
+def can_transition(source, target):
+    return target in TRANSITIONS.get(source, ())
+
+
+def sources_of(target):
+    """
+    Returns the statuses from which target can be reached.
+    """
+    return sorted(source for source, targets in TRANSITIONS.items()
+                  if target in targets)
+
+
+def apply_transitions(rules, queryset=None, **updates):
+    """
+    Applies transition rules to the subscriptions of the queryset. Each rule
+    is a (source, target, condition) tuple, condition being a Q object or
+    None, and the first rule matching a subscription applies. Other fields
+    of the moved subscriptions are updated with updates.
+
+    Rules are applied with one UPDATE query each, filtered on their source
+    status and condition only. A rule moving subscriptions to the source of
+    another rule runs after it, so that no subscription is moved twice, and
+    rules forming a cycle are refused. The ids of the moved subscriptions
+    are only read when needed, for the subscriptions_transitioned receivers
+    and the subscription caches, which are notified once the transaction
+    commits.
+
+    Returns the number of subscriptions moved per (source, target) pair.
+    """
+    for source, target, condition in rules:
+        if not can_transition(source, target):
+            raise InvalidTransition("%s -> %s" % (source, target))
+    order = _rule_order(rules)
+    if queryset is None:
+        queryset = Subscription.objects.all()
+    updates.setdefault('modified', timezone.now())
+    read = (subscriptions_transitioned.has_listeners(Subscription) or
+            get_shared_cache() is not None or entitlement_map.in_use())
+
+    moved = defaultdict(int)
+    groups = defaultdict(list)
+    vault_ids = set()
+    with transaction.atomic():
+        for index in order:
+            source, target, condition = rules[index]
+            # Earlier rules of the same source ran first: the subscriptions
+            # they matched have left the source status
+            rows = queryset.filter(status=source)
+            if condition is not None:
+                rows = rows.filter(condition)
+            if read:
+                for pk, vault_id in rows.select_for_update().values_list(
+                        'pk', 'user_vault_id'):
+                    groups[source, target].append(pk)
+                    vault_ids.add(vault_id)
+            count = rows.update(status=target, **updates)
+            if count:
+                moved[source, target] += count
+        if read and groups:
+            transaction.on_commit(partial(_transitioned, groups, vault_ids))
+    return dict(moved)
+
+
+def _rule_order(rules):
+    """
+    Returns the indexes of the rules in the order they are applied: rules
+    of the same source keep their order, rules leaving a status run before
+    the rules reaching it.
+    """
+    def before(first, second):
+        if rules[first][0] == rules[second][0]:
+            return first < second
+        return rules[first][0] == rules[second][1]
+
+    order = []
+    pending = list(range(len(rules)))
+    while pending:
+        for index in pending:
+            if not any(before(other, index)
+                       for other in pending if other != index):
+                break
+        else:
+            raise InvalidTransition("Rules form a cycle: %s" % ", ".join(
+                "%s -> %s" % rules[index][:2] for index in pending))
+        pending.remove(index)
+        order.append(index)
+    return order
+
+
+def _transitioned(groups, vault_ids):
+    UserVault.invalidate_subscription_caches(vault_ids)
+    for (source, target), subscription_ids in sorted(groups.items()):
+        subscriptions_transitioned.send(
+            sender=Subscription, source=source, target=target,
+            subscription_ids=subscription_ids)
+
+
+def transition(queryset, target, **updates):
+    """
+    Moves the subscriptions of the queryset to target, from any status
+    allowed by TRANSITIONS. Subscriptions in other statuses are left
+    unchanged.
+    """
+    return apply_transitions([(source, target, None)
+                              for source in sources_of(target)],
+                             queryset, **updates)
+
+
+def sweep(today=None, grace_days=None):
+    """
+    Nightly transitions: active subscriptions whose billing date has passed
+    become past due, past due ones are expired grace_days after their
+    billing date (the DUNNING_GRACE_DAYS setting).
+    """
+    today = today or date.today()
+    if grace_days is None:
+        grace_days = plan_settings.DUNNING_GRACE_DAYS
+    return apply_transitions([
+        (PAST_DUE, EXPIRED, Q(
+            next_billing_date__lt=today - timedelta(days=grace_days))),
+        (ACTIVE, PAST_DUE, Q(next_billing_date__lt=today)),
+    ])
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Trial periods.
+
+A subscription to a plan with a trial period starts pending, with its
+trial_end_date computed from the plan and no next billing date, so that
+billing runs skip it. When the trial ends, TrialScheduler converts it:
+
+* trials of vaults holding a payment token become active, billed from the
+  end of their trial by the next billing run;
+* the others expire.
+
+Ending trials are found through the (status, trial_end_date) index: a
+scheduler run reads the pending subscriptions whose trial ended, day by
+day, and never scans the other subscriptions.
+"""
+from datetime import date, timedelta
+
+from django.db.models import F
+
+from .models import Subscription
+from .transitions import ACTIVE, EXPIRED, PENDING, apply_transitions
+
+
+class TrialScheduler(object):
+    """
+    Converts or expires the trials ended at the given date, in chunks.
+
+    Trials ended more than `lookback` days ago, e.g. while the scheduler
+    was not running, are looked up too.
+    """
+    def __init__(self, today=None, lookback=30, chunk_size=500):
+        self.today = today or date.today()
+        self.lookback = lookback
+        self.chunk_size = chunk_size
+        self.converted = 0
+        self.expired = 0
+
+    def ending_trials(self, day):
+        return Subscription.objects.trials_ending(day, since=day)
+
+    def process_chunk(self, rows):
+        expiring = [pk for pk, token in rows if not token]
+        converting = [pk for pk, token in rows if token]
+        if expiring:
+            moved = apply_transitions(
+                [(PENDING, EXPIRED, None)],
+                Subscription.objects.filter(pk__in=expiring))
+            self.expired += sum(moved.values())
+        if converting:
+            moved = apply_transitions(
+                [(PENDING, ACTIVE, None)],
+                Subscription.objects.filter(pk__in=converting),
+                next_billing_date=F('trial_end_date'))
+            self.converted += sum(moved.values())
+
+    def run(self):
+        for days in range(self.lookback, -1, -1):
+            trials = self.ending_trials(
+                self.today - timedelta(days=days)).order_by('pk')
+            last_pk = 0
+            while True:
+                rows = list(trials.filter(pk__gt=last_pk).values_list(
+                    'pk', 'user_vault__token')[:self.chunk_size])
+                if not rows:
+                    break
+                self.process_chunk(rows)
+                last_pk = rows[-1][0]
+        return self
+
+
+def convert_trials(today=None, lookback=30, chunk_size=500):
+    """
+    Converts or expires the ended trials, see TrialScheduler.
+    """
+    return TrialScheduler(today, lookback, chunk_size).run()
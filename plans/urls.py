@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+from django.conf.urls import url
+
+from . import views
+
+
+urlpatterns = [
+    url(r'^webhook/$', views.webhook, name='plans_webhook'),
+]
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Column-oriented credit card checks, for jobs validating millions of cards.
+
+Card numbers are given as fixed-width byte strings (a NumPy "S" array, as
+read from a database dump or a CSV column); expiry years and months as
+integer arrays. NumPy is an optional dependency, only required by this
+module.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from .credit_card import LUHN_DOUBLED, expiry_threshold
+
+
+# Doubled Luhn weights indexed by byte value minus ord('0'); non-digit
+# bytes are rejected before the lookup.
+_DOUBLED = np.zeros(256, dtype=np.uint8)
+_DOUBLED[:10] = LUHN_DOUBLED
+
+
+class BatchValidation(namedtuple('BatchValidation', 'luhn_valid expired')):
+    """
+    Result of validate_columns: boolean arrays aligned with the input rows.
+    """
+    __slots__ = ()
+
+    @property
+    def is_valid(self):
+        return self.luhn_valid & ~self.expired
+
+
+def _as_bytes(numbers):
+    numbers = np.asarray(numbers)
+    if numbers.dtype.kind == 'U':
+        numbers = np.char.encode(numbers, 'ascii')
+    if numbers.dtype.kind != 'S':
+        raise TypeError("Card numbers should be strings, got %s" %
+                        numbers.dtype)
+    return np.ascontiguousarray(numbers.ravel())
+
+
+def luhn_valid(numbers):
+    """
+    Checks the given card numbers using Luhn algorithm, returning a boolean
+    array. Numbers containing non-digit characters are invalid.
+    """
+    numbers = _as_bytes(numbers)
+    width = numbers.dtype.itemsize
+    if not len(numbers) or not width:
+        return np.ones(len(numbers), dtype=bool)
+    # One row of bytes per number; shorter numbers are padded with NULs
+    digits = numbers.view(np.uint8).reshape(len(numbers), width) - ord('0')
+    lengths = np.char.str_len(numbers)
+    columns = np.arange(width)
+    inside = columns < lengths[:, None]
+    # Digits are doubled every other position, counting from the right
+    doubled = ((lengths - 1) % 2)[:, None] != (columns % 2)
+    is_digit = digits <= 9
+    values = np.where(doubled, _DOUBLED[digits], digits)
+    values[~(inside & is_digit)] = 0
+    checksum = values.sum(axis=1, dtype=np.uint16)
+    return (checksum % 10 == 0) & np.all(is_digit | ~inside, axis=1)
+
+
+def expired(years, months, today=None):
+    """
+    Checks if cards expiring at the given years and months are expired,
+    returning a boolean array. "today" is computed once for all the rows.
+    """
+    current, current_expired = expiry_threshold(today)
+    expiry = (np.asarray(years, dtype=np.int64) * 12 +
+              np.asarray(months, dtype=np.int64))
+    if current_expired:
+        return expiry <= current
+    return expiry < current
+
+
+def validate_columns(numbers, years, months, today=None):
+    """
+    Runs the Luhn and expiry checks over whole columns in one pass.
+    """
+    return BatchValidation(luhn_valid(numbers),
+                           expired(years, months, today))
@@ -4,6 +4,7 @@ import re
 import calendar
 import six
 
+from collections import namedtuple
 from datetime import datetime
 
 
@@ -49,14 +50,7 @@ class CreditCard(object):
         """
         Checks if the credit card is valid using Luhn algorithm.
         """
-        # See http://en.wikipedia.org/wiki/Luhn_algorithm
-        try:
-            digits = [int(d) for d in self.number]
-        except ValueError:
-            return False
-        checksum = sum(digits[::-2] + [sum(divmod(d * 2, 10)) for d \
-                            in digits[-2::-2]])
-        return checksum % 10 == 0
+        return luhn_valid(self.number)
 
     def _check_number(self):
         """
@@ -95,17 +89,147 @@ class CreditCard(object):
 class Visa(CreditCard):
     card_name = "Visa"
     regexp = re.compile("^4\d{12}(\d{3})?$")
+    iin_prefixes = ("4",)
+    lengths = (13, 16)
 
 class MasterCard(CreditCard):
     card_name = "MasterCard"
     regexp = re.compile("^(5[1-5]\d{4}|677189)\d{10}$")
+    iin_prefixes = ("51", "52", "53", "54", "55", "677189")
+    lengths = (16,)
 
 class AmericanExpress(CreditCard):
     card_name = "Amex"
     regexp = re.compile("^3[47]\d{13}$")
+    iin_prefixes = ("34", "37")
+    lengths = (15,)
 
 class Discover(CreditCard):
     card_name = "Discover"
     regexp = re.compile("^(6011|65\d{2})\d{12}$")
+    iin_prefixes = ("6011", "65")
+    lengths = (16,)
 
 cards = [Visa, MasterCard, AmericanExpress, Discover]
+
+
+# Luhn weights for the digits at odd positions (counting from the right):
+# the doubled digit with its own digits summed.
+LUHN_DOUBLED = (0, 2, 4, 6, 8, 1, 3, 5, 7, 9)
+_LUHN_DOUBLED_CHARS = dict(zip('0123456789', LUHN_DOUBLED))
+
+
+def luhn_valid(number):
+    """
+    Checks the given card number using Luhn algorithm.
+    """
+    # See http://en.wikipedia.org/wiki/Luhn_algorithm
+    reverse = number[::-1]
+    try:
+        checksum = (sum(map(int, reverse[::2])) +
+                    sum(map(_LUHN_DOUBLED_CHARS.__getitem__, reverse[1::2])))
+    except (KeyError, ValueError):
+        return False
+    return checksum % 10 == 0
+
+
+def expiry_threshold(today=None):
+    """
+    Returns the current month as a number of months (year * 12 + month) and
+    whether cards expiring during the current month are already expired.
+    """
+    today = today or datetime.today()
+    # A card expires at the beginning of the last day of its month
+    last_day = calendar.monthrange(today.year, today.month)[1]
+    return (today.year * 12 + today.month,
+            today > datetime(today.year, today.month, last_day))
+
+
+def expiry_checker(today=None):
+    """
+    Returns a function telling whether a card expiring at the given year and
+    month is expired. "today" is computed once, so the returned function can
+    be used over a large number of cards.
+    """
+    current, current_expired = expiry_threshold(today)
+
+    def is_expired(year, month):
+        expiry = year * 12 + month
+        return expiry < current or (expiry == current and current_expired)
+    return is_expired
+
+
+class CardValidation(namedtuple('CardValidation',
+                                'card_type luhn_valid expired')):
+    """
+    Result of a bulk card validation. card_type is None when the card is
+    not supported.
+    """
+    __slots__ = ()
+
+    @property
+    def is_valid(self):
+        return (self.card_type is not None and self.luhn_valid and
+                not self.expired)
+
+
+class IINTrie(object):
+    """
+    Prefix tree mapping IIN prefixes and number lengths to card types.
+
+    Card types without ``iin_prefixes`` fall back to their regexp.
+    """
+    def __init__(self, card_types):
+        self.root = {}
+        self.depth = 0
+        self.fallback = []
+        for card_type in card_types:
+            prefixes = getattr(card_type, 'iin_prefixes', None)
+            if not prefixes:
+                self.fallback.append(card_type)
+                continue
+            for prefix in prefixes:
+                node = self.root
+                for digit in prefix:
+                    node = node.setdefault(digit, {})
+                # Lengths are stored under the None key of the prefix node
+                by_length = node.setdefault(None, {})
+                for length in card_type.lengths:
+                    by_length.setdefault(length, card_type)
+                self.depth = max(self.depth, len(prefix))
+
+    def lookup(self, number):
+        """
+        Returns the card type accepting the given number, or None. The most
+        specific prefix wins.
+        """
+        card_type = None
+        if number.isdigit():
+            length = len(number)
+            node = self.root
+            for digit in number[:self.depth]:
+                node = node.get(digit)
+                if node is None:
+                    break
+                by_length = node.get(None)
+                if by_length and length in by_length:
+                    card_type = by_length[length]
+        if card_type is None:
+            for fallback in self.fallback:
+                if fallback.accept(number):
+                    return fallback
+        return card_type
+
+
+_tries = {}
+
+
+def get_iin_trie(card_types):
+    """
+    Returns the IINTrie for the given card types, built once per process.
+    """
+    key = tuple(card_types)
+    trie = _tries.get(key)
+    if trie is None:
+        trie = _tries[key] = IINTrie(key)
+    return trie
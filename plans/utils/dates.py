@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import calendar
+
+from datetime import timedelta
+
+
+def add_months(date, months):
+    """
+    Returns the given date shifted by a number of months. The day is clamped
+    to the last day of the resulting month (Jan 31 + 1 month = Feb 28).
+    """
+    month = date.month - 1 + months
+    year = date.year + month // 12
+    month = month % 12 + 1
+    day = min(date.day, calendar.monthrange(year, month)[1])
+    return date.replace(year=year, month=month, day=day)
+
+
+def renewal_date(first_billing_date, billing_date):
+    """
+    Returns the billing date following billing_date, a whole number of
+    months after first_billing_date so that the day does not drift after
+    short months (Jan 31, Feb 29, Mar 31). A billing date before the first
+    one is its own anchor.
+    """
+    if first_billing_date > billing_date:
+        return add_months(billing_date, 1)
+    months = ((billing_date.year - first_billing_date.year) * 12 +
+              billing_date.month - first_billing_date.month)
+    renewal = add_months(first_billing_date, months)
+    if renewal <= billing_date:
+        renewal = add_months(first_billing_date, months + 1)
+    return renewal
+
+
+def add_period(date, amount, unit):
+    """
+    Returns the given date shifted by a period expressed in one of the
+    Plan.PERIOD_UNIT_CHOICES units.
+    """
+    if unit == "day":
+        return date + timedelta(days=amount)
+    if unit == "month":
+        return add_months(date, amount)
+    raise ValueError("Unknown period unit: %s" % unit)
+
+
+def billing_period(start_date, next_billing_date):
+    """
+    Returns the (start, end) dates of the monthly billing period ending at
+    next_billing_date, the first period starting at start_date.
+    """
+    return (max(start_date, add_months(next_billing_date, -1)),
+            next_billing_date)
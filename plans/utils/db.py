@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+Database functions.
+"""
+from django.db.models import DateField, Func, IntegerField, Value
+
+
+class DaysUntil(Func):
+    """
+    Number of days from the given date until the date expression, negative
+    once passed, or NULL if the expression is NULL.
+    """
+    template = "(%(expressions)s)"
+    arg_joiner = " - "
+    output_field = IntegerField()
+
+    def __init__(self, expression, today, **extra):
+        super(DaysUntil, self).__init__(
+            expression, Value(today, output_field=DateField()), **extra)
+
+    def as_sqlite(self, compiler, connection):
+        return self.as_sql(
+            compiler, connection, function="julianday",
+            template="CAST(julianday(%(expressions)s) AS INTEGER)",
+            arg_joiner=") - julianday(")
+
+    def as_mysql(self, compiler, connection):
+        return self.as_sql(compiler, connection, function="DATEDIFF",
+                           template="DATEDIFF(%(expressions)s)",
+                           arg_joiner=", ")
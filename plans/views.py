@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from .gateway import get_gateway
+from .gateway.base import InvalidWebhook
+from .webhooks import enqueue_events
+
+
+@csrf_exempt
+@require_POST
+def webhook(request):
+    """
+    Receives the events pushed by the billing gateway. They are only
+    stored here, see plans.webhooks.WebhookProcessor.
+    """
+    gateway = get_gateway()
+    try:
+        events = gateway.parse_webhook(request)
+    except InvalidWebhook as e:
+        return HttpResponseBadRequest(str(e))
+    enqueue_events(gateway.name, events)
+    return HttpResponse()
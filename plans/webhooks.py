@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Ingestion of the events pushed by the billing gateway.
+
+In the request path, events are only verified by the gateway and inserted
+in the WebhookEvent table, once per provider event id: replayed events are
+dropped with one indexed lookup per request. WebhookProcessor then reads
+the new events in batches of pk, after the WebhookCursor, and applies each
+batch in one transaction:
+
+* the events of a subscription are coalesced into one status transition,
+  grouped with the other subscriptions moving between the same statuses;
+* next billing dates are updated per date;
+* charges are logged with one bulk insert, once per transaction id.
+"""
+from collections import OrderedDict, defaultdict
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .gateway import base
+from .models import (
+    PaymentLog,
+    Subscription,
+    UserVault,
+    WebhookCursor,
+    WebhookEvent,
+)
+from .transitions import apply_transitions, can_transition
+
+
+# Status each kind of event moves its subscription to
+EVENT_STATUSES = {
+    base.CHARGED: Subscription.ACTIVE,
+    base.DECLINED: Subscription.PAST_DUE,
+    base.ACTIVATED: Subscription.ACTIVE,
+    base.PAST_DUE: Subscription.PAST_DUE,
+    base.CANCELED: Subscription.CANCELED,
+    base.EXPIRED: Subscription.EXPIRED,
+}
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def enqueue_events(provider, events, chunk_size=500):
+    """
+    Stores the GatewayEvents not received yet from the provider and
+    returns the number of events stored.
+    """
+    unique = OrderedDict()
+    for event in events:
+        unique.setdefault(event.event_id, event)
+    created = 0
+    for chunk in _chunks(list(unique.values()), chunk_size):
+        received = set(WebhookEvent.objects.filter(
+            provider=provider,
+            event_id__in=[event.event_id for event in chunk],
+        ).values_list('event_id', flat=True))
+        rows = [WebhookEvent(provider=provider, **event._asdict())
+                for event in chunk if event.event_id not in received]
+        if not rows:
+            continue
+        try:
+            with transaction.atomic():
+                WebhookEvent.objects.bulk_create(rows)
+            created += len(rows)
+        except IntegrityError:
+            # Some events were received concurrently, store the others
+            for row in rows:
+                try:
+                    with transaction.atomic():
+                        row.save(force_insert=True)
+                    created += 1
+                except IntegrityError:
+                    pass
+    return created
+
+
+def coalesce_status(status, kinds):
+    """
+    Returns the status a subscription in the given status reaches after
+    the events of the given kinds, in order. Events moving it to a status
+    not allowed by TRANSITIONS are ignored, and the status reached must be
+    reachable from the initial one in one transition: e.g. a pending
+    subscription activated then declined ends up active.
+    """
+    current = reached = status
+    for kind in kinds:
+        target = EVENT_STATUSES[kind]
+        if not can_transition(current, target):
+            continue
+        current = target
+        if target == status or can_transition(status, target):
+            reached = target
+    return reached
+
+
+class WebhookProcessor(object):
+    """
+    Applies the stored webhook events after the cursor of the given name.
+
+    Events are applied in id order, and a batch stops at the first event
+    received less than `delay` seconds ago: it is left to the next run with
+    the events after it, so that an event whose insert was not committed
+    yet when the cursor moved past it is not skipped.
+    """
+
+    def __init__(self, name="default", batch_size=500, delay=5):
+        self.name = name
+        self.batch_size = batch_size
+        self.delay = delay
+        self.events = 0
+        self.transitions = 0
+        self.billing_dates = 0
+        self.payments = 0
+        self.unknown = 0
+
+    def run(self):
+        """
+        Processes all the pending events, returns self.
+        """
+        while self.process_batch():
+            pass
+        return self
+
+    def process_batch(self):
+        """
+        Processes the next batch of events and returns its size.
+        """
+        received_before = timezone.now() - timedelta(seconds=self.delay)
+        with transaction.atomic():
+            cursor, _ = WebhookCursor.objects.select_for_update(
+            ).get_or_create(name=self.name)
+            events = list(WebhookEvent.objects.filter(
+                pk__gt=cursor.last_event_id,
+            ).defer('payload').order_by('pk')[:self.batch_size])
+            for index, event in enumerate(events):
+                if event.received >= received_before:
+                    del events[index:]
+                    break
+            if not events:
+                return 0
+            self.apply(events)
+            WebhookCursor.objects.filter(pk=cursor.pk).update(
+                last_event_id=events[-1].pk)
+        self.events += len(events)
+        return len(events)
+
+    def apply(self, events):
+        by_subscription = OrderedDict()
+        for event in events:
+            by_subscription.setdefault(event.subscription_id, []).append(
+                event)
+        subscriptions = dict(
+            (row[0], row[1:]) for row in Subscription.objects.filter(
+                subscription_id__in=list(by_subscription),
+            ).values_list('subscription_id', 'pk', 'status', 'user_vault_id'))
+
+        moves = defaultdict(list)
+        billing_dates = defaultdict(list)
+        vault_ids = set()
+        charges = OrderedDict()
+        for subscription_id, subscription_events in by_subscription.items():
+            if subscription_id not in subscriptions:
+                self.unknown += len(subscription_events)
+                continue
+            pk, status, vault_id = subscriptions[subscription_id]
+            target = coalesce_status(
+                status, [event.kind for event in subscription_events])
+            if target != status:
+                moves[status, target].append(pk)
+            dates = [event.next_billing_date for event in subscription_events
+                     if event.next_billing_date is not None]
+            if dates:
+                billing_dates[dates[-1]].append(pk)
+                vault_ids.add(vault_id)
+            for event in subscription_events:
+                if (event.kind == base.CHARGED and event.transaction_id
+                        and event.amount is not None):
+                    charges.setdefault(event.transaction_id,
+                                       (vault_id, event))
+
+        for (source, target), pks in sorted(moves.items()):
+            moved = apply_transitions(
+                [(source, target, None)],
+                Subscription.objects.filter(pk__in=pks))
+            self.transitions += sum(moved.values())
+        for billing_date, pks in billing_dates.items():
+            for chunk in _chunks(pks, 500):
+                self.billing_dates += Subscription.objects.filter(
+                    pk__in=chunk).update(next_billing_date=billing_date)
+        UserVault.invalidate_subscription_caches(vault_ids)
+        self.log_charges(charges)
+
+    def log_charges(self, charges):
+        """
+        Bulk inserts the payment logs of the charges not logged yet, given
+        as {transaction_id: (vault_id, event)}.
+        """
+        logged = set()
+        for chunk in _chunks(list(charges), 500):
+            logged.update(PaymentLog.objects.filter(
+                transaction_id__in=chunk,
+            ).values_list('transaction_id', flat=True))
+        logs = [
+            PaymentLog(vault_id=vault_id, transaction_id=transaction_id,
+                       amount=event.amount, currency=event.currency)
+            for transaction_id, (vault_id, event) in charges.items()
+            if transaction_id not in logged
+        ]
+        PaymentLog.objects.bulk_create(logs)
+        self.payments += len(logs)
@@ -14,11 +14,19 @@ if not settings.configured:
         },
         MIDDLEWARE_CLASSES=(
             'django.middleware.common.CommonMiddleware',
+            'django.contrib.sessions.middleware.SessionMiddleware',
             'django.middleware.csrf.CsrfViewMiddleware',
+            'django.contrib.auth.middleware.AuthenticationMiddleware',
+            'django.contrib.messages.middleware.MessageMiddleware',
         ),
         INSTALLED_APPS=(
+            'django.contrib.admin',
             'django.contrib.auth',
             'django.contrib.contenttypes',
+            'django.contrib.messages',
+            'django.contrib.sessions',
+            'django_countries',
+            'plans',
             'tests',
             'django_nose',
         ),
@@ -33,6 +41,17 @@ if not settings.configured:
             '--cover-erase',
             '--cover-package=tests',
         ],
+        TEMPLATES=[{
+            'BACKEND': 'django.template.backends.django.DjangoTemplates',
+            'APP_DIRS': True,
+            'OPTIONS': {
+                'context_processors': [
+                    'django.contrib.auth.context_processors.auth',
+                    'django.contrib.messages.context_processors.messages',
+                ],
+            },
+        }],
+        ROOT_URLCONF='tests.urls',
         SITE_ID=1,
         SECRET_KEY='this-is-just-for-tests',
     )
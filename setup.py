@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import os, re
-from setuptools import setup
+from setuptools import find_packages, setup
 
 
 PROJECT_DIR = os.path.dirname(__file__)
@@ -25,12 +25,15 @@ setup(
     author_email='benzid.wael@hotmail.fr',
     version=version,
     url='https://github.com/benzid-wael/django-plans',
-    packages=['plans'],
+    packages=find_packages(exclude=['tests', 'benchmarks']),
+    package_data={'plans': ['templates/plans/*.html']},
     description='Dajngo application to manage plans and features',
     long_description=readme,
     install_requires=[
         "six>=1.7.3",
-        "django-countries==2.1.2",
+        "Django>=1.11",
+        "django-countries>=4.0",
+        "futures>=3.0; python_version < '3'",
     ],
     zip_safe=False,
     #tests_require=['coverage', 'nose'],
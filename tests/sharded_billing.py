@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Billing worker process of test_sharded_billing, run on a SQLite database
+file shared with the other workers:
+
+    python -m tests.sharded_billing DATABASE seed COUNT
+    python -m tests.sharded_billing DATABASE work WORKER_ID
+
+The seed command migrates the database and creates COUNT due
+subscriptions, the work command bills them and prints the number charged.
+"""
+from __future__ import print_function
+
+import sys
+
+from datetime import date
+
+import django
+from django.conf import settings
+
+TODAY = date(2020, 3, 10)
+
+
+def setup(database):
+    settings.configure(
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': database,
+                # Wait for the locks of the other workers
+                'OPTIONS': {'timeout': 60},
+            }
+        },
+        INSTALLED_APPS=(
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'django_countries',
+            'plans',
+        ),
+        SECRET_KEY='this-is-just-for-tests',
+    )
+    django.setup()
+
+
+def seed(count):
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from plans.models import Plan, Subscription, UserVault
+
+    call_command('migrate', verbosity=0)
+    plan = Plan.objects.create(name="Basic", plan_id="basic", price="9.90")
+    for i in range(count):
+        user = User.objects.create(username="user%s" % i)
+        vault = UserVault.objects.create(user=user, vault_id="v%s" % i)
+        Subscription.objects.create(
+            subscription_id="s%s" % i, user_vault=vault, plan=plan,
+            status=Subscription.ACTIVE, next_billing_date=TODAY)
+
+
+def work(worker_id):
+    from plans.billing import BillingRun
+    from plans.gateway.dummy import DummyGateway
+
+    run = BillingRun(TODAY, DummyGateway(latency=0.002), chunk_size=5,
+                     concurrency=1, worker_id=worker_id).run()
+    print(run.charged)
+
+
+def main(argv):
+    database, command, argument = argv
+    setup(database)
+    if command == "seed":
+        seed(int(argument))
+    else:
+        work(argument)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
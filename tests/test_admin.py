@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from plans.models import (
+    BillingInfo,
+    PaymentLog,
+    Plan,
+    Subscription,
+    UserVault,
+)
+
+
+def create_rows(count, start=0):
+    plan, _ = Plan.objects.get_or_create(name="Basic", plan_id="basic",
+                                         price="10.00")
+    users = User.objects.bulk_create([
+        User(username="user%s" % i) for i in range(start, start + count)])
+    users = User.objects.filter(username__in=[u.username for u in users])
+    BillingInfo.objects.bulk_create([
+        BillingInfo(user=user, name=user.username, country="FR")
+        for user in users])
+    vaults = UserVault.objects.bulk_create([
+        UserVault(user=user, vault_id=user.username) for user in users])
+    vaults = UserVault.objects.filter(vault_id__in=[v.vault_id
+                                                    for v in vaults])
+    Subscription.objects.bulk_create([
+        Subscription(subscription_id=vault.vault_id, user_vault=vault,
+                     plan=plan, status=Subscription.ACTIVE)
+        for vault in vaults])
+    PaymentLog.objects.bulk_create([
+        PaymentLog(vault=vault, transaction_id=vault.vault_id,
+                   amount="10.00")
+        for vault in vaults])
+
+
+class ListingQueriesTests(TestCase):
+
+    models = (BillingInfo, UserVault, Subscription, PaymentLog)
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser("admin", "a@b.c", "pw")
+        self.client.force_login(self.admin)
+
+    def changelist_queries(self, model):
+        url = "/admin/plans/%s/" % model._meta.model_name
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_str(self):
+        create_rows(1000)
+        for model in self.models:
+            with self.assertNumQueries(1):
+                self.assertEqual(len([str(obj)
+                                      for obj in model.objects.all()]), 1000)
+
+    def test_changelists(self):
+        create_rows(10)
+        small = [self.changelist_queries(model) for model in self.models]
+        create_rows(990, start=10)
+        large = [self.changelist_queries(model) for model in self.models]
+        self.assertEqual(small, large)
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from six import StringIO
+
+from plans import billing
+from plans.billing import (
+    BillingRun,
+    claim_due_subscriptions,
+    reserve_payments,
+)
+from plans.gateway.base import Gateway, GatewayError, GatewayNotSent
+from plans.gateway.concurrency import ConcurrentGateway
+from plans.gateway.dummy import DummyGateway
+from plans.models import PaymentLog, Plan, Subscription, UserVault
+from plans.utils.dates import add_months, renewal_date
+
+
+class BillingTestGateway(Gateway):
+
+    name = "Billing Test Gateway"
+
+    def __init__(self):
+        self.charges = []
+
+    def charge(self, credit_card, amount, options=None):
+        if options["vault_id"].startswith("declined"):
+            raise GatewayError("Declined")
+        self.charges.append((options["subscription_id"], amount))
+        return "tx-%s" % options["subscription_id"]
+
+
+def create_subscriptions(count, plan, next_billing_date, prefix="v",
+                         status=Subscription.ACTIVE, start_date=None):
+    subscriptions = []
+    for i in range(count):
+        user = User.objects.create(username="%s%s" % (prefix, i))
+        vault = UserVault.objects.create(user=user,
+                                         vault_id="%s%s" % (prefix, i))
+        subscriptions.append(Subscription.objects.create(
+            subscription_id="%s%s" % (prefix, i), user_vault=vault,
+            plan=plan, status=status, next_billing_date=next_billing_date,
+            start_date=start_date or next_billing_date))
+    return subscriptions
+
+
+class DatesTests(TestCase):
+
+    def test_add_months(self):
+        self.assertEqual(add_months(date(2020, 1, 31), 1), date(2020, 2, 29))
+        self.assertEqual(add_months(date(2020, 12, 15), 1), date(2021, 1, 15))
+        self.assertEqual(add_months(date(2020, 1, 15), -1),
+                         date(2019, 12, 15))
+        self.assertEqual(add_months(date(2020, 1, 15), 25), date(2022, 2, 15))
+
+    def test_renewal_date(self):
+        start = date(2020, 1, 31)
+        self.assertEqual(renewal_date(start, date(2020, 1, 31)),
+                         date(2020, 2, 29))
+        self.assertEqual(renewal_date(start, date(2020, 2, 29)),
+                         date(2020, 3, 31))
+        self.assertEqual(renewal_date(start, date(2020, 4, 30)),
+                         date(2020, 5, 31))
+        self.assertEqual(renewal_date(date(2020, 1, 15), date(2020, 3, 10)),
+                         date(2020, 3, 15))
+        self.assertEqual(renewal_date(date(2020, 5, 1), date(2020, 3, 10)),
+                         date(2020, 4, 10))
+
+
+class BillingRunTests(TestCase):
+
+    def setUp(self):
+        self.today = date(2020, 3, 10)
+        self.plan = Plan.objects.create(name="Basic", plan_id="basic",
+                                        price="9.90", currency="USD")
+        self.due = create_subscriptions(5, self.plan, date(2020, 3, 10))
+        self.overdue = create_subscriptions(2, self.plan, date(2020, 2, 29),
+                                            prefix="o",
+                                            start_date=date(2020, 1, 31))
+        self.later = create_subscriptions(2, self.plan, date(2020, 3, 11),
+                                          prefix="l")
+        self.declined = create_subscriptions(1, self.plan, date(2020, 3, 1),
+                                             prefix="declined")
+        self.gateway = BillingTestGateway()
+
+    def test_run(self):
+        run = BillingRun(self.today, self.gateway, chunk_size=2).run()
+        self.assertEqual((run.charged, run.failed), (7, 1))
+        self.assertEqual(len(self.gateway.charges), 7)
+        self.assertEqual(PaymentLog.objects.count(), 7)
+        log = PaymentLog.objects.get(transaction_id="tx-v0")
+        self.assertEqual((log.amount, log.currency),
+                         (Decimal("9.90"), "USD"))
+        self.assertEqual(
+            Subscription.objects.get(pk=self.due[0].pk).next_billing_date,
+            date(2020, 4, 10))
+        self.assertEqual(
+            Subscription.objects.get(pk=self.overdue[0].pk).next_billing_date,
+            date(2020, 3, 31))
+        self.assertEqual(
+            Subscription.objects.get(pk=self.later[0].pk).next_billing_date,
+            date(2020, 3, 11))
+        self.assertEqual(
+            Subscription.objects.get(pk=self.declined[0].pk).status,
+            Subscription.PAST_DUE)
+
+    def test_concurrent_run(self):
+        gateway = DummyGateway(declined_vaults=["declined0"])
+        run = BillingRun(self.today, gateway, chunk_size=3,
+                         concurrency=4).run()
+        self.assertEqual((run.charged, run.failed, run.errors), (7, 1, 0))
+        self.assertEqual(PaymentLog.objects.count(), 7)
+
+    def test_gateway_errors(self):
+        gateway = BillingTestGateway()
+        gateway.charge = lambda *args: 1 / 0
+        run = BillingRun(self.today, gateway).run()
+        self.assertEqual((run.charged, run.failed, run.errors), (0, 0, 8))
+        self.assertEqual(
+            Subscription.objects.get(pk=self.due[0].pk).status,
+            Subscription.ACTIVE)
+        # The charges may have been made: they are only retried, with the
+        # same idempotency keys, once their reservation is stale
+        self.assertEqual(
+            PaymentLog.objects.filter(status=PaymentLog.PENDING).count(), 8)
+        run = BillingRun(self.today, self.gateway).run()
+        self.assertEqual((run.charged, run.skipped), (0, 8))
+        self.assertEqual(self.gateway.charges, [])
+        keys = set(PaymentLog.objects.values_list('idempotency_key',
+                                                  flat=True))
+        PaymentLog.objects.filter(vault__vault_id="v0").update(
+            amount="12.00")
+        PaymentLog.objects.update(
+            modified=timezone.now() - timedelta(seconds=601))
+        run = BillingRun(self.today, self.gateway).run()
+        self.assertEqual((run.charged, run.failed, run.skipped), (7, 1, 0))
+        self.assertIn(("v0", Decimal("12.00")), self.gateway.charges)
+        self.assertEqual(set(PaymentLog.objects.values_list(
+            'idempotency_key', flat=True)), keys - set(
+                PaymentLog.idempotency_key_for(subscription,
+                                               subscription.next_billing_date)
+                for subscription in self.declined))
+        self.assertEqual(PaymentLog.objects.filter(
+            status=PaymentLog.PENDING).count(), 0)
+
+    def test_not_sent(self):
+        charge = self.gateway.charge
+
+        def not_sent(credit_card, amount, options=None):
+            if options["vault_id"] == "v0":
+                raise GatewayNotSent("Canceled")
+            return charge(credit_card, amount, options)
+
+        self.gateway.charge = not_sent
+        run = BillingRun(self.today, self.gateway).run()
+        self.assertEqual((run.charged, run.failed, run.errors), (6, 1, 1))
+        # Released for the next run
+        self.assertFalse(PaymentLog.objects.filter(
+            vault__vault_id="v0").exists())
+        self.assertEqual(
+            Subscription.objects.get(pk=self.due[0].pk).next_billing_date,
+            self.today)
+        self.gateway.charge = charge
+        run = BillingRun(self.today, self.gateway).run()
+        self.assertEqual((run.charged, run.failed, run.skipped), (1, 1, 0))
+        self.assertEqual(self.gateway.charges[-1], ("v0", Decimal("9.90")))
+
+    def test_idempotent_retry(self):
+        # A worker crashed after charging v0, another one committed v1
+        for subscription, status in [(self.due[0], PaymentLog.PENDING),
+                                     (self.due[1], PaymentLog.SUCCEEDED)]:
+            PaymentLog.objects.create(
+                vault=subscription.user_vault, status=status, amount="9.90",
+                idempotency_key=PaymentLog.idempotency_key_for(
+                    subscription, subscription.next_billing_date))
+        run = BillingRun(self.today, self.gateway).run()
+        self.assertEqual((run.charged, run.failed, run.skipped), (5, 1, 2))
+        charged = set(subscription_id
+                      for subscription_id, amount in self.gateway.charges)
+        self.assertFalse(charged & set(["v0", "v1"]))
+        # Declined reservations are released for the next attempt
+        self.assertEqual(PaymentLog.objects.count(), 7)
+        run = BillingRun(self.today, self.gateway).run()
+        self.assertEqual((run.charged, run.failed, run.skipped), (0, 1, 2))
+
+    def test_claims(self):
+        first = claim_due_subscriptions("w1", self.today, 5)
+        second = claim_due_subscriptions("w2", self.today, 5)
+        self.assertEqual(len(first), 5)
+        self.assertEqual(len(second), 3)
+        self.assertFalse(set(first) & set(second))
+        self.assertEqual(claim_due_subscriptions("w3", self.today, 5), [])
+        # The lease of a crashed worker expires
+        Subscription.objects.filter(pk=first[0].pk).update(
+            lease_expires=datetime(2000, 1, 1))
+        self.assertEqual(claim_due_subscriptions("w3", self.today, 5),
+                         [first[0]])
+
+    def test_claim_long_worker_id(self):
+        worker_id = "worker-%s" % ("x" * 100)
+        claimed = claim_due_subscriptions(worker_id, self.today, 5)
+        self.assertEqual(len(claimed), 5)
+        owner = claimed[0].lease_owner
+        self.assertEqual(len(owner), 64)
+        self.assertTrue(owner.startswith("worker-xxx"))
+        # Each claim gets its own token
+        self.assertEqual(len(claim_due_subscriptions(worker_id, self.today,
+                                                     5)), 3)
+
+    def test_worker_run(self):
+        runs = [BillingRun(self.today, self.gateway, chunk_size=3,
+                           worker_id=worker_id) for worker_id in ["w1", "w2"]]
+        chunks = [run.due_subscriptions() for run in runs]
+        # Interleave the chunks of both workers
+        for chunk in next(chunks[0]), next(chunks[1]), next(chunks[0]):
+            runs[0].process_chunk(ConcurrentGateway(self.gateway), chunk)
+        self.assertEqual(list(chunks[1]), [])
+        self.assertEqual(list(chunks[0]), [])
+        self.assertEqual(len(self.gateway.charges), 7)
+        self.assertEqual(PaymentLog.objects.count(), 7)
+        renewed = Subscription.objects.get(pk=self.due[0].pk)
+        self.assertEqual(renewed.lease_owner, None)
+
+    def test_adjustments(self):
+        for subscription, amounts in [(self.due[0], ["-3.00", "1.00"]),
+                                      (self.due[1], ["-25.00"]),
+                                      (self.declined[0], ["-1.00"])]:
+            for i, amount in enumerate(amounts):
+                PaymentLog.objects.create(
+                    vault=subscription.user_vault, amount=amount,
+                    currency="USD", status=PaymentLog.ADJUSTMENT,
+                    idempotency_key="%s:adjustment:%s" % (
+                        subscription.subscription_id, i))
+        run = BillingRun(self.today, self.gateway).run()
+        self.assertEqual((run.charged, run.failed), (7, 1))
+        charges = dict(self.gateway.charges)
+        self.assertEqual(charges["v0"], Decimal("7.90"))
+        # Covered by the credit, which is carried over
+        self.assertNotIn("v1", charges)
+        key = PaymentLog.idempotency_key_for(self.due[1], self.today)
+        self.assertEqual(PaymentLog.objects.get(idempotency_key=key).status,
+                         PaymentLog.SUCCEEDED)
+        self.assertEqual(
+            PaymentLog.objects.get(idempotency_key=key + ":credit").amount,
+            Decimal("-15.10"))
+        self.assertEqual(
+            Subscription.objects.get(pk=self.due[1].pk).next_billing_date,
+            date(2020, 4, 10))
+        self.assertEqual(sorted(PaymentLog.objects.filter(
+            status=PaymentLog.ADJUSTMENT,
+        ).values_list('vault__vault_id', 'amount', 'applied_to')), [
+            ("declined0", Decimal("-1.00"), None),
+            ("v0", Decimal("-3.00"), "v0:2020-03-10"),
+            ("v0", Decimal("1.00"), "v0:2020-03-10"),
+            ("v1", Decimal("-25.00"), "v1:2020-03-10"),
+            ("v1", Decimal("-15.10"), None),
+        ])
+        # The adjustments are applied once
+        self.gateway.charges = []
+        BillingRun(date(2020, 4, 10), self.gateway).run()
+        self.assertEqual(dict(self.gateway.charges)["v0"], Decimal("9.90"))
+        self.assertNotIn("v1", dict(self.gateway.charges))
+        self.assertEqual(PaymentLog.objects.get(
+            idempotency_key="v1:2020-04-10:credit").amount, Decimal("-5.20"))
+
+    def test_adjustment_currency(self):
+        vault = self.due[0].user_vault
+        for currency in ["USD", "EUR"]:
+            PaymentLog.objects.create(
+                vault=vault, amount="-2.00", currency=currency,
+                status=PaymentLog.ADJUSTMENT,
+                idempotency_key="adjustment:%s" % currency)
+        BillingRun(self.today, self.gateway).run()
+        self.assertEqual(dict(self.gateway.charges)["v0"], Decimal("7.90"))
+        # Not settled in another currency
+        self.assertIsNone(PaymentLog.objects.get(
+            idempotency_key="adjustment:EUR").applied_to)
+
+    def test_reserve_payments(self):
+        vault = self.due[0].user_vault
+        logs = [PaymentLog(vault=vault, idempotency_key=key, amount="1.00",
+                           status=PaymentLog.PENDING)
+                for key in ["a", "b", "a"]]
+        self.assertEqual(reserve_payments(logs), set(["a", "b"]))
+        self.assertEqual(PaymentLog.objects.count(), 2)
+        self.assertEqual(reserve_payments(logs), set())
+
+    def test_run_is_chunked(self):
+        # Two selects (the chunk and an empty one), the usage and
+        # adjustments lookups, the reservation (a select and the bulk insert
+        # in a savepoint), then in a savepoint: the logs update, one update
+        # per new billing date, and the delete and update of the declined
+        # subscription
+        with self.assertNumQueries(2 + 2 + (1 + 3) + (2 + 1 + 2 + 2)):
+            BillingRun(self.today, self.gateway, chunk_size=10).run()
+
+    def test_logs_update_batches(self):
+        batch_size = billing.UPDATE_BATCH_SIZE
+        billing.UPDATE_BATCH_SIZE = 3
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                BillingRun(self.today, self.gateway).run()
+        finally:
+            billing.UPDATE_BATCH_SIZE = batch_size
+        updates = [query for query in queries.captured_queries
+                   if query['sql'].startswith('UPDATE "plans_paymentlog"')]
+        # 7 charged logs
+        self.assertEqual(len(updates), 3)
+        self.assertEqual(sorted(PaymentLog.objects.values_list(
+            'status', 'transaction_id')), sorted(
+            (PaymentLog.SUCCEEDED, "tx-%s" % subscription_id)
+            for subscription_id, _ in self.gateway.charges))
+
+    @override_settings(PLANS={
+        "BILLING_GATEWAY": "tests.test_billing.BillingTestGateway"})
+    def test_command(self):
+        out = StringIO()
+        call_command("plans_billing_run", "--date=2020-03-10", stdout=out)
+        self.assertEqual(out.getvalue().strip(),
+                         "7 subscriptions charged, 1 failed, 0 errors, "
+                         "0 already reserved.")
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+from threading import Thread
+from unittest import skipIf
+
+from django.test import RequestFactory, TestCase, override_settings
+
+from six.moves.urllib.parse import urlencode
+
+from plans.gateway import base
+from plans.gateway.base import GatewayNotConfigured, InvalidWebhook
+
+try:
+    import braintree
+    from plans.gateway import braintree_payements_gateway as bt
+except ImportError:
+    braintree = None
+
+
+class FakeResponse(object):
+    status_code = 500
+    text = ""
+
+
+class FakeSession(object):
+
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url))
+        return FakeResponse()
+
+    def close(self):
+        pass
+
+
+@skipIf(braintree is None, "braintree is not installed")
+@override_settings(PLANS={
+    "GATEWAY_SETTINGS": {
+        "MERCHANT_ACCOUNT_ID": "merchant",
+        "PUBLIC_KEY": "public",
+        "PRIVATE_KEY": "private",
+    },
+})
+class BraintreeGatewayTests(TestCase):
+
+    @override_settings(PLANS={"GATEWAY_SETTINGS": {"PUBLIC_KEY": "public"}})
+    def test_not_configured(self):
+        self.assertRaises(GatewayNotConfigured, bt.BraintreeGateway)
+
+    def test_shared_client(self):
+        clients = []
+        threads = [Thread(target=lambda: clients.append(
+            bt.BraintreeGateway().client)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(id(client) for client in clients)), 1)
+        config = clients[0].config
+        self.assertEqual(config.merchant_id, "merchant")
+        self.assertTrue(isinstance(config.http_strategy(), bt.SessionHttp))
+        # The global configuration is left untouched
+        self.assertNotEqual(
+            getattr(braintree.Configuration, "merchant_id", None), "merchant")
+
+    def test_session_reused(self):
+        session = FakeSession()
+        http = bt.get_client().config.http_strategy()
+        http.session = session
+        for _ in range(2):
+            self.assertRaises(braintree.exceptions.ServerError,
+                              bt.BraintreeGateway().void, "tx")
+        self.assertEqual(len(session.requests), 2)
+        method, url = session.requests[0]
+        self.assertEqual(method, "PUT")
+        self.assertTrue(url.endswith(
+            "/merchants/merchant/transactions/tx/void"))
+
+    def test_charge_order_id(self):
+        sales = []
+
+        class Result(object):
+            is_success = True
+
+            class transaction(object):
+                id = "tx1"
+
+        transaction = bt.get_client().transaction
+        transaction.sale = lambda params: sales.append(params) or Result
+        try:
+            self.assertEqual(bt.BraintreeGateway().charge(
+                None, "9.90", {"token": "tok", "idempotency_key": "s1:key"}),
+                "tx1")
+        finally:
+            del transaction.sale
+        self.assertEqual(sales[0]["order_id"], "s1:key")
+        self.assertEqual(sales[0]["payment_method_token"], "tok")
+
+    def webhook_request(self, kind, subscription_id, tamper=False):
+        params = bt.get_client().webhook_testing.sample_notification(
+            kind, subscription_id)
+        if tamper:
+            signature = params["bt_signature"]
+            params["bt_signature"] = signature[:-1] + (
+                "1" if signature.endswith("0") else "0")
+        return RequestFactory().post(
+            "/webhook/", urlencode(params),
+            content_type="application/x-www-form-urlencoded")
+
+    def test_parse_webhook(self):
+        gateway = bt.BraintreeGateway()
+        Kind = braintree.WebhookNotification.Kind
+        request = self.webhook_request(Kind.SubscriptionChargedSuccessfully,
+                                       "s1")
+        event, = gateway.parse_webhook(request)
+        self.assertEqual(event.kind, base.CHARGED)
+        self.assertEqual(event.subscription_id, "s1")
+        self.assertTrue(event.transaction_id)
+        self.assertTrue(event.amount > 0)
+        self.assertEqual(event.event_id, gateway.parse_webhook(
+            request)[0].event_id)
+        event, = gateway.parse_webhook(self.webhook_request(
+            Kind.SubscriptionCanceled, "s1"))
+        self.assertEqual(event.kind, base.CANCELED)
+        self.assertEqual(event.transaction_id, "")
+        # Not consumed
+        self.assertEqual(gateway.parse_webhook(self.webhook_request(
+            Kind.SubscriptionTrialEnded, "s1")), [])
+
+    def test_parse_webhook_invalid_signature(self):
+        request = self.webhook_request(
+            braintree.WebhookNotification.Kind.SubscriptionCanceled, "s1",
+            tamper=True)
+        self.assertRaises(InvalidWebhook,
+                          bt.BraintreeGateway().parse_webhook, request)
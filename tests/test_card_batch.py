@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from unittest import skipIf
+
+from django.test import TestCase
+
+from plans.utils.credit_card import expiry_checker, luhn_valid
+
+try:
+    import numpy as np
+    from plans.utils import card_batch
+except ImportError:
+    np = None
+
+
+@skipIf(np is None, "NumPy is not installed")
+class CardBatchTestCase(TestCase):
+
+    numbers = ["4111111111111111", "4111123111111111", "378282246310005",
+               "4222222222222", "abcd", "411111111111111a", "0", "18", ""]
+
+    def test_luhn_valid(self):
+        result = card_batch.luhn_valid(np.array(self.numbers, dtype='S19'))
+        self.assertEqual(result.tolist(),
+                         [luhn_valid(n) for n in self.numbers])
+
+    def test_luhn_valid_unicode(self):
+        result = card_batch.luhn_valid(self.numbers)
+        self.assertEqual(result.tolist(),
+                         [luhn_valid(n) for n in self.numbers])
+
+    def test_expired(self):
+        years = [2019, 2020, 2020, 2020, 2021]
+        months = [12, 1, 2, 3, 1]
+        for today in [datetime(2020, 2, 10), datetime(2020, 2, 29, 12)]:
+            is_expired = expiry_checker(today)
+            result = card_batch.expired(years, months, today)
+            self.assertEqual(result.tolist(),
+                             [is_expired(y, m) for y, m in zip(years, months)])
+
+    def test_validate_columns(self):
+        result = card_batch.validate_columns(
+            np.array(["4111111111111111", "4111111111111111", "abcd"],
+                     dtype='S16'),
+            np.array([2090, 1990, 2090]),
+            np.array([12, 12, 12]),
+        )
+        self.assertEqual(result.is_valid.tolist(), [True, False, False])
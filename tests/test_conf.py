@@ -2,11 +2,19 @@
 
 from nose.tools import raises
 
-from django.test import TestCase
+from decimal import Decimal
+
+from django.test import TestCase, override_settings
 from django.core.exceptions import ImproperlyConfigured
 
+from plans.gateway import get_gateway
 from plans.gateway.base import Gateway
-from plans.conf import Settings, DEFAULT_SETTINGS, NotFoundAttribute
+from plans.conf import (
+    Settings,
+    DEFAULT_SETTINGS,
+    NotFoundAttribute,
+    plan_settings,
+)
 
 
 TEST_USER_SETTINGS = {
@@ -18,6 +26,10 @@ TEST_USER_SETTINGS = {
     "TAX_PERCENT": 10,
 }
 
+# Settings resolved by the snapshot, with a local taxation policy
+SNAPSHOT_SETTINGS = dict(TEST_USER_SETTINGS,
+                         TAXATION_POLICY="tests.test_conf.TaxationPolicy")
+
 
 class BadGateway(object):
     pass
@@ -25,6 +37,9 @@ class BadGateway(object):
 class BillingGateway(Gateway):
     pass
 
+class TaxationPolicy(object):
+    pass
+
 
 class SettingsTests(TestCase):
     """Basic tests for Settings class."""
@@ -73,3 +88,38 @@ class SettingsTests(TestCase):
         setting = Settings(test_user_setting, DEFAULT_SETTINGS)
         app_name = setting.APP_NAME
         self.assertEqual(app_name, expected)
+
+
+class SettingsSnapshotTests(TestCase):
+
+    def test_freeze(self):
+        snapshot = Settings(SNAPSHOT_SETTINGS, DEFAULT_SETTINGS).freeze()
+        self.assertEqual(snapshot.DEFAULT_PLAN, "default_plan_name")
+        self.assertEqual(snapshot.CACHE_ALIAS, None)
+        self.assertEqual(snapshot.tax_policy, TaxationPolicy)
+        self.assertEqual(snapshot.tax_percent, Decimal("10"))
+        self.assertRaises(AttributeError, setattr, snapshot, "TEST_MODE",
+                          True)
+
+    @raises(ImproperlyConfigured)
+    def test_invalid_tax_percent(self):
+        Settings({"TAX_PERCENT": "ten"}, DEFAULT_SETTINGS).freeze()
+
+    @raises(ImproperlyConfigured)
+    def test_notfound_tax_policy(self):
+        Settings({"TAXATION_POLICY": "tests.test_conf.Undefined"},
+                 DEFAULT_SETTINGS).freeze()
+
+    def test_read_only(self):
+        self.assertRaises(AttributeError, setattr, plan_settings,
+                          "TEST_MODE", True)
+        self.assertRaises(NotFoundAttribute, getattr, plan_settings,
+                          "UNDEFINED")
+
+    def test_reload(self):
+        self.assertEqual(plan_settings.DEFAULT_PLAN, None)
+        with override_settings(PLANS=SNAPSHOT_SETTINGS):
+            self.assertEqual(plan_settings.DEFAULT_PLAN, "default_plan_name")
+            self.assertIsInstance(get_gateway(), BillingGateway)
+        self.assertEqual(plan_settings.DEFAULT_PLAN, None)
+        self.assertRaises(ImproperlyConfigured, get_gateway)
@@ -1,8 +1,19 @@
 # -*- coding: utf-8 -*-
 
+from datetime import datetime
+
 from django.test import TestCase
 
-from plans.utils.credit_card import CreditCard, Visa
+from plans.utils.credit_card import (
+    AmericanExpress,
+    CreditCard,
+    Discover,
+    MasterCard,
+    Visa,
+    cards,
+    expiry_checker,
+    get_iin_trie,
+)
 from tests import credit_card
 
 
@@ -63,3 +74,23 @@ class CreditCardTestCase(TestCase):
     def test_invalid_visa(self):
         self.assertEqual(Visa.accept("11111"), False)
         self.assertEqual(Visa.accept("1111111111111111"), False)
+
+    def test_iin_trie(self):
+        trie = get_iin_trie(cards)
+        self.assertEqual(trie.lookup("4111111111111111"), Visa)
+        self.assertEqual(trie.lookup("4222222222222"), Visa)
+        self.assertEqual(trie.lookup("41111111111111"), None)
+        self.assertEqual(trie.lookup("5105105105105100"), MasterCard)
+        self.assertEqual(trie.lookup("6771890000000000"), MasterCard)
+        self.assertEqual(trie.lookup("371449635398431"), AmericanExpress)
+        self.assertEqual(trie.lookup("6500000000000002"), Discover)
+        self.assertEqual(trie.lookup("411111111111111a"), None)
+        self.assertTrue(get_iin_trie(cards) is trie)
+
+    def test_expiry_checker(self):
+        is_expired = expiry_checker(datetime(2020, 2, 10))
+        self.assertEqual(is_expired(2020, 1), True)
+        self.assertEqual(is_expired(2020, 2), False)
+        self.assertEqual(is_expired(2021, 1), False)
+        is_expired = expiry_checker(datetime(2020, 2, 29, 12))
+        self.assertEqual(is_expired(2020, 2), True)
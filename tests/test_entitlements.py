@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.test import TestCase, override_settings
+
+from plans.catalog import plan_catalog
+from plans.entitlements import (
+    entitlement_map,
+    get_entitlements,
+    has_entitlement,
+    merge_entitlements,
+)
+from plans.models import Entitlement, Plan, Subscription, UserVault
+from plans.transitions import CANCELED, transition
+
+from .utils import run_on_commit
+
+
+class EntitlementTests(TestCase):
+
+    def setUp(self):
+        plan_catalog.invalidate()
+        entitlement_map.invalidate()
+        entitlement_map.stats.reset()
+        self.free = Plan.objects.create(name="Free", plan_id="free",
+                                        price="0.00", default=True)
+        self.pro = Plan.objects.create(name="Pro", plan_id="pro",
+                                       price="20.00")
+        Entitlement.objects.create(plan=self.free, feature="projects",
+                                   limit=1)
+        Entitlement.objects.create(plan=self.pro, feature="projects",
+                                   limit=10)
+        Entitlement.objects.create(plan=self.pro, feature="export")
+        self.user = User.objects.create(username="user")
+        self.vault = UserVault.objects.create(user=self.user, vault_id="v1")
+        self.subscription = Subscription.objects.create(
+            subscription_id="s1", user_vault=self.vault, plan=self.pro,
+            status=Subscription.ACTIVE, next_billing_date=date(2020, 4, 1))
+
+    def test_merge(self):
+        self.assertEqual(merge_entitlements([
+            {"projects": 1, "export": None},
+            {"projects": 10, "export": 5, "api": None},
+            {"projects": None},
+        ]), {"projects": None, "export": None, "api": None})
+
+    def test_has_entitlement(self):
+        self.assertTrue(has_entitlement(self.user, "export"))
+        self.assertTrue(has_entitlement(self.user, "export", usage=1000))
+        self.assertTrue(has_entitlement(self.user, "projects", usage=9))
+        self.assertFalse(has_entitlement(self.user, "projects", usage=10))
+        self.assertFalse(has_entitlement(self.user, "api"))
+        self.assertEqual(get_entitlements(self.user),
+                         {"projects": 10, "export": None})
+
+    def test_queries(self):
+        # Entitlements of the plans and subscriptions of the user
+        with self.assertNumQueries(2):
+            has_entitlement(self.user, "export")
+        with self.assertNumQueries(0):
+            for i in range(100):
+                has_entitlement(self.user, "export")
+        # Users without subscription get the default plan of the catalog
+        other = User.objects.create(username="other")
+        with self.assertNumQueries(1 + 1):
+            has_entitlement(other, "export")
+        self.assertEqual(entitlement_map.stats.local_hits, 100)
+
+    def test_default_plan(self):
+        other = User.objects.create(username="other")
+        self.assertEqual(get_entitlements(other), {"projects": 1})
+        self.assertEqual(get_entitlements(AnonymousUser()), {"projects": 1})
+        Plan.objects.filter(pk=self.free.pk).update(default=False)
+        plan_catalog.invalidate()
+        entitlement_map.invalidate()
+        self.assertEqual(get_entitlements(other), {})
+        self.assertEqual(get_entitlements(AnonymousUser()), {})
+
+    def test_subscription_changes(self):
+        self.assertTrue(has_entitlement(self.user, "export"))
+        self.subscription.plan = self.free
+        self.subscription.save()
+        # Until the change is committed
+        self.assertTrue(has_entitlement(self.user, "export"))
+        run_on_commit()
+        self.assertFalse(has_entitlement(self.user, "export"))
+        self.subscription.delete()
+        run_on_commit()
+        self.assertEqual(get_entitlements(self.user), {"projects": 1})
+        vault = UserVault.objects.create(user=self.user, vault_id="v2")
+        Subscription.objects.create(
+            subscription_id="s2", user_vault=vault, plan=self.pro,
+            status=Subscription.PENDING)
+        run_on_commit()
+        self.assertTrue(has_entitlement(self.user, "export"))
+
+    def test_bulk_transition(self):
+        self.assertTrue(has_entitlement(self.user, "export"))
+        transition(Subscription.objects.filter(pk=self.subscription.pk),
+                   CANCELED)
+        run_on_commit()
+        self.assertFalse(has_entitlement(self.user, "export"))
+
+    def test_plan_changes(self):
+        self.assertFalse(has_entitlement(self.user, "api"))
+        entitlement = Entitlement.objects.create(plan=self.pro,
+                                                 feature="api")
+        run_on_commit()
+        self.assertTrue(has_entitlement(self.user, "api"))
+        entitlement.limit = 0
+        entitlement.save()
+        run_on_commit()
+        self.assertFalse(has_entitlement(self.user, "api"))
+        self.pro.delete()
+        run_on_commit()
+        self.assertEqual(get_entitlements(self.user), {"projects": 1})
+
+    def test_vault_moved(self):
+        self.assertTrue(has_entitlement(self.user, "export"))
+        other = User.objects.create(username="other")
+        self.assertFalse(has_entitlement(other, "export"))
+        self.vault.user = other
+        self.vault.save()
+        run_on_commit()
+        self.assertFalse(has_entitlement(self.user, "export"))
+        self.assertTrue(has_entitlement(other, "export"))
+
+    def test_invalidated_while_loading(self):
+        other = User.objects.create(username="other")
+
+        def get_default_plan():
+            # Committed by another thread while the user is loaded
+            entitlement_map.invalidate_users([other.pk])
+            return self.free
+
+        plan_catalog.get_default_plan = get_default_plan
+        try:
+            self.assertEqual(get_entitlements(other), {"projects": 1})
+        finally:
+            del plan_catalog.get_default_plan
+        # Not kept, as it may have been loaded from stale rows
+        self.assertIsNone(entitlement_map.users.get(other.pk))
+        self.assertEqual(get_entitlements(other), {"projects": 1})
+        self.assertIsNotNone(entitlement_map.users.get(other.pk))
+
+    @override_settings(PLANS={"ENTITLEMENT_CACHE_TIMEOUT": 60})
+    def test_expiry(self):
+        clock = [0]
+        entitlement_map.users.clock = lambda: clock[0]
+        self.assertTrue(has_entitlement(self.user, "export"))
+        # Changed by another process
+        Subscription.objects.filter(pk=self.subscription.pk).update(
+            plan=self.free)
+        self.assertTrue(has_entitlement(self.user, "export"))
+        clock[0] = 60
+        self.assertFalse(has_entitlement(self.user, "export"))
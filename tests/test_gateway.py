@@ -1,11 +1,20 @@
 # -*- coding: utf-8 -*-
 
+import time
+
 from nose.tools import raises
 
 from django.test import TestCase
 from django.core.exceptions import ImproperlyConfigured
 
-from plans.gateway.base import Gateway
+from plans.gateway.base import (
+    Gateway,
+    GatewayError,
+    GatewayNotSent,
+    GatewayTimeout,
+)
+from plans.gateway.concurrency import ConcurrentGateway
+from plans.gateway.dummy import DummyGateway
 from plans.utils import credit_card
 
 from tests.credit_card import (
@@ -42,3 +51,80 @@ class GatewayTests(TestCase):
     @raises(credit_card.CardNotSupported)
     def test_unsupported_card(self):
         self.gateway.validate(unsupported_card)
+
+    def test_validate_many(self):
+        results = self.gateway.validate_many([visa_card, expired_visa,
+                                              unsupported_card])
+        self.assertEqual([r.card_type for r in results],
+                         [credit_card.Visa, credit_card.Visa, None])
+        self.assertEqual([r.is_valid for r in results], [True, False, False])
+        self.assertEqual(results[1].expired, True)
+        self.assertEqual(results[1].luhn_valid, True)
+
+    def test_validate_many_matches_validate(self):
+        numbers = ["4111111111111111", "4222222222222", "5555555555554444",
+                   "6771890000000000", "378282246310005", "6011111111111117",
+                   "41111111111111111", "abcd", ""]
+        cards = [credit_card.CreditCard("John Doe", n, "111", 2090, 12)
+                 for n in numbers]
+        results = self.gateway.validate_many(cards)
+        for card, result in zip(cards, results):
+            try:
+                expected = self.gateway.validate(card)
+            except credit_card.CardNotSupported:
+                self.assertEqual(result.card_type, None)
+            else:
+                self.assertEqual(result.is_valid, expected)
+
+
+class ConcurrentGatewayTests(TestCase):
+
+    """Tests for ConcurrentGateway"""
+
+    def setUp(self):
+        self.gateway = DummyGateway(latency=0.01, declined_vaults=["v2"])
+
+    def test_results_in_order(self):
+        calls = [(None, 10, {"vault_id": "v%s" % i}) for i in range(20)]
+        with ConcurrentGateway(self.gateway, concurrency=4) as gateway:
+            results = gateway.map("charge", calls)
+        self.assertEqual(len(results), 20)
+        self.assertEqual([r.ok for r in results],
+                         [i != 2 for i in range(20)])
+        self.assertTrue(isinstance(results[2].error, GatewayError))
+        self.assertEqual(len(set(r.value for r in results)), 20)
+
+    def test_serial(self):
+        gateway = ConcurrentGateway(self.gateway, concurrency=1)
+        results = gateway.map("void", [("tx1",), ("tx2",)])
+        self.assertEqual([r.ok for r in results], [True, True])
+        self.assertEqual(gateway._executor, None)
+
+    def test_timeout(self):
+        self.gateway.latency = 0.2
+        with ConcurrentGateway(self.gateway, concurrency=2,
+                               timeout=0.01) as gateway:
+            results = gateway.map("refund", [("tx1",)])
+        self.assertTrue(isinstance(results[0].error, GatewayTimeout))
+
+    def test_not_sent(self):
+        # The last calls are still waiting for a thread when they time out
+        self.gateway.latency = 0.5
+        with ConcurrentGateway(self.gateway, concurrency=2,
+                               timeout=0.05) as gateway:
+            results = gateway.map("refund", [("tx%s" % i,)
+                                             for i in range(4)])
+        self.assertEqual([type(r.error) for r in results],
+                         [GatewayTimeout, GatewayTimeout, GatewayNotSent,
+                          GatewayNotSent])
+
+    def test_serial_timeout(self):
+        self.gateway.latency = 0.5
+        start = time.time()
+        with ConcurrentGateway(self.gateway, concurrency=1,
+                               timeout=0.01) as gateway:
+            results = gateway.map("refund", [("tx1",), ("tx2",)])
+            # Not waiting for the timed out calls
+            self.assertLess(time.time() - start, 0.5)
+        self.assertEqual([type(r.error) for r in results],
+                         [GatewayTimeout, GatewayTimeout])
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from unittest import skipIf
+
+import six
+
+from django.test import TestCase
+
+from plans.gateway.base import GatewayError, GatewayTimeout
+from plans.gateway.dummy import DummyGateway
+from tests.credit_card import visa_card
+
+if six.PY3:
+    import asyncio
+    from plans.gateway.aio import SyncGatewayAdapter
+
+
+class CountingGateway(DummyGateway):
+
+    def __init__(self, *args, **kwargs):
+        super(CountingGateway, self).__init__(*args, **kwargs)
+        self.running = 0
+        self.max_running = 0
+
+    def charge(self, credit_card, amount, options=None):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            return super(CountingGateway, self).charge(credit_card, amount,
+                                                       options)
+        finally:
+            self.running -= 1
+
+
+@skipIf(six.PY2, "asyncio requires Python 3")
+class SyncGatewayAdapterTests(TestCase):
+
+    """Tests for the asyncio adapter of synchronous gateways"""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.sync_gateway = CountingGateway(latency=0.01,
+                                            declined_vaults=["v0"])
+        self.gateway = SyncGatewayAdapter(self.sync_gateway,
+                                          max_concurrency=4)
+
+    def tearDown(self):
+        self.gateway.close()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_until_complete(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_concurrent_charges(self):
+        charges = [self.gateway.charge(None, 10, {"vault_id": "v%s" % i})
+                   for i in range(1, 41)]
+        start = time.time()
+        transaction_ids = self.run_until_complete(asyncio.gather(*charges))
+        self.assertLess(time.time() - start, 40 * 0.01)
+        self.assertEqual(len(set(transaction_ids)), 40)
+        self.assertLessEqual(self.sync_gateway.max_running, 4)
+
+    def test_errors(self):
+        self.assertRaises(GatewayError, self.run_until_complete,
+                          self.gateway.charge(None, 10, {"vault_id": "v0"}))
+
+    def test_timeout(self):
+        self.gateway.timeout = 0.001
+        self.assertRaises(GatewayTimeout, self.run_until_complete,
+                          self.gateway.refund("tx"))
+
+    def test_validate(self):
+        self.assertEqual(self.gateway.validate(visa_card), True)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import sys
+
+from django.test import SimpleTestCase
+
+
+SCRIPT = """
+import sys
+
+import django
+from django.conf import settings
+
+settings.configure(
+    INSTALLED_APPS=(
+        'django.contrib.auth',
+        'django.contrib.contenttypes',
+        'django_countries',
+        'plans',
+    ),
+    PLANS={
+        'BILLING_GATEWAY':
+            'plans.gateway.braintree_payements_gateway.BraintreeGateway',
+    },
+)
+django.setup()
+
+import plans.billing
+import plans.models
+
+print(' '.join(sorted(sys.modules)))
+"""
+
+# -X importtime was added in Python 3.7
+IMPORTTIME = sys.version_info >= (3, 7)
+
+
+def import_modules():
+    """
+    Set up Django with the Braintree gateway and import the plans models in
+    a new interpreter. Returns the names of the imported modules and the
+    -X importtime report, if supported, as {module: cumulative us}.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [root] + [path for path in [env.get("PYTHONPATH")] if path])
+    args = [sys.executable]
+    if IMPORTTIME:
+        args += ["-X", "importtime"]
+    process = subprocess.Popen(args + ["-c", SCRIPT], env=env,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    if process.returncode:
+        raise AssertionError(err.decode("utf-8"))
+    times = {}
+    for line in err.decode("utf-8").splitlines():
+        # import time: self [us] | cumulative | imported package
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return set(out.decode("utf-8").split()), times
+
+
+class ImportTimeTests(SimpleTestCase):
+
+    def test_gateway_not_imported(self):
+        modules, times = import_modules()
+        self.assertIn("plans.models", modules)
+        self.assertNotIn("braintree", modules)
+        self.assertNotIn("plans.gateway.braintree_payements_gateway",
+                         modules)
+        if IMPORTTIME:
+            # Modules loaded by Django with import_module() are not timed
+            self.assertIn("plans.conf", times)
+            self.assertNotIn("braintree", times)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+
+from datetime import date
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from six import StringIO
+
+from plans.invoicing import (
+    create_invoices,
+    html_lines,
+    iter_invoices,
+    invoices_response,
+    write_invoices,
+)
+from plans.models import (
+    BillingInfo,
+    Invoice,
+    InvoiceSequence,
+    PaymentLog,
+    UserVault,
+)
+
+
+@override_settings(PLANS={
+    "TAXATION_POLICY": "plans.taxation.EUTaxationPolicy",
+    "TAX_COUNTRY": "FR",
+})
+class InvoicingTests(TestCase):
+
+    def setUp(self):
+        self.issued = date(2020, 3, 31)
+        for i, country in enumerate(["FR", "DE", "US", None]):
+            user = User.objects.create(username="user%s" % i)
+            vault = UserVault.objects.create(user=user, vault_id="v%s" % i)
+            if country:
+                BillingInfo.objects.create(
+                    user=user, name="Customer %s" % i, street="1 Main St",
+                    zipcode="1000", city="City", country=country)
+            PaymentLog.objects.create(vault=vault, transaction_id="tx%s" % i,
+                                      amount="12.00", currency="EUR")
+        PaymentLog.objects.create(vault=vault, amount="12.00",
+                                  status=PaymentLog.PENDING,
+                                  idempotency_key="pending")
+
+    def test_create_invoices(self):
+        # Per batch: select the payments, then in a savepoint select and
+        # update the counter and insert the invoices. The counter is
+        # created by the first batch.
+        with self.assertNumQueries(3 + 6 + 6 + 1):
+            self.assertEqual(create_invoices(issued=self.issued,
+                                             batch_size=3), 4)
+        invoices = list(Invoice.objects.order_by("number"))
+        self.assertEqual([invoice.number for invoice in invoices],
+                         ["2020-000001", "2020-000002", "2020-000003",
+                          "2020-000004"])
+        self.assertEqual(
+            [(i.tax_rate, i.net_amount, i.tax_amount) for i in invoices],
+            [(Decimal("20"), Decimal("10.00"), Decimal("2.00")),
+             (Decimal("19"), Decimal("10.08"), Decimal("1.92")),
+             (None, Decimal("12.00"), Decimal("0.00")),
+             (None, Decimal("12.00"), Decimal("0.00"))])
+        self.assertEqual(invoices[1].name, "Customer 1")
+        self.assertEqual(invoices[3].name, "user3")
+        self.assertEqual(InvoiceSequence.objects.get(name="2020").last_number,
+                         4)
+        # Payments are invoiced once
+        self.assertEqual(create_invoices(issued=self.issued), 0)
+
+    def test_render(self):
+        create_invoices(issued=self.issued)
+        with self.assertNumQueries(1):
+            html = "".join(html_lines(iter_invoices(Invoice.objects.all())))
+        self.assertEqual(html.count('<section class="invoice">'), 4)
+        self.assertIn("Invoice 2020-000002", html)
+        self.assertIn("Tax (19%)", html)
+        response = invoices_response(Invoice.objects.all(),
+                                     filename="invoices.html")
+        self.assertEqual(b"".join(response.streaming_content),
+                         html.encode("utf-8"))
+
+    def test_write_invoices(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        out = StringIO()
+        call_command("plans_invoices", "--date=2020-03-31",
+                     "--output-dir=%s" % directory, stdout=out)
+        self.assertEqual(out.getvalue().splitlines(),
+                         ["4 invoices created.", "4 invoices written."])
+        self.assertEqual(sorted(os.listdir(directory)),
+                         ["2020-00000%s.html" % i for i in range(1, 5)])
+        self.assertRaises(ValueError, write_invoices, Invoice.objects.all(),
+                          directory, "txt")
+
+    def test_full_tax_rate(self):
+        field = Invoice._meta.get_field("tax_rate")
+        self.assertEqual(field.clean(Decimal("100.00"), None),
+                         Decimal("100.00"))
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+from datetime import date
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError
+from django.test import TestCase, override_settings
+
+from plans import metering
+from plans.billing import BillingRun
+from plans.metering import (
+    UsageBuffer,
+    record_usage,
+    usage_charges,
+    usage_period,
+    write_usage,
+)
+from plans.models import (
+    PaymentLog,
+    Plan,
+    Subscription,
+    UsageRate,
+    UsageRecord,
+    UserVault,
+)
+from tests.test_billing import BillingTestGateway
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def create_subscription(name, plan, next_billing_date):
+    user = User.objects.create(username=name)
+    vault = UserVault.objects.create(user=user, vault_id=name)
+    return Subscription.objects.create(
+        subscription_id=name, user_vault=vault, plan=plan,
+        status=Subscription.ACTIVE, start_date=date(2020, 1, 15),
+        next_billing_date=next_billing_date)
+
+
+class UsageTests(TestCase):
+
+    def setUp(self):
+        self.plan = Plan.objects.create(name="Metered", plan_id="metered",
+                                        price="10.00")
+        self.subscription = create_subscription("s1", self.plan,
+                                                date(2020, 4, 15))
+        self.clock = Clock()
+        self.buffer = UsageBuffer(self.clock)
+
+    def quantities(self):
+        return dict(((subscription_id, metric, period_start), quantity)
+                    for subscription_id, metric, period_start, quantity
+                    in UsageRecord.objects.values_list(
+                        'subscription__subscription_id', 'metric',
+                        'period_start', 'quantity'))
+
+    def test_usage_period(self):
+        self.assertEqual(usage_period(date(2020, 1, 15), date(2020, 4, 15)),
+                         date(2020, 3, 15))
+        self.assertEqual(usage_period(date(2020, 1, 15), None),
+                         date(2020, 1, 15))
+
+    def test_buffered(self):
+        with self.assertNumQueries(0):
+            for i in range(100):
+                self.buffer.add(self.subscription, "api_calls")
+            self.buffer.add(self.subscription, "storage", 5)
+        self.assertEqual(len(self.buffer), 2)
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.quantities(), {
+            ("s1", "api_calls", date(2020, 3, 15)): 100,
+            ("s1", "storage", date(2020, 3, 15)): 5,
+        })
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_upsert(self):
+        other = create_subscription("s2", self.plan, date(2020, 4, 15))
+        self.buffer.add(self.subscription, "api_calls", 3)
+        self.buffer.flush()
+        self.buffer.add(self.subscription, "api_calls", 4)
+        self.buffer.add(self.subscription, "storage", 1)
+        self.buffer.add(other, "api_calls", 2)
+        # Select the existing records, update them and insert the others,
+        # in a savepoint
+        with self.assertNumQueries(1 + 1 + 1 + 2):
+            self.buffer.flush()
+        self.assertEqual(self.quantities(), {
+            ("s1", "api_calls", date(2020, 3, 15)): 7,
+            ("s1", "storage", date(2020, 3, 15)): 1,
+            ("s2", "api_calls", date(2020, 3, 15)): 2,
+        })
+
+    def test_periods(self):
+        self.buffer.add(self.subscription, "api_calls", 3)
+        self.subscription.next_billing_date = date(2020, 5, 15)
+        self.buffer.add(self.subscription, "api_calls", 4)
+        self.buffer.flush()
+        self.assertEqual(self.quantities(), {
+            ("s1", "api_calls", date(2020, 3, 15)): 3,
+            ("s1", "api_calls", date(2020, 4, 15)): 4,
+        })
+
+    @override_settings(PLANS={"USAGE_FLUSH_INTERVAL": 10})
+    def test_flush_interval(self):
+        self.buffer.add(self.subscription, "api_calls")
+        self.clock.now = 9
+        self.buffer.add(self.subscription, "api_calls")
+        self.assertFalse(UsageRecord.objects.exists())
+        self.clock.now = 10
+        self.buffer.add(self.subscription, "api_calls")
+        self.assertEqual(UsageRecord.objects.get().quantity, 3)
+        self.assertEqual(len(self.buffer), 0)
+
+    @override_settings(PLANS={"USAGE_BUFFER_SIZE": 2})
+    def test_buffer_size(self):
+        self.buffer.add(self.subscription, "api_calls")
+        self.buffer.add(self.subscription, "api_calls")
+        self.assertFalse(UsageRecord.objects.exists())
+        self.buffer.add(self.subscription, "storage")
+        self.assertEqual(UsageRecord.objects.count(), 2)
+
+    def test_failed_flush(self):
+        other = create_subscription("s2", self.plan, date(2020, 4, 15))
+        self.buffer.add(self.subscription, "api_calls", 3)
+        self.buffer.add(other, None)
+        # The counts are kept for the next flush
+        with self.assertRaises(IntegrityError):
+            self.buffer.flush()
+        self.assertEqual(len(self.buffer), 2)
+
+    def test_failed_chunk(self):
+        other = create_subscription("s2", self.plan, date(2020, 4, 15))
+        self.buffer = UsageBuffer(self.clock, chunk_size=2)
+        self.buffer.add(self.subscription, "api_calls", 3)
+        self.buffer.add(self.subscription, "storage", 1)
+        self.buffer.add(other, None)
+        with self.assertRaises(IntegrityError):
+            self.buffer.flush()
+        # Only the counts of the failed chunk are kept, the first one was
+        # written
+        self.assertEqual(len(self.buffer), 1)
+        self.assertEqual(self.quantities(), {
+            ("s1", "api_calls", date(2020, 3, 15)): 3,
+            ("s1", "storage", date(2020, 3, 15)): 1,
+        })
+        UsageRecord.objects.all().delete()
+        counts = {
+            (self.subscription.pk, "api_calls", date(2020, 3, 15)): 3,
+            (other.pk, None, date(2020, 3, 15)): 1,
+        }
+        with self.assertRaises(IntegrityError):
+            write_usage(counts, chunk_size=1)
+        self.assertEqual(list(counts), [(other.pk, None, date(2020, 3, 15))])
+
+    @override_settings(PLANS={"USAGE_FLUSH_INTERVAL": 0.05})
+    def test_idle_flush(self):
+        written = {}
+
+        def write_usage(counts, chunk_size):
+            written.update(counts)
+            counts.clear()
+
+        buffer = UsageBuffer()
+        original, metering.write_usage = metering.write_usage, write_usage
+        try:
+            buffer.add(self.subscription, "api_calls", 2)
+            timer = buffer._timer
+            # Flushed by the timer, which stops once the buffer is empty
+            timer.join(5)
+        finally:
+            metering.write_usage = original
+        self.assertFalse(timer.is_alive())
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(written, {
+            (self.subscription.pk, "api_calls", date(2020, 3, 15)): 2})
+
+    def test_threads(self):
+        def record():
+            for i in range(1000):
+                self.buffer.add(self.subscription, "api_calls")
+
+        threads = [threading.Thread(target=record) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.buffer.flush()
+        self.assertEqual(UsageRecord.objects.get().quantity, 4000)
+
+    def test_usage_charges(self):
+        other = create_subscription("s2", self.plan, date(2020, 5, 1))
+        UsageRate.objects.create(plan=self.plan, metric="api_calls",
+                                 unit_price="0.0015")
+        write_usage({
+            (self.subscription.pk, "api_calls", date(2020, 3, 15)): 1001,
+            # Not priced
+            (self.subscription.pk, "storage", date(2020, 3, 15)): 10,
+            # Previous period
+            (self.subscription.pk, "api_calls", date(2020, 2, 15)): 10,
+            (other.pk, "api_calls", date(2020, 4, 1)): 10,
+        })
+        with self.assertNumQueries(2):
+            self.assertEqual(usage_charges([self.subscription, other]), {
+                self.subscription.pk: Decimal("1.50"),
+                other.pk: Decimal("0.02"),
+            })
+        UsageRecord.objects.all().delete()
+        with self.assertNumQueries(1):
+            self.assertEqual(usage_charges([self.subscription, other]), {})
+
+    def test_billing_run(self):
+        UsageRate.objects.create(plan=self.plan, metric="api_calls",
+                                 unit_price="0.01")
+        self.buffer.add(self.subscription, "api_calls", 250)
+        self.buffer.flush()
+        gateway = BillingTestGateway()
+        BillingRun(date(2020, 4, 15), gateway).run()
+        self.assertEqual(gateway.charges, [("s1", Decimal("12.50"))])
+        self.assertEqual(PaymentLog.objects.get().amount, Decimal("12.50"))
+        # Usage now goes to the next period
+        subscription = Subscription.objects.get()
+        self.assertEqual(usage_period(subscription.start_date,
+                                      subscription.next_billing_date),
+                         date(2020, 4, 15))
+
+    def test_billing_run_flushes(self):
+        UsageRate.objects.create(plan=self.plan, metric="api_calls",
+                                 unit_price="0.01")
+        record_usage(self.subscription, "api_calls", 100)
+        gateway = BillingTestGateway()
+        BillingRun(date(2020, 4, 15), gateway).run()
+        self.assertEqual(gateway.charges, [("s1", Decimal("11.00"))])
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, override_settings
+
+from plans import catalog
+from plans.cache import subscription_cache_stats
+from plans.catalog import plan_catalog
+from plans.models import Plan, Subscription, UserVault
+from tests.utils import run_on_commit
+
+
+class UserVaultSubscriptionTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create(username="john")
+        self.vault = UserVault.objects.create(user=user, vault_id="v1")
+        self.plan = Plan.objects.create(name="Basic", plan_id="basic",
+                                        price="10.00")
+        self.subscription = Subscription.objects.create(
+            subscription_id="s1", user_vault=self.vault, plan=self.plan,
+            status=Subscription.ACTIVE)
+        subscription_cache_stats.reset()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_subscription_cached_on_instance(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.vault.subscription, self.subscription)
+            self.assertEqual(self.vault.subscription, self.subscription)
+        self.assertEqual(subscription_cache_stats.as_dict(),
+                         {"local_hits": 1, "shared_hits": 0, "misses": 1})
+
+    def test_invalidated_on_save(self):
+        subscription = self.vault.subscription
+        subscription.status = Subscription.CANCELED
+        subscription.save()
+        self.assertEqual(self.vault.subscription, None)
+
+    @override_settings(PLANS={"CACHE_ALIAS": "default"})
+    def test_shared_cache(self):
+        vault = UserVault.objects.get(pk=self.vault.pk)
+        self.assertEqual(vault.subscription, self.subscription)
+        vault = UserVault.objects.get(pk=self.vault.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(vault.subscription, self.subscription)
+        self.assertEqual(subscription_cache_stats.shared_hits, 1)
+        # Deleting the subscription from another instance invalidates it
+        Subscription.objects.get(pk=self.subscription.pk).delete()
+        vault = UserVault.objects.get(pk=self.vault.pk)
+        self.assertEqual(vault.subscription, None)
+        self.assertEqual(subscription_cache_stats.misses, 2)
+
+
+class PlanCatalogTests(TestCase):
+
+    def setUp(self):
+        plan_catalog.invalidate()
+        plan_catalog.stats.reset()
+        self.basic = Plan.objects.create(name="Basic", plan_id="basic",
+                                         price="10.00", active=True,
+                                         default=True)
+        self.pro = Plan.objects.create(name="Pro", plan_id="pro",
+                                       price="20.00", default=True)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_lookups(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(Plan.get_default_plan(), self.pro)
+            self.assertEqual(plan_catalog.get("basic"), self.basic)
+            self.assertEqual(plan_catalog.get_by_name("Pro"), self.pro)
+            self.assertEqual(plan_catalog.get("unknown"), None)
+            self.assertEqual(plan_catalog.active_plans, [self.basic])
+        self.assertEqual(plan_catalog.stats.misses, 1)
+
+    def test_default_plan_setting(self):
+        with override_settings(PLANS={"DEFAULT_PLAN": "Basic"}):
+            self.assertEqual(Plan.get_default_plan(), self.basic)
+        with override_settings(PLANS={"DEFAULT_PLAN": "Unknown"}):
+            self.assertRaises(Plan.DoesNotExist, Plan.get_default_plan)
+
+    def test_invalidated_on_save(self):
+        self.assertEqual(Plan.get_default_plan(), self.pro)
+        self.pro.delete()
+        # Once committed
+        self.assertEqual(Plan.get_default_plan().name, "Pro")
+        run_on_commit()
+        self.assertEqual(Plan.get_default_plan(), self.basic)
+        self.assertEqual(plan_catalog.stats.misses, 2)
+
+    def test_rolled_back(self):
+        self.assertEqual(Plan.get_default_plan(), self.pro)
+        try:
+            with transaction.atomic():
+                Plan.objects.create(name="Gold", plan_id="gold",
+                                    price="30.00", default=True)
+                raise ValueError
+        except ValueError:
+            pass
+        run_on_commit()
+        self.assertEqual(plan_catalog.stats.misses, 1)
+
+    def test_invalidated_while_loading(self):
+        loaded = catalog._Catalog
+
+        def invalidated(plans, version):
+            # A plan change committed by another thread during the load
+            plan_catalog.invalidate()
+            return loaded(plans, version)
+
+        catalog._Catalog = invalidated
+        try:
+            self.assertEqual(Plan.get_default_plan(), self.pro)
+        finally:
+            catalog._Catalog = loaded
+        # The loaded catalog was not kept
+        self.assertEqual(Plan.get_default_plan(), self.pro)
+        self.assertEqual(plan_catalog.stats.misses, 2)
+
+    @override_settings(PLANS={"CACHE_ALIAS": "default"})
+    def test_shared_version(self):
+        self.assertEqual(Plan.get_default_plan(), self.pro)
+        # Another process saves a plan
+        cache.set(plan_catalog.version_key, 42)
+        self.assertEqual(Plan.get_default_plan(), self.pro)
+        self.assertEqual(plan_catalog.stats.misses, 2)
+        with self.assertNumQueries(0):
+            Plan.get_default_plan()
+
+
+class SubscriptionQuerySetTests(TestCase):
+
+    def setUp(self):
+        self.today = date.today()
+        plan = Plan.objects.create(name="Basic", plan_id="basic",
+                                   price="10.00")
+        rows = [
+            ("s1", Subscription.ACTIVE, 3),
+            ("s2", Subscription.ACTIVE, -2),
+            ("s3", Subscription.PAST_DUE, 0),
+            ("s4", Subscription.EXPIRED, 40),
+            ("s5", Subscription.CANCELED, 10),
+            ("s6", Subscription.PENDING, None),
+        ]
+        for i, (name, status, days) in enumerate(rows):
+            user = User.objects.create(username="user%s" % i)
+            vault = UserVault.objects.create(user=user, vault_id="v%s" % i)
+            Subscription.objects.create(
+                subscription_id=name, user_vault=vault, plan=plan,
+                status=status, next_billing_date=(
+                    None if days is None
+                    else self.today + timedelta(days=days)))
+
+    def names(self, queryset):
+        return sorted(queryset.values_list('subscription_id', flat=True))
+
+    def test_with_days_left(self):
+        with self.assertNumQueries(1):
+            subscriptions = list(Subscription.objects.with_days_left()
+                                 .order_by('remaining_days', 'pk'))
+            days = [(s.subscription_id, s.days_left()) for s in subscriptions]
+        self.assertEqual(sorted(days, key=lambda row: row[0]), sorted(
+            (s.subscription_id, s.days_left())
+            for s in Subscription.objects.all()))
+        self.assertEqual(days[-4:], [("s3", 0), ("s1", 3), ("s5", 10),
+                                     ("s4", 40)])
+        self.assertEqual(self.names(Subscription.objects.with_days_left()
+                                    .filter(remaining_days__gt=5)),
+                         ["s4", "s5"])
+
+    def test_filters(self):
+        self.assertEqual(self.names(Subscription.objects.running()),
+                         ["s1", "s2", "s3", "s6"])
+        self.assertEqual(self.names(Subscription.objects.expired()),
+                         ["s2", "s4"])
+        self.assertEqual(
+            self.names(Subscription.objects.expired()),
+            sorted(s.subscription_id for s in Subscription.objects.all()
+                   if s.is_expired()))
+        self.assertEqual(self.names(Subscription.objects.due_within(3)),
+                         ["s1", "s3"])
+        self.assertEqual(self.names(Subscription.objects.due_within(0)),
+                         ["s3"])
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from six import StringIO
+
+from plans.gateway.base import GatewayError
+from plans.gateway.dummy import DummyGateway
+from plans.models import PaymentLog, Plan, Subscription, UserVault
+from plans.proration import (
+    DuplicatePlanChange,
+    Proration,
+    billing_period,
+    change_plan,
+    prorate,
+    reprice,
+    subscribe,
+)
+
+
+class ProrateTests(TestCase):
+
+    def test_billing_period(self):
+        self.assertEqual(billing_period(date(2020, 1, 1), date(2020, 4, 10)),
+                         (date(2020, 3, 10), date(2020, 4, 10)))
+        # First period
+        self.assertEqual(billing_period(date(2020, 3, 20), date(2020, 4, 10)),
+                         (date(2020, 3, 20), date(2020, 4, 10)))
+
+    def test_prorate(self):
+        period = (date(2020, 3, 1), date(2020, 4, 1))
+        # 10 days left out of 31
+        self.assertEqual(
+            prorate(Decimal("9.90"), Decimal("19.90"), period,
+                    date(2020, 3, 22)),
+            Proration(Decimal("3.19"), Decimal("6.42"), Decimal("3.23")))
+        self.assertEqual(
+            prorate(Decimal("19.90"), Decimal("9.90"), period,
+                    date(2020, 3, 1)),
+            Proration(Decimal("19.90"), Decimal("9.90"), Decimal("-10.00")))
+        self.assertEqual(prorate("10", "20", period, date(2020, 4, 1)),
+                         Proration(0, 0, 0))
+        self.assertEqual(prorate("10", "20", period, date(2020, 2, 1)),
+                         Proration(Decimal("10.00"), Decimal("20.00"),
+                                   Decimal("10.00")))
+
+    def test_exact(self):
+        # 1/3 of 0.10 is rounded once
+        period = (date(2020, 1, 1), date(2020, 1, 4))
+        self.assertEqual(prorate("0.10", "0.20", period, date(2020, 1, 3)),
+                         Proration(Decimal("0.03"), Decimal("0.07"),
+                                   Decimal("0.04")))
+
+
+class PlanChangeTests(TestCase):
+
+    def setUp(self):
+        self.basic = Plan.objects.create(name="Basic", plan_id="basic",
+                                         price="10.00", active=True)
+        self.pro = Plan.objects.create(name="Pro", plan_id="pro",
+                                       price="40.00", active=True)
+        user = User.objects.create(username="user")
+        self.vault = UserVault.objects.create(user=user, vault_id="v1")
+        self.gateway = DummyGateway()
+
+    def subscription(self):
+        return Subscription.objects.create(
+            subscription_id="s1", user_vault=self.vault, plan=self.basic,
+            status=Subscription.ACTIVE, start_date=date(2020, 1, 1),
+            next_billing_date=date(2020, 4, 1))
+
+    def test_subscribe(self):
+        subscription = subscribe(self.vault, self.basic, date(2020, 3, 1),
+                                 self.gateway)
+        subscription = Subscription.objects.get(pk=subscription.pk)
+        self.assertEqual(subscription.status, Subscription.ACTIVE)
+        self.assertEqual(subscription.next_billing_date, date(2020, 4, 1))
+        log = PaymentLog.objects.get()
+        self.assertEqual(log.status, PaymentLog.SUCCEEDED)
+        self.assertEqual(log.amount, Decimal("10.00"))
+        self.assertTrue(log.transaction_id)
+        self.assertEqual(log.idempotency_key, "%s:2020-03-01" %
+                         subscription.subscription_id)
+
+    def test_subscribe_declined(self):
+        gateway = DummyGateway(declined_vaults=["v1"])
+        self.assertRaises(GatewayError, subscribe, self.vault, self.basic,
+                          date(2020, 3, 1), gateway)
+        self.assertEqual(Subscription.objects.get().status,
+                         Subscription.CANCELED)
+        self.assertFalse(PaymentLog.objects.exists())
+
+    def test_upgrade(self):
+        subscription = self.subscription()
+        proration = change_plan(subscription, self.pro, date(2020, 3, 17),
+                                self.gateway)
+        # 15 days left out of 31
+        self.assertEqual(proration, Proration(
+            Decimal("4.84"), Decimal("19.35"), Decimal("14.51")))
+        self.assertEqual(Subscription.objects.get().plan, self.pro)
+        log = PaymentLog.objects.get()
+        self.assertEqual((log.status, log.amount),
+                         (PaymentLog.SUCCEEDED, Decimal("14.51")))
+        self.assertEqual(log.idempotency_key, "s1:plan:%s:%s:2020-03-17" % (
+            self.basic.pk, self.pro.pk))
+
+    def test_upgrade_declined(self):
+        subscription = self.subscription()
+        self.assertRaises(GatewayError, change_plan, subscription, self.pro,
+                          date(2020, 3, 17),
+                          DummyGateway(declined_vaults=["v1"]))
+        self.assertEqual(Subscription.objects.get().plan, self.basic)
+        self.assertFalse(PaymentLog.objects.exists())
+
+    def test_downgrade(self):
+        subscription = self.subscription()
+        subscription.plan = self.pro
+        subscription.save()
+        proration = change_plan(subscription, self.basic, date(2020, 3, 17),
+                                self.gateway)
+        self.assertEqual(proration.amount, Decimal("-14.51"))
+        log = PaymentLog.objects.get()
+        self.assertEqual((log.status, log.amount, log.transaction_id),
+                         (PaymentLog.ADJUSTMENT, Decimal("-14.51"), ""))
+
+    def test_change_back_and_forth(self):
+        subscription = self.subscription()
+        change_plan(subscription, self.pro, date(2020, 3, 17), self.gateway)
+        change_plan(subscription, self.basic, date(2020, 3, 17),
+                    self.gateway)
+        # The upgrade was already charged today: it is not switched again
+        # without payment
+        self.assertRaises(DuplicatePlanChange, change_plan, subscription,
+                          self.pro, date(2020, 3, 17), self.gateway)
+        self.assertEqual(Subscription.objects.get().plan, self.basic)
+        self.assertEqual(sorted(PaymentLog.objects.values_list(
+            'status', 'amount')), [
+            (PaymentLog.ADJUSTMENT, Decimal("-14.51")),
+            (PaymentLog.SUCCEEDED, Decimal("14.51")),
+        ])
+        # Another day, it is charged again
+        change_plan(subscription, self.pro, date(2020, 3, 18), self.gateway)
+        self.assertEqual(Subscription.objects.get().plan, self.pro)
+        self.assertEqual(PaymentLog.objects.filter(
+            status=PaymentLog.SUCCEEDED).count(), 2)
+
+    def test_downgrade_back_and_forth(self):
+        subscription = self.subscription()
+        subscription.plan = self.pro
+        subscription.save()
+        change_plan(subscription, self.basic, date(2020, 3, 17),
+                    self.gateway)
+        change_plan(subscription, self.pro, date(2020, 3, 17), self.gateway)
+        # The credit of the downgrade was already recorded today
+        self.assertRaises(DuplicatePlanChange, change_plan, subscription,
+                          self.basic, date(2020, 3, 17), self.gateway)
+        self.assertEqual(Subscription.objects.get().plan, self.pro)
+        self.assertEqual(sorted(PaymentLog.objects.values_list(
+            'status', 'amount')), [
+            (PaymentLog.ADJUSTMENT, Decimal("-14.51")),
+            (PaymentLog.SUCCEEDED, Decimal("14.51")),
+        ])
+
+    @override_settings(PLANS={
+        "BILLING_GATEWAY": "plans.gateway.dummy.DummyGateway",
+    })
+    def test_vault_subscribe(self):
+        subscription = self.vault.subscribe("basic")
+        self.assertEqual(subscription.plan, self.basic)
+        vault = UserVault.objects.get(pk=self.vault.pk)
+        self.assertEqual(vault.subscribe(self.pro).pk, subscription.pk)
+        self.assertEqual(Subscription.objects.get().plan, self.pro)
+        self.assertRaises(Plan.DoesNotExist, vault.subscribe, "unknown")
+
+
+class RepricingTests(TestCase):
+
+    def setUp(self):
+        self.old = Plan.objects.create(name="Old", plan_id="old",
+                                       price="10.00")
+        self.new = Plan.objects.create(name="New", plan_id="new",
+                                       price="12.00")
+        for i in range(7):
+            user = User.objects.create(username="user%s" % i)
+            vault = UserVault.objects.create(user=user, vault_id="v%s" % i)
+            Subscription.objects.create(
+                subscription_id="s%s" % i, user_vault=vault, plan=self.old,
+                status=(Subscription.CANCELED if i == 6
+                        else Subscription.ACTIVE),
+                start_date=date(2020, 1, 1),
+                # Periods of 29 and 31 days
+                next_billing_date=date(2020, 3 + i % 2, 1))
+
+    def test_reprice(self):
+        repricing = reprice(self.old, self.new, date(2020, 2, 20),
+                            chunk_size=4)
+        self.assertEqual(repricing.moved, 6)
+        self.assertEqual(repricing.adjustments, 6)
+        self.assertEqual(
+            sorted(Subscription.objects.values_list('subscription_id',
+                                                    'plan__plan_id')),
+            [("s0", "new"), ("s1", "new"), ("s2", "new"), ("s3", "new"),
+             ("s4", "new"), ("s5", "new"), ("s6", "old")])
+        # 10 days left out of 29, and the prepaid March periods
+        self.assertEqual(sorted(PaymentLog.objects.values_list(
+            'vault__vault_id', 'status', 'amount')), [
+            ("v%s" % i, PaymentLog.ADJUSTMENT,
+             Decimal("2.00") if i % 2 else Decimal("0.69"))
+            for i in range(6)])
+        self.assertEqual(repricing.total, Decimal("8.07"))
+
+    def test_rerun(self):
+        reprice(self.old, self.new, date(2020, 2, 20))
+        Subscription.objects.update(plan=self.old)
+        self.assertEqual(reprice(self.old, self.new,
+                                 date(2020, 2, 20)).adjustments, 0)
+        self.assertEqual(PaymentLog.objects.count(), 6)
+
+    def test_queries(self):
+        # Lock and read the chunk, update it, look up and insert the
+        # adjustments, then read the empty next chunk; with savepoints
+        with self.assertNumQueries(11):
+            reprice(self.old, self.new, date(2020, 2, 20))
+
+    def test_command(self):
+        out = StringIO()
+        call_command("plans_reprice", "old", "new", "--date", "2020-02-20",
+                     "--no-prorate", stdout=out)
+        self.assertEqual(out.getvalue().strip(),
+                         "6 subscriptions moved, 0 adjustments, total 0.00")
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from six import StringIO
+
+from plans.models import PaymentLog, UserVault
+from plans.reporting import (
+    export_lines,
+    export_response,
+    payment_logs,
+    revenue_totals,
+)
+
+
+class ReportingTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create(username="john")
+        vault = UserVault.objects.create(user=user, vault_id="v1")
+        payments = [
+            (datetime(2020, 1, 5), "10.00", "EUR"),
+            (datetime(2020, 1, 20), "5.50", "EUR"),
+            (datetime(2020, 1, 21), "7.00", "USD"),
+            (datetime(2020, 2, 1), "10.00", "EUR"),
+        ]
+        for i, (created, amount, currency) in enumerate(payments):
+            log = PaymentLog.objects.create(vault=vault,
+                                            transaction_id="tx%s" % i,
+                                            amount=amount, currency=currency)
+            # created is set on insert by auto_now_add
+            PaymentLog.objects.filter(pk=log.pk).update(created=created)
+
+    def test_csv_export(self):
+        lines = list(export_lines(PaymentLog.objects.all(), chunk_size=2))
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(
+            lines[0], "id,created,vault__vault_id,transaction_id,amount,"
+                      "currency\r\n")
+        self.assertTrue(lines[1].endswith(",v1,tx0,10.00,EUR\r\n"))
+
+    def test_jsonl_export(self):
+        lines = list(export_lines(payment_logs(start=datetime(2020, 2, 1)),
+                                  format="jsonl"))
+        self.assertEqual(len(lines), 1)
+        row = json.loads(lines[0])
+        self.assertEqual((row["transaction_id"], row["amount"]),
+                         ("tx3", "10.00"))
+
+    def test_export_response(self):
+        response = export_response(PaymentLog.objects.all(),
+                                   filename="payments.csv")
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertEqual(len(b"".join(response.streaming_content)
+                             .splitlines()), 5)
+
+    def test_revenue_totals(self):
+        with self.assertNumQueries(1):
+            totals = list(revenue_totals(period="month"))
+        self.assertEqual(
+            [(t["period"], t["currency"], t["total"], t["count"])
+             for t in totals],
+            [(date(2020, 1, 1), "EUR", Decimal("15.50"), 2),
+             (date(2020, 1, 1), "USD", Decimal("7.00"), 1),
+             (date(2020, 2, 1), "EUR", Decimal("10.00"), 1)])
+
+    def test_command_totals(self):
+        out = StringIO()
+        call_command("plans_export_payments", "--totals=year", stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), [
+            "period,currency,total,count",
+            "2020-01-01,EUR,25.50,3",
+            "2020-01-01,USD,7.00,1",
+        ])
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+from django.test import SimpleTestCase
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SUBSCRIPTIONS = 40
+
+
+class ShardedBillingTests(SimpleTestCase):
+    """
+    Billing by two worker processes sharing a SQLite database file, see
+    tests/sharded_billing.py.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database = os.path.join(self.directory, "billing.sqlite3")
+        self.env = dict(os.environ)
+        self.env["PYTHONPATH"] = os.pathsep.join(
+            [ROOT] + [path for path in [os.environ.get("PYTHONPATH")]
+                      if path])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def start(self, command, argument):
+        return subprocess.Popen(
+            [sys.executable, "-m", "tests.sharded_billing", self.database,
+             command, str(argument)],
+            cwd=ROOT, env=self.env, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+
+    def wait(self, process):
+        stdout, stderr = process.communicate()
+        self.assertEqual(process.returncode, 0, stderr)
+        return stdout
+
+    def test_two_workers(self):
+        self.wait(self.start("seed", SUBSCRIPTIONS))
+        workers = [self.start("work", worker_id)
+                   for worker_id in ["w1", "w2"]]
+        charged = [int(self.wait(worker)) for worker in workers]
+        self.assertEqual(sum(charged), SUBSCRIPTIONS)
+
+        database = sqlite3.connect(self.database)
+        try:
+            rows = database.execute(
+                "SELECT s.subscription_id, COUNT(l.id) "
+                "FROM plans_subscription s LEFT JOIN plans_paymentlog l "
+                "ON l.vault_id = s.user_vault_id AND l.status = 'succeeded' "
+                "GROUP BY s.subscription_id").fetchall()
+            due = database.execute(
+                "SELECT COUNT(*) FROM plans_subscription "
+                "WHERE next_billing_date <= '2020-03-10'").fetchone()[0]
+        finally:
+            database.close()
+        self.assertEqual(len(rows), SUBSCRIPTIONS)
+        self.assertEqual(set(count for _, count in rows), set([1]))
+        self.assertEqual(due, 0)
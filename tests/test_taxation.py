@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from plans.cache import TTLCache
+from plans.models import BillingInfo
+from plans.taxation import (
+    EUTaxationPolicy,
+    Tax,
+    TaxationPolicy,
+    get_tax_policy,
+)
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class CountingPolicy(EUTaxationPolicy):
+
+    def __init__(self, *args, **kwargs):
+        super(CountingPolicy, self).__init__(*args, **kwargs)
+        self.checks = 0
+
+    def check_tax_number(self, number, country_code):
+        self.checks += 1
+        return super(CountingPolicy, self).check_tax_number(number,
+                                                            country_code)
+
+
+class TaxationPolicyTests(TestCase):
+
+    def test_default_rate(self):
+        policy = TaxationPolicy(default_rate="10")
+        self.assertEqual(policy.get_tax_rate("", "US"), Decimal("10"))
+        self.assertEqual(TaxationPolicy().get_tax_rate("", "US"), None)
+
+    def test_eu_rates(self):
+        policy = EUTaxationPolicy(issuer_country="FR")
+        # Issuer country, even for businesses
+        self.assertEqual(policy.get_tax_rate("FR40303265045", "FR"),
+                         Decimal("20"))
+        # Reverse charge for other EU businesses
+        self.assertEqual(policy.get_tax_rate("DE 123.456.789", "DE"), None)
+        self.assertEqual(policy.get_tax_rate("EL123456789", "GR"), None)
+        # Consumers, or invalid VAT numbers
+        self.assertEqual(policy.get_tax_rate("", "DE"), Decimal("19"))
+        self.assertEqual(policy.get_tax_rate("DE1234", "de"), Decimal("19"))
+        # Outside the EU
+        self.assertEqual(policy.get_tax_rate("", "US"), None)
+
+    def test_validation_cache(self):
+        policy = CountingPolicy(vat_cache_timeout=60)
+        policy.vat_cache.clock = clock = Clock()
+        for _ in range(3):
+            self.assertTrue(policy.is_valid_tax_number("DE123456789", "DE"))
+            self.assertFalse(policy.is_valid_tax_number("DE1234", "DE"))
+        self.assertEqual(policy.checks, 2)
+        clock.now = 61
+        policy.is_valid_tax_number("123456789", "DE")
+        self.assertEqual(policy.checks, 3)
+
+    def test_no_validation_cache(self):
+        policy = CountingPolicy()
+        policy.is_valid_tax_number("DE123456789", "DE")
+        policy.is_valid_tax_number("DE123456789", "DE")
+        self.assertEqual(policy.checks, 2)
+
+    def test_compute_taxes(self):
+        user = User.objects.create(username="john")
+        billing_info = BillingInfo.objects.create(
+            user=user, name="John", street="1 rue", zipcode="75001",
+            city="Paris", country="DE")
+        policy = CountingPolicy(issuer_country="FR")
+        business = BillingInfo(tax_number="DE123456789", country="DE")
+        taxes = policy.compute_taxes([
+            (billing_info, Decimal("10.00")),
+            (business, Decimal("10.00")),
+            (business, "20.00"),
+            (BillingInfo(country="FR"), Decimal("9.99")),
+        ])
+        self.assertEqual(taxes, [
+            Tax(Decimal("19"), Decimal("1.90")),
+            Tax(None, Decimal("0.00")),
+            Tax(None, Decimal("0.00")),
+            Tax(Decimal("20"), Decimal("2.00")),
+        ])
+        self.assertEqual(policy.checks, 1)
+
+    def test_settings(self):
+        policy = get_tax_policy()
+        self.assertIs(get_tax_policy(), policy)
+        self.assertIs(type(policy), TaxationPolicy)
+        with override_settings(PLANS={
+                "TAXATION_POLICY": "plans.taxation.EUTaxationPolicy",
+                "TAX_COUNTRY": "FR", "TAX_PERCENT": "20"}):
+            policy = get_tax_policy()
+            self.assertIsInstance(policy, EUTaxationPolicy)
+            self.assertEqual(policy.issuer_country, "FR")
+            self.assertEqual(policy.default_rate, Decimal("20"))
+        self.assertIs(type(get_tax_policy()), TaxationPolicy)
+
+
+class TTLCacheTests(TestCase):
+
+    def test_expiry(self):
+        cache = TTLCache(10, clock=Clock())
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        cache.clock.now = 10
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(cache.stats.as_dict(),
+                         {"local_hits": 1, "shared_hits": 0, "misses": 1})
+
+    def test_eviction(self):
+        cache = TTLCache(10, maxsize=2, clock=Clock())
+        cache.set("a", 1)
+        cache.clock.now = 1
+        cache.set("b", 2)
+        cache.set("c", 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(cache.get("c"), 3)
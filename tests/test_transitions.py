@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db.models import Q
+from django.test import TestCase
+from six import StringIO
+
+from plans.entitlements import entitlement_map
+from plans.models import NotSubscribedError, Plan, Subscription, UserVault
+from plans.signals import subscriptions_transitioned
+from plans.transitions import (
+    ACTIVE,
+    CANCELED,
+    EXPIRED,
+    PAST_DUE,
+    PENDING,
+    InvalidTransition,
+    apply_transitions,
+    can_transition,
+    sweep,
+    transition,
+)
+
+from .utils import run_on_commit
+
+
+class TransitionTests(TestCase):
+
+    def setUp(self):
+        self.today = date(2020, 3, 10)
+        plan = Plan.objects.create(name="Basic", plan_id="basic",
+                                   price="9.90")
+        rows = [
+            (PENDING, 0),
+            (ACTIVE, 5),       # not due
+            (ACTIVE, -1),      # overdue: past due
+            (PAST_DUE, -3),    # in grace period
+            (PAST_DUE, -20),   # expires
+            (PAST_DUE, -30),   # expires
+            (EXPIRED, -40),
+            (CANCELED, -40),
+        ]
+        for i, (status, days) in enumerate(rows):
+            user = User.objects.create(username="user%s" % i)
+            vault = UserVault.objects.create(user=user, vault_id="v%s" % i)
+            Subscription.objects.create(
+                subscription_id="s%s" % i, user_vault=vault, plan=plan,
+                status=status,
+                next_billing_date=self.today + timedelta(days=days))
+        self.names = dict(Subscription.objects.values_list(
+            'pk', 'subscription_id'))
+        self.events = []
+        subscriptions_transitioned.connect(self.receive)
+        self.addCleanup(subscriptions_transitioned.disconnect, self.receive)
+
+    def receive(self, sender, source, target, subscription_ids, **kwargs):
+        self.events.append((source, target, sorted(
+            self.names[pk] for pk in subscription_ids)))
+
+    def statuses(self):
+        return list(Subscription.objects.order_by('pk').values_list(
+            'status', flat=True))
+
+    def test_table(self):
+        self.assertTrue(can_transition(PENDING, ACTIVE))
+        self.assertTrue(can_transition(PAST_DUE, ACTIVE))
+        self.assertFalse(can_transition(EXPIRED, ACTIVE))
+        self.assertFalse(can_transition(PENDING, PAST_DUE))
+        self.assertRaises(InvalidTransition, apply_transitions,
+                          [(CANCELED, ACTIVE, None)])
+
+    def test_sweep(self):
+        # Per rule, one read and one update, in a savepoint
+        with self.assertNumQueries(2 * 2 + 2):
+            moved = sweep(self.today, grace_days=14)
+        self.assertEqual(moved, {(ACTIVE, PAST_DUE): 1,
+                                 (PAST_DUE, EXPIRED): 2})
+        self.assertEqual(self.statuses(), [
+            PENDING, ACTIVE, PAST_DUE, PAST_DUE, EXPIRED, EXPIRED, EXPIRED,
+            CANCELED])
+        # Receivers are notified once the transaction commits
+        self.assertEqual(self.events, [])
+        run_on_commit()
+        self.assertEqual(self.events, [
+            (ACTIVE, PAST_DUE, ["s2"]),
+            (PAST_DUE, EXPIRED, ["s4", "s5"]),
+        ])
+        self.assertEqual(sweep(self.today, grace_days=14), {})
+
+    def test_command(self):
+        out = StringIO()
+        call_command("plans_sweep", "--date=2020-03-10", "--grace-days=25",
+                     stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), [
+            "active -> past_due: 1",
+            "past_due -> expired: 1",
+        ])
+
+    def test_rule_order(self):
+        # Rows moved by a rule are not moved again by the next ones
+        moved = apply_transitions([
+            (ACTIVE, PAST_DUE, None),
+            (PAST_DUE, EXPIRED, None),
+            (PENDING, ACTIVE, Q(subscription_id="s0")),
+            (PENDING, CANCELED, None),
+        ])
+        self.assertEqual(moved, {(ACTIVE, PAST_DUE): 2,
+                                 (PAST_DUE, EXPIRED): 3,
+                                 (PENDING, ACTIVE): 1})
+        self.assertEqual(self.statuses(), [
+            ACTIVE, PAST_DUE, PAST_DUE, EXPIRED, EXPIRED, EXPIRED, EXPIRED,
+            CANCELED])
+        run_on_commit()
+        self.assertEqual(self.events, [
+            (ACTIVE, PAST_DUE, ["s1", "s2"]),
+            (PAST_DUE, EXPIRED, ["s3", "s4", "s5"]),
+            (PENDING, ACTIVE, ["s0"]),
+        ])
+
+    def test_same_modified(self):
+        # Subscriptions saved with the timestamp of the update are moved
+        modified = Subscription.objects.get(subscription_id="s3").modified
+        moved = apply_transitions([
+            (ACTIVE, PAST_DUE, None),
+            (PAST_DUE, EXPIRED, None),
+        ], modified=modified)
+        self.assertEqual(moved, {(ACTIVE, PAST_DUE): 2,
+                                 (PAST_DUE, EXPIRED): 3})
+
+    def test_cycle(self):
+        with self.assertRaises(InvalidTransition):
+            apply_transitions([
+                (ACTIVE, PAST_DUE, None),
+                (PAST_DUE, ACTIVE, None),
+            ])
+        self.assertEqual(self.statuses()[1:4], [ACTIVE, ACTIVE, PAST_DUE])
+
+    def test_first_rule_applies(self):
+        moved = apply_transitions([
+            (PAST_DUE, EXPIRED, Q(subscription_id="s3")),
+            (PAST_DUE, ACTIVE, None),
+            (PAST_DUE, CANCELED, None),
+        ])
+        self.assertEqual(moved, {(PAST_DUE, EXPIRED): 1,
+                                 (PAST_DUE, ACTIVE): 2})
+
+    def test_without_receivers(self):
+        subscriptions_transitioned.disconnect(self.receive)
+        entitlement_map.reset()
+        # One update per source status in a savepoint, the subscriptions
+        # are not read
+        with self.assertNumQueries(3 + 2):
+            moved = transition(Subscription.objects.all(), CANCELED)
+        self.assertEqual(sum(moved.values()), 6)
+        self.assertEqual(set(self.statuses()), set([EXPIRED, CANCELED]))
+        run_on_commit()
+        self.assertEqual(self.events, [])
+
+    def test_cancel(self):
+        subscription = Subscription.objects.get(subscription_id="s1")
+        vault = subscription.user_vault
+        self.assertEqual(vault.subscription, subscription)
+        vault.unsubscribe()
+        self.assertEqual(Subscription.objects.get(pk=subscription.pk).status,
+                         CANCELED)
+        vault = UserVault.objects.get(pk=vault.pk)
+        self.assertRaises(NotSubscribedError, vault.unsubscribe)
+        self.assertRaises(InvalidTransition, subscription.cancel)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date, timedelta
+from importlib import import_module
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from six import StringIO
+
+from plans.gateway.dummy import DummyGateway
+from plans.models import PaymentLog, Plan, Subscription, UserVault
+from plans.proration import subscribe
+from plans.trials import convert_trials
+
+
+class TrialTests(TestCase):
+
+    def setUp(self):
+        self.today = date(2020, 3, 10)
+        self.plan = Plan.objects.create(
+            name="Trial", plan_id="trial", price="9.90", trial_period=True,
+            trial_period_amount=14, trial_period_unit="day")
+        self.basic = Plan.objects.create(name="Basic", plan_id="basic",
+                                         price="9.90")
+
+    def create(self, name, start_date, token="tok", plan=None,
+               status=Subscription.PENDING):
+        user = User.objects.create(username=name)
+        vault = UserVault.objects.create(user=user, vault_id=name,
+                                         token=token)
+        return Subscription.objects.create(
+            subscription_id=name, user_vault=vault, plan=plan or self.plan,
+            status=status, start_date=start_date)
+
+    def test_trial_end(self):
+        self.assertEqual(self.plan.trial_end(date(2020, 2, 20)),
+                         date(2020, 3, 5))
+        self.plan.trial_period_amount, self.plan.trial_period_unit = 1, "month"
+        self.assertEqual(self.plan.trial_end(date(2020, 1, 31)),
+                         date(2020, 2, 29))
+        self.assertIsNone(self.basic.trial_end(date(2020, 1, 31)))
+        # No unit, no trial
+        self.plan.trial_period_unit = None
+        self.assertIsNone(self.plan.trial_end(date(2020, 1, 31)))
+        self.plan.save()
+        trial = self.create("s1", date(2020, 3, 1))
+        self.assertIsNone(trial.trial_end_date)
+        self.assertFalse(trial.is_trial())
+
+    def test_trial_end_date(self):
+        trial = self.create("s1", date(2020, 3, 1))
+        self.assertEqual(trial.trial_end_date, date(2020, 3, 15))
+        self.assertEqual(trial.first_billing_date, date(2020, 3, 15))
+        self.assertTrue(trial.is_trial())
+        subscription = self.create("s2", date(2020, 3, 1), plan=self.basic)
+        self.assertIsNone(subscription.trial_end_date)
+        self.assertEqual(subscription.first_billing_date, date(2020, 3, 1))
+        self.assertFalse(subscription.is_trial())
+
+    def test_migration(self):
+        migration = import_module(
+            "plans.migrations.0008_subscription_trial_end_date")
+        self.create("s1", date(2020, 3, 1))
+        self.create("s2", date(2020, 3, 2))
+        self.create("s3", date(2020, 3, 1), plan=self.basic)
+        no_unit = Plan.objects.create(
+            name="No unit", plan_id="no-unit", price="9.90",
+            trial_period=True, trial_period_amount=14)
+        self.create("s4", date(2020, 3, 1), plan=no_unit)
+        Subscription.objects.update(trial_end_date=None)
+        migration.compute_trial_end_dates(apps, None)
+        self.assertEqual(dict(Subscription.objects.values_list(
+            'subscription_id', 'trial_end_date')), {
+            "s1": date(2020, 3, 15),
+            "s2": date(2020, 3, 16),
+            "s3": None,
+            "s4": None,
+        })
+
+    def test_subscribe(self):
+        user = User.objects.create(username="user")
+        vault = UserVault.objects.create(user=user, vault_id="v1")
+        # Not charged
+        subscription = subscribe(vault, self.plan, self.today,
+                                 DummyGateway(declined_vaults=["v1"]))
+        self.assertEqual(subscription.status, Subscription.PENDING)
+        self.assertEqual(subscription.trial_end_date, date(2020, 3, 24))
+        self.assertIsNone(subscription.next_billing_date)
+        self.assertFalse(PaymentLog.objects.exists())
+
+    def test_convert(self):
+        start = self.today - timedelta(days=14)
+        self.create("ended", start)
+        self.create("no_token", start, token="")
+        self.create("late", start - timedelta(days=5))
+        self.create("too_late", start - timedelta(days=40))
+        self.create("running", start + timedelta(days=1))
+        self.create("canceled", start, status=Subscription.CANCELED)
+        scheduler = convert_trials(self.today, chunk_size=1)
+        self.assertEqual((scheduler.converted, scheduler.expired), (2, 1))
+        self.assertEqual(dict(Subscription.objects.values_list(
+            'subscription_id', 'status')), {
+            "ended": Subscription.ACTIVE,
+            "no_token": Subscription.EXPIRED,
+            "late": Subscription.ACTIVE,
+            "too_late": Subscription.PENDING,
+            "running": Subscription.PENDING,
+            "canceled": Subscription.CANCELED,
+        })
+        converted = Subscription.objects.get(subscription_id="late")
+        self.assertEqual(converted.next_billing_date,
+                         converted.trial_end_date)
+        self.assertEqual(convert_trials(self.today).converted, 0)
+
+    def test_index(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("SQLite query plan")
+        sql, params = Subscription.objects.trials_ending(
+            self.today, since=self.today).query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            plan = " ".join(row[-1] for row in cursor.fetchall())
+        self.assertIn("USING INDEX plans_subsc_status_bed41a_idx", plan)
+
+    def test_command(self):
+        self.create("ended", self.today - timedelta(days=14))
+        out = StringIO()
+        call_command("plans_trials", "--date", "2020-03-10", stdout=out)
+        self.assertEqual(out.getvalue().strip(), "1 converted, 0 expired")
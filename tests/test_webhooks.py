@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from six import StringIO
+
+from plans.gateway import base
+from plans.gateway.base import InvalidWebhook
+from plans.gateway.dummy import DummyGateway
+from plans.models import (
+    PaymentLog,
+    Plan,
+    Subscription,
+    UserVault,
+    WebhookCursor,
+    WebhookEvent,
+)
+from plans.webhooks import (
+    WebhookProcessor,
+    coalesce_status,
+    enqueue_events,
+)
+
+
+ACTIVE, PAST_DUE, PENDING, CANCELED = (
+    Subscription.ACTIVE,
+    Subscription.PAST_DUE,
+    Subscription.PENDING,
+    Subscription.CANCELED,
+)
+
+
+def event(event_id, kind, subscription_id, **kwargs):
+    data = {"id": event_id, "kind": kind, "subscription_id": subscription_id}
+    data.update(kwargs)
+    return data
+
+
+def gateway_events(*events):
+    request = RequestFactory().post("/", json.dumps(events),
+                                    content_type="application/json")
+    return DummyGateway().parse_webhook(request)
+
+
+class DummyWebhookTests(TestCase):
+
+    def setUp(self):
+        self.gateway = DummyGateway(webhook_secret="secret")
+        self.body = json.dumps([event(
+            "e1", base.CHARGED, "s1", transaction_id="t1", amount="9.90",
+            next_billing_date="2020-04-01")]).encode("utf-8")
+
+    def post(self, body, signature):
+        return RequestFactory().post("/", body,
+                                     content_type="application/json",
+                                     HTTP_X_SIGNATURE=signature)
+
+    def test_parse(self):
+        request = self.post(self.body, self.gateway.sign_webhook(self.body))
+        parsed, = self.gateway.parse_webhook(request)
+        self.assertEqual(parsed.event_id, "e1")
+        self.assertEqual(parsed.kind, base.CHARGED)
+        self.assertEqual(parsed.amount, Decimal("9.90"))
+        self.assertEqual(parsed.currency, "USD")
+        self.assertEqual(parsed.next_billing_date, date(2020, 4, 1))
+
+    def test_invalid(self):
+        self.assertRaises(InvalidWebhook, self.gateway.parse_webhook,
+                          self.post(self.body, "0" * 64))
+        for body in [b"[", b'[{"id": "e1"}]',
+                     b'[{"id": "e1", "kind": "x", "subscription_id": "s"}]']:
+            self.assertRaises(InvalidWebhook, self.gateway.parse_webhook,
+                              self.post(body, self.gateway.sign_webhook(body)))
+
+
+@override_settings(PLANS={
+    "BILLING_GATEWAY": "plans.gateway.dummy.DummyGateway",
+})
+class WebhookViewTests(TestCase):
+
+    def post(self, *events):
+        return self.client.post("/plans/webhook/", json.dumps(events),
+                                content_type="application/json")
+
+    def test_enqueue(self):
+        response = self.post(event("e1", base.ACTIVATED, "s1"),
+                             event("e2", base.CANCELED, "s1"))
+        self.assertEqual(response.status_code, 200)
+        # Replayed
+        self.assertEqual(self.post(event("e2", base.CANCELED, "s1"),
+                                   event("e3", base.EXPIRED, "s2"),
+                                   ).status_code, 200)
+        self.assertEqual(list(WebhookEvent.objects.order_by('pk').values_list(
+            'provider', 'event_id', 'kind')), [
+            ("Dummy Gateway", "e1", base.ACTIVATED),
+            ("Dummy Gateway", "e2", base.CANCELED),
+            ("Dummy Gateway", "e3", base.EXPIRED),
+        ])
+
+    def test_invalid(self):
+        response = self.client.post("/plans/webhook/", "[",
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get("/plans/webhook/").status_code, 405)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+
+class EnqueueTests(TestCase):
+
+    def test_deduplicated(self):
+        events = gateway_events(event("e1", base.ACTIVATED, "s1"),
+                                event("e2", base.CANCELED, "s1"),
+                                event("e1", base.ACTIVATED, "s1"))
+        self.assertEqual(enqueue_events("dummy", events), 2)
+        self.assertEqual(enqueue_events("dummy", events), 0)
+        # Event ids are unique per provider
+        self.assertEqual(enqueue_events("other", events[:1]), 1)
+        self.assertEqual(WebhookEvent.objects.count(), 3)
+
+    def test_queries(self):
+        events = gateway_events(*[event("e%s" % i, base.ACTIVATED, "s1")
+                                  for i in range(50)])
+        # Lookup and insert, the insert in a savepoint
+        with self.assertNumQueries(4):
+            self.assertEqual(enqueue_events("dummy", events), 50)
+
+
+class CoalesceTests(TestCase):
+
+    def test_coalesce_status(self):
+        self.assertEqual(coalesce_status(
+            ACTIVE, [base.DECLINED, base.CHARGED]), ACTIVE)
+        self.assertEqual(coalesce_status(
+            ACTIVE, [base.DECLINED, base.DECLINED]), PAST_DUE)
+        self.assertEqual(coalesce_status(
+            PAST_DUE, [base.CANCELED, base.CHARGED]), CANCELED)
+        self.assertEqual(coalesce_status(
+            PENDING, [base.ACTIVATED, base.DECLINED]), ACTIVE)
+        self.assertEqual(coalesce_status(
+            CANCELED, [base.ACTIVATED]), CANCELED)
+        self.assertEqual(coalesce_status(ACTIVE, []), ACTIVE)
+
+
+class WebhookProcessorTests(TestCase):
+
+    def setUp(self):
+        self.plan = Plan.objects.create(name="Basic", plan_id="basic",
+                                        price="9.90")
+
+    def subscribe(self, count, status=ACTIVE):
+        start = Subscription.objects.count()
+        for i in range(start, start + count):
+            user = User.objects.create(username="user%s" % i)
+            vault = UserVault.objects.create(user=user, vault_id="v%s" % i)
+            Subscription.objects.create(
+                subscription_id="s%s" % i, user_vault=vault, plan=self.plan,
+                status=status, next_billing_date=date(2020, 3, 1))
+
+    def receive(self, *events):
+        return enqueue_events("dummy", gateway_events(*events))
+
+    def process(self, **kwargs):
+        kwargs.setdefault("delay", 0)
+        return WebhookProcessor(**kwargs).run()
+
+    def subscriptions(self):
+        return dict((sid, (status, billing_date)) for sid, status, billing_date
+                    in Subscription.objects.values_list(
+                        'subscription_id', 'status', 'next_billing_date'))
+
+    def test_process(self):
+        self.subscribe(3)
+        self.subscribe(1, PENDING)
+        vault = UserVault.objects.get(vault_id="v0")
+        PaymentLog.objects.create(vault=vault, transaction_id="t0",
+                                  amount="9.90")
+        self.receive(
+            # Declined, then charged on retry
+            event("e1", base.DECLINED, "s0"),
+            event("e2", base.CHARGED, "s0", transaction_id="t1",
+                  amount="9.90", next_billing_date="2020-04-01"),
+            # Charge logged by the billing run
+            event("e3", base.CHARGED, "s0", transaction_id="t0",
+                  amount="9.90", next_billing_date="2020-04-01"),
+            event("e4", base.DECLINED, "s1"),
+            event("e5", base.DECLINED, "s1"),
+            event("e6", base.CANCELED, "s2"),
+            event("e7", base.CHARGED, "s2", transaction_id="t2",
+                  amount="9.90"),
+            event("e8", base.ACTIVATED, "s3"),
+            event("e9", base.CANCELED, "unknown"),
+        )
+        processor = self.process(batch_size=4)
+        self.assertEqual(processor.events, 9)
+        self.assertEqual(processor.transitions, 3)
+        self.assertEqual(processor.billing_dates, 1)
+        self.assertEqual(processor.payments, 2)
+        self.assertEqual(processor.unknown, 1)
+        self.assertEqual(self.subscriptions(), {
+            "s0": (ACTIVE, date(2020, 4, 1)),
+            "s1": (PAST_DUE, date(2020, 3, 1)),
+            "s2": (CANCELED, date(2020, 3, 1)),
+            "s3": (ACTIVE, date(2020, 3, 1)),
+        })
+        self.assertEqual(sorted(PaymentLog.objects.values_list(
+            'transaction_id', 'vault__vault_id')), [
+            ("t0", "v0"), ("t1", "v0"), ("t2", "v2")])
+        self.assertEqual(WebhookCursor.objects.get().last_event_id,
+                         WebhookEvent.objects.latest('pk').pk)
+        # Processed once
+        self.assertEqual(self.process().events, 0)
+        self.receive(event("e10", base.CANCELED, "s0"))
+        self.assertEqual(self.process().events, 1)
+        self.assertEqual(self.subscriptions()["s0"][0], CANCELED)
+
+    def test_delay(self):
+        self.subscribe(1)
+        self.receive(event("e1", base.CANCELED, "s0"))
+        self.assertEqual(self.process(delay=60).events, 0)
+        self.assertEqual(self.process().events, 1)
+
+    def test_delay_out_of_order(self):
+        # An event received after a later id stops the batch, the events
+        # after it are applied once it is old enough
+        self.subscribe(2)
+        self.receive(event("e1", base.CANCELED, "s0"),
+                     event("e2", base.CANCELED, "s1"))
+        first, second = WebhookEvent.objects.order_by('pk')
+        WebhookEvent.objects.filter(pk=second.pk).update(
+            received=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(self.process(delay=60).events, 0)
+        WebhookEvent.objects.filter(pk=first.pk).update(
+            received=timezone.now() - timedelta(minutes=2))
+        self.assertEqual(self.process(delay=60).events, 2)
+        self.assertEqual(self.subscriptions()["s1"][0], CANCELED)
+
+    def test_queries_per_batch(self):
+        """
+        A batch of events takes the same number of queries whatever the
+        number of subscriptions and events.
+        """
+        WebhookCursor.objects.create(name="default")
+        counts = []
+        for size in (5, 100):
+            self.subscribe(size)
+            start = Subscription.objects.count() - size
+            events = []
+            for i in range(start, start + size):
+                events += [
+                    event("d%s" % i, base.DECLINED, "s%s" % i),
+                    event("c%s" % i, base.CHARGED, "s%s" % i,
+                          transaction_id="t%s" % i, amount="9.90",
+                          next_billing_date="2020-04-01"),
+                    event("x%s" % i, base.CANCELED, "s%s" % i),
+                ]
+            self.receive(*events)
+            with CaptureQueriesContext(connection) as queries:
+                processor = self.process()
+            self.assertEqual(processor.transitions, size)
+            self.assertEqual(processor.payments, size)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_command(self):
+        self.subscribe(1)
+        self.receive(event("e1", base.CANCELED, "s0"))
+        out = StringIO()
+        call_command("plans_process_webhooks", delay=0, stdout=out)
+        self.assertEqual(out.getvalue().strip(),
+                         "1 events: 1 transitions, 0 billing dates, "
+                         "0 payments, 0 unknown")
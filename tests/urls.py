@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+from django.conf.urls import include, url
+from django.contrib import admin
+
+
+urlpatterns = [
+    url(r'^admin/', admin.site.urls),
+    url(r'^plans/', include('plans.urls')),
+]
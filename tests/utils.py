@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+
+from django.db import connection
+
+
+def run_on_commit():
+    """
+    Runs the transaction.on_commit() callbacks registered so far, as the
+    transaction of a TestCase is never committed.
+    """
+    callbacks, connection.run_on_commit = connection.run_on_commit, []
+    for entry in callbacks:
+        # (savepoint ids, callback), followed by the robust flag since
+        # Django 4.2
+        callback = entry[1]
+        callback()